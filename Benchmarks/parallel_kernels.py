@@ -0,0 +1,47 @@
+"""Measure how the prange kernels scale with the number of threads.
+
+Run from the repository root with: python -m Benchmarks.parallel_kernels [N]
+"""
+import sys
+from timeit import timeit
+
+from numba import config
+
+from epyr.circuit import Circuit
+from epyr.state import State
+
+TRIALS = 3
+
+
+def layered_circuit(N, depth=4):
+    """Layers of Hadamards on every qubit, followed by a chain of CNOTs."""
+    c = Circuit(N)
+    for _ in range(depth):
+        for i in range(N):
+            c.h(i)
+        for i in range(N - 1):
+            c.cnot(i, i + 1)
+    return c
+
+
+def time_compute(c, **kwargs):
+    """Return the mean time in seconds taken by c.compute on a fresh state, excluding compilation."""
+    c.compute(State(c.N), **kwargs)
+    return timeit(lambda: c.compute(State(c.N), **kwargs), number=TRIALS) / TRIALS
+
+
+def main(N=22):
+    c = layered_circuit(N)
+    print(f"N = {N}")
+    print(f"{'threads':>8} {'parallel (s)':>13} {'speedup':>9}")
+    single_thread = None
+    num_threads = 1
+    while num_threads <= config.NUMBA_NUM_THREADS:
+        parallel = time_compute(c, parallel=True, num_threads=num_threads)
+        single_thread = single_thread or parallel
+        print(f"{num_threads:>8} {parallel:>13.4f} {single_thread / parallel:>8.1f}x")
+        num_threads *= 2
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,139 @@
+"""Offline benchmark suite for EPyR. Times Circuit.compute on random circuits of 1-qubit gates, 2-qubit gates and a mix
+of both, across qubit counts and execution modes, as well as sampling and unitary construction, and writes the results
+to a JSON file so that releases can be compared.
+
+Run from the repository root with, e.g.:
+    python -m Benchmarks.suite --min-qubits 10 --max-qubits 28 --output benchmark.json
+"""
+import argparse
+import json
+import platform
+import time
+from datetime import datetime
+
+import numba
+import numpy as np
+
+from epyr.circuit import Circuit, warm_up
+from epyr.state import State
+
+GATE_MIXES = ["one_qubit", "two_qubit", "mixed"]
+MODES = dict({
+    "numba": dict(),
+    "python": dict(enable_numba=False),
+    "parallel": dict(parallel=True),
+    "vectorized": dict(vectorize=True),
+})
+ONE_QUBIT_GATES = ["X", "Y", "Z", "H", "S", "T"]
+
+
+def random_circuit(N, depth, gate_mix, seed=0):
+    """Return an N qubit circuit with DEPTH * N random gates. GATE_MIX is one of GATE_MIXES."""
+    rng = np.random.default_rng(seed)
+    c = Circuit(N)
+    for _ in range(depth * N):
+        two_qubit = gate_mix == "two_qubit" or (gate_mix == "mixed" and rng.random() < 0.5)
+        if two_qubit and N > 1:
+            control, target = rng.choice(N, 2, replace=False)
+            c.cnot(int(control), int(target))
+        else:
+            c.add(ONE_QUBIT_GATES[rng.integers(len(ONE_QUBIT_GATES))], int(rng.integers(N)))
+    return c
+
+
+def best_time(f, repeats):
+    """Return the shortest of REPEATS wall-clock timings of f(), in seconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compute_benchmarks(Ns, depth, repeats, max_python_qubits):
+    """Time Circuit.compute for every gate mix, qubit count and mode."""
+    results = []
+    for gate_mix in GATE_MIXES:
+        for N in Ns:
+            c = random_circuit(N, depth, gate_mix)
+            for mode, options in MODES.items():
+                if mode == "python" and N > max_python_qubits:
+                    continue
+                seconds = best_time(lambda: c.compute(State(N), **options), repeats)
+                results.append(dict(benchmark="compute", gate_mix=gate_mix, mode=mode, N=N,
+                                    gates=len(c.gates), fused_gates=len(c.fused_gates), seconds=seconds))
+                print(f"compute  {gate_mix:>9} {mode:>10} N={N:<3} {seconds:.5f} s")
+    return results
+
+
+def sampling_benchmarks(Ns, shots, repeats):
+    """Time Circuit.sample and Circuit.measure on the output state of a mixed circuit."""
+    results = []
+    for N in Ns:
+        c = random_circuit(N, 1, "mixed")
+        s = State(N)
+        c.compute(s)
+        seconds = best_time(lambda: c.sample(s, shots, seed=0), repeats)
+        results.append(dict(benchmark="sample", N=N, shots=shots, seconds=seconds))
+        print(f"sample   {shots} shots N={N:<3} {seconds:.5f} s")
+        seconds = best_time(lambda: c.measure(s), repeats)
+        results.append(dict(benchmark="measure", N=N, seconds=seconds))
+        print(f"measure  N={N:<3} {seconds:.5f} s")
+    return results
+
+
+def unitary_benchmarks(Ns, depth, repeats):
+    """Time the construction of the dense unitary of a mixed circuit."""
+    results = []
+    for N in Ns:
+        c = random_circuit(N, depth, "mixed")
+        seconds = best_time(c.unitary, repeats)
+        results.append(dict(benchmark="unitary", N=N, gates=len(c.gates), seconds=seconds))
+        print(f"unitary  N={N:<3} {seconds:.5f} s")
+    return results
+
+
+def environment():
+    """Describe the machine and library versions the benchmarks ran with."""
+    return dict(
+        timestamp=datetime.now().isoformat(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        processor=platform.processor(),
+        numpy=np.__version__,
+        numba=numba.__version__,
+        numba_threads=numba.config.NUMBA_NUM_THREADS,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-qubits", type=int, default=10)
+    parser.add_argument("--max-qubits", type=int, default=28)
+    parser.add_argument("--step", type=int, default=2)
+    parser.add_argument("--depth", type=int, default=4, help="random gates per qubit")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--shots", type=int, default=100000)
+    parser.add_argument("--max-python-qubits", type=int, default=14,
+                        help="largest circuit to run with Numba disabled")
+    parser.add_argument("--max-unitary-qubits", type=int, default=10)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    Ns = list(range(args.min_qubits, args.max_qubits + 1, args.step))
+    unitary_Ns = [N for N in Ns if N <= args.max_unitary_qubits]
+    # Keep compilation out of the timings.
+    warm_up()
+
+    results = compute_benchmarks(Ns, args.depth, args.repeats, args.max_python_qubits)
+    results += sampling_benchmarks(Ns, args.shots, args.repeats)
+    results += unitary_benchmarks(unitary_Ns, args.depth, args.repeats)
+
+    with open(args.output, "w") as f:
+        json.dump(dict(environment=environment(), arguments=vars(args), results=results), f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Compare the vectorized (tensordot) kernel against the loop kernels with Numba disabled.
+
+Run from the repository root with: python -m Benchmarks.vectorized_kernels
+"""
+from timeit import timeit
+
+from epyr.circuit import Circuit
+from epyr.state import State
+
+TRIALS = 3
+NS = range(8, 17, 2)
+
+
+def ghz_circuit(N):
+    """A Hadamard followed by a chain of CNOTs, as in scratchwork/numba_test.ipynb."""
+    c = Circuit(N)
+    c.h(0)
+    for i in range(1, N):
+        c.cnot(0, i)
+    return c
+
+
+def time_compute(c, **kwargs):
+    """Return the mean time in seconds taken by c.compute on a fresh state."""
+    return timeit(lambda: c.compute(State(c.N), **kwargs), number=TRIALS) / TRIALS
+
+
+def main():
+    print(f"{'N':>3} {'loop (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for N in NS:
+        c = ghz_circuit(N)
+        loop = time_compute(c, enable_numba=False)
+        vectorized = time_compute(c, vectorize=True)
+        print(f"{N:>3} {loop:>12.5f} {vectorized:>15.5f} {loop / vectorized:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
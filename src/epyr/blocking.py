@@ -0,0 +1,160 @@
+import numpy as np
+
+from .compiled import CompiledCircuit
+from .fusion import embed_gate
+from .operators import SWAP, sort_gate_qubits, PERMUTATION
+from .epyr_exception import EpyrException
+
+# The size in bytes of the blocks of the state vector, about that of the L2 cache of a core.
+BLOCK_BYTES = 1 << 18
+# The largest number of qubit swaps merged into one permutation gate, i.e. one pass over the state vector.
+MAX_SWAPS_PER_PASS = 3
+
+
+class BlockedCircuit:
+    """A list of gates scheduled into passes over the state vector, so that each pass applies many gates while the
+    state streams through the cache once, rather than once per gate.
+
+    The lowest BLOCK_QUBITS qubits of the state vector are local to its blocks of 2^BLOCK_QUBITS consecutive
+    amplitudes. A block pass applies a run of gates acting on local qubits only, to one block after another (see
+    kernels.run_program_blocked). Gates commute past the gates on other qubits, so a block pass collects every gate
+    whose qubits are all local, and which only follows gates in the pass or on other qubits. A gate on a higher qubit is
+    preceded by a swap pass, which exchanges that qubit with the local qubit used furthest in the future, and the
+    circuit keeps track of the resulting layout, as DistributedState does. Final swap passes restore the layout."""
+
+    def __init__(self, gates, N, dtype, block_qubits=None):
+        """Schedule GATES, a list of (gate, indices, kind) tuples of an N qubit circuit of the given DTYPE, into
+        passes over blocks of 2^BLOCK_QUBITS amplitudes (by default, as many as fit into BLOCK_BYTES)."""
+        if block_qubits is None:
+            block_qubits = int(np.log2(BLOCK_BYTES // np.dtype(dtype).itemsize))
+        self.N = N
+        self.block_qubits = min(block_qubits, N)
+        self.num_gates = len(gates)
+        # The passes, as ("block", gates on the block's qubits, their CompiledCircuit) or ("swap", [a single
+        # permutation gate on the state vector], its CompiledCircuit) tuples.
+        self.passes = []
+        for kind, entries in schedule_passes(gates, N, self.block_qubits):
+            width = self.block_qubits if kind == "block" else N
+            self.passes.append((kind, entries, CompiledCircuit(entries, width, dtype)))
+
+    @property
+    def num_passes(self):
+        """Return the number of passes over the state vector."""
+        return len(self.passes)
+
+    @property
+    def num_swap_passes(self):
+        """Return the number of passes which only swap qubits."""
+        return sum(kind == "swap" for kind, _, _ in self.passes)
+
+    def run(self, state_vector, enable_numba=True):
+        """Apply the scheduled gates to STATE_VECTOR, in place, one pass after another. Unless ENABLE_NUMBA is False,
+        every pass is a single call of a compiled kernel; otherwise, the gates are applied one block at a time with the
+        plain Python kernels, see circuit.apply_gate_in_place."""
+        from .circuit import select_kernel, apply_gate_in_place
+        if not enable_numba:
+            block = 1 << self.block_qubits
+            for kind, entries, _ in self.passes:
+                if kind == "swap":
+                    gate, indices, gate_kind = entries[0]
+                    apply_gate_in_place(state_vector, gate, indices, gate_kind, self.N, False)
+                    continue
+                for start in range(0, len(state_vector), block):
+                    for gate, indices, gate_kind in entries:
+                        apply_gate_in_place(state_vector[start:start + block], gate, indices, gate_kind,
+                                            self.block_qubits, False)
+            return
+        run_program = select_kernel("run_program", True)
+        run_program_blocked = select_kernel("run_program_blocked", True)
+        for kind, _, program in self.passes:
+            arrays = (program.opcodes, program.target_pointers, program.targets, program.integer_pointers,
+                      program.integers, program.value_pointers, program.values)
+            if kind == "block":
+                run_program_blocked(state_vector, *arrays, self.block_qubits)
+            else:
+                run_program(state_vector, *arrays, self.N)
+
+    def __repr__(self):
+        return f"BlockedCircuit - {self.num_gates} gates in {self.num_passes} passes ({self.num_swap_passes} swaps)"
+
+
+def schedule_passes(gates, N, block_qubits):
+    """Return the passes of GATES over an N qubit state vector with blocks of 2^BLOCK_QUBITS amplitudes, as ("block",
+    gates) and ("swap", [permutation gate]) tuples, in which all gates act on physical qubits. See BlockedCircuit."""
+    # The physical qubit holding each logical qubit.
+    layout = list(range(N))
+    remaining = list(gates)
+    passes = []
+    while remaining:
+        local, deferred = [], []
+        # The qubits of the deferred gates, which no later gate of this pass may act on.
+        blocked = set()
+        for entry in remaining:
+            gate, indices, kind = entry
+            if len(indices) > block_qubits:
+                raise EpyrException("A gate acts on more qubits than a block holds.")
+            physical = [layout[q] for q in indices]
+            if blocked.isdisjoint(indices) and max(physical) < block_qubits:
+                physical, gate = sort_gate_qubits(gate, physical)
+                local.append((gate, physical, kind))
+            else:
+                deferred.append(entry)
+                blocked.update(indices)
+        if local:
+            passes.append(("block", local))
+            remaining = deferred
+            continue
+
+        # The first remaining gate acts on high qubits. Its high qubits, and those of the next gates, as many as a swap
+        # pass takes, are swapped with the local qubits needed last.
+        high, needed = [], set()
+        for _, indices, _ in remaining:
+            gate_high = [q for q in indices if layout[q] >= block_qubits and q not in high]
+            if high and (len(high) + len(gate_high) > MAX_SWAPS_PER_PASS or
+                         len(needed | set(indices)) > block_qubits):
+                break
+            high.extend(gate_high)
+            needed.update(indices)
+        next_use = dict()
+        for position, (_, indices, _) in enumerate(remaining):
+            for q in indices:
+                next_use.setdefault(q, position)
+        candidates = [q for q in range(N) if layout[q] < block_qubits and q not in needed]
+        candidates.sort(key=lambda q: -next_use.get(q, len(remaining)))
+        swaps = [(layout[q], layout[low]) for q, low in zip(high, candidates)]
+        for a, b in swaps:
+            swap_layout(layout, a, b)
+        passes.extend(swap_passes(swaps))
+
+    # Restore the layout, so that logical qubit q is physical qubit q again.
+    swaps = []
+    for p in range(N):
+        if layout[p] != p:
+            swaps.append((p, layout[p]))
+            swap_layout(layout, p, layout[p])
+    passes.extend(swap_passes(swaps))
+    return passes
+
+
+def swap_layout(layout, a, b):
+    """Record in LAYOUT that the physical qubits A and B have been swapped."""
+    holder_a, holder_b = layout.index(a), layout.index(b)
+    layout[holder_a], layout[holder_b] = b, a
+
+
+def swap_passes(swaps):
+    """Return the swap passes applying SWAPS, a list of pairs of physical qubits, in order: runs of up to
+    MAX_SWAPS_PER_PASS disjoint swaps are merged into one permutation gate."""
+    passes, run = [], []
+    for swap in swaps + [None]:
+        if swap is None or len(run) == MAX_SWAPS_PER_PASS or any(set(swap) & set(other) for other in run):
+            if run:
+                qubits = sorted(q for pair in run for q in pair)
+                matrix = np.eye(2 ** len(qubits), dtype=np.complex128)
+                for pair in run:
+                    matrix = embed_gate(SWAP, sorted(pair), qubits) @ matrix
+                passes.append(("swap", [(matrix, qubits, PERMUTATION)]))
+            run = []
+        if swap is not None:
+            run.append(swap)
+    return passes
@@ -0,0 +1,116 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .circuit import apply_gate_in_place
+
+# By default, the state is stored after every this many gates.
+CHECKPOINT_INTERVAL = 16
+
+
+class PrefixCache:
+    """A cache of intermediate state vectors, for circuits which share prefixes of their gates, such as the circuits of
+    a parameter scan which differ in their last gates only. Pass it to Circuit.compute as CACHE.
+
+    The state after the first p gates of a circuit is stored under a key which hashes the input state vector and those
+    p gates (their matrices and qubits), at every multiple of CHECKPOINT_INTERVAL and at the end of the circuit. A
+    computation resumes from the longest prefix found in the cache. Entries are evicted in least recently used order
+    once they take more than MEMORY_BUDGET bytes; if a SPILL_DIRECTORY is given, evicted entries are written there
+    instead of being dropped, and read back on use."""
+
+    def __init__(self, memory_budget=1 << 30, checkpoint_interval=CHECKPOINT_INTERVAL, spill_directory=None):
+        self.memory_budget = memory_budget
+        self.checkpoint_interval = checkpoint_interval
+        self.spill_directory = spill_directory
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+        # Maps keys to state vectors in memory, least recently used first, and keys to the files of spilled entries.
+        self._memory = OrderedDict()
+        self._disk = dict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # The number of gates which did not need to be applied, thanks to cached prefixes.
+        self.gates_skipped = 0
+
+    def compute(self, circuit, state, enable_numba=True):
+        """Apply the gates of CIRCUIT to STATE, resuming from the longest cached prefix, and store the checkpoints of
+        the remaining gates. The gates are applied one by one with the specialised kernels, without fusion, so that
+        the checkpoints fall between the circuit's own gates."""
+        gates = circuit.gates
+        keys = prefix_keys(state.state, gates)
+        checkpoints = sorted(set(range(self.checkpoint_interval, len(gates), self.checkpoint_interval)) | {len(gates)})
+        start = 0
+        for position in reversed(checkpoints):
+            cached = self.get(keys[position])
+            if cached is not None:
+                state.state[:] = cached
+                start = position
+                break
+        if start:
+            self.hits += 1
+            self.gates_skipped += start
+        else:
+            self.misses += 1
+        for checkpoint in checkpoints:
+            if checkpoint <= start:
+                continue
+            for gate, indices, kind in gates[start:checkpoint]:
+                apply_gate_in_place(state.state, gate, indices, kind, circuit.N, enable_numba)
+            self.put(keys[checkpoint], state.state)
+            start = checkpoint
+
+    def get(self, key):
+        """Return the state vector stored under KEY, or None."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if key in self._disk:
+            return np.load(self._disk[key], mmap_mode="r")
+        return None
+
+    def put(self, key, state_vector):
+        """Store a copy of STATE_VECTOR under KEY, evicting the least recently used entries to stay within the memory
+        budget."""
+        if key in self._memory or key in self._disk:
+            return
+        self._memory[key] = state_vector.copy()
+        self.memory_bytes += state_vector.nbytes
+        while self.memory_bytes > self.memory_budget and self._memory:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+            if self.spill_directory is not None:
+                path = os.path.join(self.spill_directory, evicted_key + ".npy")
+                np.save(path, evicted)
+                self._disk[evicted_key] = path
+
+    def clear(self):
+        """Drop all entries, including the spilled ones."""
+        for path in self._disk.values():
+            os.remove(path)
+        self._memory.clear()
+        self._disk.clear()
+        self.memory_bytes = 0
+
+    def __len__(self):
+        return len(self._memory) + len(self._disk)
+
+    def __repr__(self):
+        return f"PrefixCache - {len(self._memory)} entries in memory ({self.memory_bytes} bytes), " \
+               f"{len(self._disk)} on disk, {self.hits} hits, {self.misses} misses"
+
+
+def prefix_keys(state_vector, gates):
+    """Return the keys of all prefixes of GATES applied to STATE_VECTOR: key p hashes the state vector (with its
+    dtype) and the matrices and qubits of the first p gates, as a chain, so that all keys take a single pass."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((state_vector.dtype.str, len(state_vector))).encode())
+    digest.update(np.ascontiguousarray(state_vector).data)
+    keys = [digest.hexdigest()]
+    for gate, indices, _ in gates:
+        digest.update(np.ascontiguousarray(gate).data)
+        digest.update(np.asarray(indices, dtype=np.int64).data)
+        keys.append(digest.hexdigest())
+    return keys
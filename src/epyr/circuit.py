@@ -1,52 +1,255 @@
 import numpy as np
-from numba import njit
-from .state import State
-from .operators import operator_dict, swap_two_qubit_gate
+from .state import State, MemmapState, SparseState, DensityMatrix
+from .operators import operator_dict, swap_two_qubit_gate, sort_gate_qubits, classify_gate, controlled_gate_target, \
+    gate_offsets, rotation_dict, DIAGONAL, PERMUTATION, CONTROLLED
+from .fusion import fuse_gates
+from .unitary import CircuitOperator, circuit_unitary, UNITARY_BLOCK_SIZE
+from .compiled import CompiledCircuit
+from .blocking import BlockedCircuit
+from .stabilizer import StabilizerState, clifford_operations
+from .noise import run_trajectories
+from .parameters import Parameter, ScaledParameter, run_sweep
+from .distributed import DistributedState
+from .mps import MPSState
 from .epyr_exception import EpyrException
 
-ENABLE_NUMBA = True
+# Names of the Numba kernels, which live in the kernels module. They are available as attributes of this module too,
+# but only imported on first access, see __getattr__ below.
+KERNEL_NAMES = [
+    "apply_general_one_qubit_gate_in_place",
+    "apply_general_two_qubit_gate_in_place",
+    "apply_one_qubit_gate_parallel",
+    "apply_two_qubit_gate_parallel",
+    "apply_one_qubit_gate_range",
+    "apply_two_qubit_gate_range",
+    "insert_zero_bits",
+    "apply_diagonal_gate_in_place",
+    "apply_permutation_gate_in_place",
+    "apply_controlled_gate_in_place",
+    "apply_dense_gate_in_place",
+    "run_program",
+    "run_program_blocked",
+    "parity",
+    "pauli_group_expectation",
+    "pauli_group_expectation_parallel",
+]
 
 
 class Circuit:
     """Represents a quantum circuit."""
 
-    def __init__(self, N):
-        """Create an n-qubit quantum circuit."""
+    def __init__(self, N, fusion_width=2, dtype=np.complex64):
+        """Create an n-qubit quantum circuit. Before the circuit is computed, runs of its gates are fused into single
+        gates acting on at most FUSION_WIDTH qubits (see fusion.fuse_gates). DTYPE (complex64 or complex128) sets the
+        precision of the simulation: every gate is cast to it when added, and the states the circuit is computed on
+        must have the same dtype, so that the kernels run in a single dtype."""
         self._n = N
+        self._dtype = np.dtype(dtype)
         self._gates = []
-        # Unitary transform corresponding to the entire circuit.
-        # Note: this is incredibly inefficient.
+        # The noise channels attached to my gates, by the position of the gate, see add_noise().
+        self._noise = dict()
+        # The parameterized rotation gates, as (position, rotation name, parameter, factor) tuples, see add_rotation(),
+        # and the values bound to the parameters, see bind().
+        self._parameter_slots = []
+        self._parameter_values = dict()
+        # The error in the readout of measured qubits, a noise.ReadoutError, or None.
+        self.readout_error = None
+        self._fusion_width = fusion_width
+        # The fused gates, computed on demand and cleared whenever the gates change.
+        self._fused_gates = None
+        # Unitary transform corresponding to the entire circuit, as a lazy operator. See the U property.
         self._U = None
+        # The compiled circuit, with and without fusion, see compile().
+        self._compiled = dict()
+        # The gates scheduled into cache-blocked passes, by fusion and block size, see block().
+        self._blocked = dict()
+        # The Clifford gates my gates are, or False if some are not, see is_clifford. Computed on demand.
+        self._clifford = None
+
+    def _gates_changed(self):
+        """Clear everything derived from my gates."""
+        self._fused_gates = None
+        self._U = None
+        self._compiled = dict()
+        self._blocked = dict()
+        self._clifford = None
 
     @property
     def N(self):
         """Return the number of qubits this circuit acts on."""
         return self._n
 
+    @property
+    def dtype(self):
+        """Return the dtype of my gates, and of the states I can be computed on."""
+        return self._dtype
+
     @property
     def U(self):
+        """Return the unitary transform corresponding to the entire circuit, as a lazy CircuitOperator. It applies the
+        circuit (or its inverse) to vectors on demand, so it does not take O(4^N) memory. Use unitary() for a dense
+        matrix."""
+        if self._U is None:
+            self._U = CircuitOperator(self)
         return self._U
 
+    def unitary(self, block_size=UNITARY_BLOCK_SIZE, processes=None):
+        """Return the unitary transform corresponding to the entire circuit as a dense (2^N x 2^N) matrix. It is built
+        by applying the circuit to blocks of BLOCK_SIZE columns of the identity, optionally on a pool of PROCESSES
+        processes. See unitary.circuit_unitary."""
+        return circuit_unitary(self, block_size, processes)
+
+    def adjoint(self):
+        """Return a new circuit which implements the inverse (Hermitian adjoint) of this circuit. Its gates are
+        copies of mine, so a value must be bound to each of my parameters first."""
+        self._check_bound()
+        inverse = Circuit(self.N, self.fusion_width, self.dtype)
+        for gate, indices, kind in reversed(self._gates):
+            # The adjoint of a gate is of the same kind.
+            inverse._gates.append((np.ascontiguousarray(gate.conj().T), indices, kind))
+        return inverse
+
     @property
     def gates(self):
         """Return a list of tuples, containing the gates this circuit is composed of,
-        as well as the indices of the qubits they act upon. The gates are listed 
-        sequentially, in the order they will be applied."""
+        the indices of the qubits they act upon, and the kind of each gate (see
+        operators.classify_gate). The gates are listed sequentially, in the order
+        they will be applied."""
         return self._gates
 
-    def measure(self, state: State):
+    @property
+    def noise(self):
+        """Return a dictionary mapping the positions of my gates (in the gates property) to the list of (channel,
+        indices) tuples attached to them, which are applied right after the gate, in order. See add_noise()."""
+        return self._noise
+
+    @property
+    def fusion_width(self):
+        """Return the maximum number of qubits a fused gate may act on."""
+        return self._fusion_width
+
+    @fusion_width.setter
+    def fusion_width(self, width):
+        self._fusion_width = width
+        self._gates_changed()
+
+    @property
+    def fused_gates(self):
+        """Return the gates of this circuit after fusion, in the same format as the gates property. These are the
+        gates compute() applies by default."""
+        if self._fused_gates is None:
+            # Parameterized gates are kept apart, so that binding new values does not require fusing again.
+            fixed = {position for position, _, _, _ in self._parameter_slots}
+            self._fused_gates = fuse_gates(self._gates, self._fusion_width, fixed)
+        return self._fused_gates
+
+    def compile(self, fuse=True):
+        """Return my (fused, unless FUSE is False) gates lowered into a CompiledCircuit: packed arrays of opcodes,
+        qubit indices and gate matrices, which a single Numba kernel executes without any per-gate Python dispatch.
+        The result is cached until my gates change, so repeated computations reuse it."""
+        if fuse not in self._compiled:
+            parameterized = [self._gates[position][0] for position, _, _, _ in self._parameter_slots]
+            self._compiled[fuse] = CompiledCircuit(
+                self.fused_gates if fuse else self._gates, self.N, self.dtype, parameterized)
+        return self._compiled[fuse]
+
+    def block(self, fuse=True, block_qubits=None):
+        """Return my (fused, unless FUSE is False) gates scheduled into a BlockedCircuit, which applies runs of gates on
+        the lowest BLOCK_QUBITS qubits one cache-sized block of the state vector at a time, and swaps higher qubits
+        into those positions as needed. The result is cached until my gates change."""
+        key = (fuse, block_qubits)
+        if key not in self._blocked:
+            self._blocked[key] = BlockedCircuit(self.fused_gates if fuse else self._gates, self.N, self.dtype,
+                                                block_qubits)
+        return self._blocked[key]
+
+    def blocking_report(self, fuse=True, block_qubits=None):
+        """Return a dictionary with the number of passes over the state vector per computation: one per (fused) gate
+        without blocking, and those of block(), of which some only swap qubits."""
+        blocked = self.block(fuse, block_qubits)
+        return dict({
+            "gates": blocked.num_gates,
+            "passes": blocked.num_passes,
+            "swap_passes": blocked.num_swap_passes,
+            "passes_saved": blocked.num_gates - blocked.num_passes,
+        })
+
+    def fusion_report(self):
+        """Return a dictionary with the number of gates in this circuit, the number of gates after fusion, and thus the
+        number of sweeps over the state vector fusion saves per computation."""
+        num_gates, num_fused_gates = len(self._gates), len(self.fused_gates)
+        return dict({
+            "gates": num_gates,
+            "fused_gates": num_fused_gates,
+            "sweeps_saved": num_gates - num_fused_gates,
+        })
+
+    @property
+    def is_clifford(self):
+        """Return whether all my gates are Clifford gates (see stabilizer.CLIFFORD_GATES), so that I can be computed on a
+        StabilizerState."""
+        if self._clifford is None:
+            operations = clifford_operations(self._gates)
+            self._clifford = False if operations is None else operations
+        return self._clifford is not False
+
+    def initial_state(self):
+        """Return the state |0...> in the representation best suited to me: a StabilizerState, which takes polynomial
+        time and memory in N, if all my gates are Clifford gates, and a State of my dtype otherwise."""
+        if self.is_clifford:
+            return StabilizerState(self.N)
+        return State(self.N, dtype=self._dtype)
+
+    def measure(self, state: State = None):
         """Perform a complete measurement on the state. Returns the index of the basis state to which the wave-function
-        collapses."""
-        basis_indices = np.arange(2 ** self.N)
-        probabilities = state.probabilities()
-        collapsed_state_index = np.random.choice(
-            basis_indices, p=probabilities)
-        return collapsed_state_index
+        collapses. If no STATE is passed, I am first computed on my initial_state(). My readout_error, if set, is
+        applied to the outcome, unless the state is a StabilizerState or an MPSState."""
+        if state is None:
+            state = self.initial_state()
+            self.compute(state)
+        if isinstance(state, (StabilizerState, MPSState)):
+            return state.measure()
+        if isinstance(state, SparseState) and not state.dense:
+            index = state.indices[sample_basis_indices(np.abs(state.amplitudes) ** 2, 1, np.random)[0]]
+        else:
+            index = sample_basis_indices(state.probabilities(), 1, np.random)[0]
+        if self.readout_error is None:
+            return index
+        return int(self._read_out([index], self.N, np.random.default_rng(np.random.randint(2 ** 31)))[0])
+
+    def sample(self, state: State, shots, seed=None, qubits=None):
+        """Measure SHOTS copies of the state at once, and return a dictionary mapping the basis states observed (as
+        returned by State.basis_vector_string) to the number of times they were observed. The cumulative distribution is
+        computed once, after which all shots are drawn together. If QUBITS is passed, only those qubits are measured,
+        by first marginalizing over all other qubits; bit j of the reported basis states then refers to QUBITS[j].
+        A sparse state is sampled from its nonzero amplitudes only. If STATE is None, I am first computed on my
+        initial_state(), so that Clifford circuits are sampled from a StabilizerState (see StabilizerState.sample).
+        An MPSState is sampled one qubit at a time, without forming its state vector (see MPSState.sample_bits).
+        My readout_error, if set, is applied to the outcomes, unless the state is a StabilizerState or an MPSState."""
+        if state is None:
+            state = self.initial_state()
+            self.compute(state)
+        if isinstance(state, (StabilizerState, MPSState)):
+            return state.sample(shots, seed, qubits)
+        rng = np.random.default_rng(seed)
+        num_qubits = self.N if qubits is None else len(qubits)
+        if isinstance(state, SparseState) and not state.dense:
+            outcomes = state.indices if qubits is None else gather_bits(state.indices, qubits)
+            indices = outcomes[sample_basis_indices(np.abs(state.amplitudes) ** 2, shots, rng)]
+        else:
+            probabilities = state.probabilities()
+            if qubits is not None:
+                probabilities = marginal_probabilities(probabilities, qubits, self.N)
+            indices = sample_basis_indices(probabilities, shots, rng)
+        indices = self._read_out(indices, num_qubits, rng)
+        values, counts = np.unique(indices, return_counts=True)
+        return dict({State.basis_vector_string(num_qubits, int(value)): int(count)
+                     for value, count in zip(values, counts)})
 
     @staticmethod
     def create_circuit_unitary(gates):
         """Construct the quantum circuit unitary operator from an array of unitary gates. Note: again, this is incredibly
-        inefficient."""
+        inefficient. Prefer the U property, or the unitary() method, which never form the embeddings of the gates."""
         U = gates[0]
         for i in range(1, len(gates)):
             # TODO: consider, if numpy has a built-in to do this.
@@ -60,12 +263,15 @@ class Circuit:
     def add(self, gate, indices=None):
         """Add a gate, sequentially to my circuit's gates. The gate passed must be one of the common gates
         defined in the operators module, passed as a string, or an (m x m) unitary. Indices can be a single index or a list of
-        indices, which the gate should be applied to."""
+        indices, which the gate should be applied to, in any order. The gate is stored with its indices sorted, and its
+        matrix permuted to match, so that the kernels never need to reorder qubits."""
         # TODO: check unitarity.
         if type(gate) == str:
             if gate not in operator_dict.keys():
                 raise EpyrException("The requested gate is not available.")
             gate = operator_dict[gate]
+        # Cast the gate to my precision once, rather than in every kernel call.
+        gate = np.asarray(gate, dtype=self._dtype)
 
         # By default, apply the gate to the first log2(m) qubits.
         if indices is None:
@@ -73,8 +279,96 @@ class Circuit:
             indices = [i for i in range(num_affected_qubits)]
         elif type(indices) == int:
             indices = [indices]
-        # TODO: check unitarIty and that it functions with the indices
-        self._gates.append((gate, indices))
+        # TODO: check unitarIty
+        if gate.shape != (2 ** len(indices), 2 ** len(indices)):
+            raise EpyrException("The gate does not match the number of indices it is applied to.")
+        if len(set(indices)) != len(indices) or not all(0 <= index < self.N for index in indices):
+            raise EpyrException("The indices must be distinct qubits of the circuit.")
+        indices, gate = sort_gate_qubits(gate, list(indices))
+        self._gates.append((gate, indices, classify_gate(gate)))
+        self._gates_changed()
+
+    def add_rotation(self, name, index, theta):
+        """Add the rotation gate NAME (one of operators.rotation_dict: RX, RY, RZ or PHASE) by the angle THETA to the
+        qubit at position INDEX. THETA may be a number, or a Parameter (or a multiple of one), whose value is only
+        bound later, see bind(). A parameterized gate keeps its place in the fused and compiled gates, and binding
+        only refills its matrix."""
+        rotation, kind = rotation_dict[name]
+        if not isinstance(theta, (Parameter, ScaledParameter)):
+            self.add(rotation(theta), index)
+            return
+        if not 0 <= index < self.N:
+            raise EpyrException("The indices must be distinct qubits of the circuit.")
+        if isinstance(theta, Parameter):
+            theta = ScaledParameter(theta, 1)
+        # The matrix is a placeholder until a value is bound, but its kind is that of the rotation at any angle.
+        self._gates.append((np.asarray(rotation(0), dtype=self._dtype), [index], kind))
+        self._parameter_slots.append((len(self._gates) - 1, name, theta.parameter, theta.factor))
+        self._gates_changed()
+
+    @property
+    def parameters(self):
+        """Return the list of distinct parameters of my gates, in the order of their first use. This is the order of
+        the values passed to bind() and sweep()."""
+        parameters = []
+        for _, _, parameter, _ in self._parameter_slots:
+            if all(parameter is not known for known in parameters):
+                parameters.append(parameter)
+        return parameters
+
+    def bind(self, values):
+        """Bind VALUES to my parameters: either a dictionary mapping parameters (or their names) to angles, or a
+        sequence of angles in the order of the parameters property. The matrices of the parameterized gates are
+        refilled in place, as are their slots in the compiled circuits, so the fused and compiled gates are reused."""
+        parameters = self.parameters
+        if isinstance(values, dict):
+            by_name = {key.name if isinstance(key, Parameter) else key: value for key, value in values.items()}
+            values = [by_name[parameter.name] for parameter in parameters if parameter.name in by_name]
+            if len(values) != len(parameters):
+                raise EpyrException("A value must be bound to every parameter.")
+        if len(values) != len(parameters):
+            raise EpyrException(f"Expected {len(parameters)} parameter values, but got {len(values)}.")
+        for parameter, value in zip(parameters, values):
+            self._parameter_values[parameter] = value
+        for position, name, parameter, factor in self._parameter_slots:
+            self._gates[position][0][...] = rotation_dict[name][0](factor * self._parameter_values[parameter])
+        for compiled in self._compiled.values():
+            compiled.refill()
+        # The blocked gates are relabeled copies, so they are scheduled again on demand.
+        self._blocked = dict()
+        # The adjoint and the Clifford analysis copy the matrices, so they are derived again on demand.
+        self._U = None
+        self._clifford = None
+
+    def sweep(self, values, state=None, observable=None, processes=None):
+        """Compute the circuit for each row of VALUES, a (P x number of parameters) array of parameter sets, ordered
+        as the parameters property, starting from a copy of STATE (by default, |0...>). Returns the (P,) array of the
+        expectation values of OBSERVABLE, if one is passed, and the (P x 2^N) array of the final state vectors
+        otherwise. The rows are split over PROCESSES worker processes, if given; the circuit structure is fused and
+        compiled once per worker, after which every row only rebinds the parameters. See parameters.run_sweep."""
+        return run_sweep(self, values, state, observable, processes)
+
+    def _check_bound(self):
+        """Raise an exception, unless a value is bound to each of my parameters."""
+        if any(parameter not in self._parameter_values for _, _, parameter, _ in self._parameter_slots):
+            raise EpyrException("Bind values to all parameters (see bind()) before computing the circuit.")
+
+    def add_noise(self, channel, indices=None):
+        """Attach the noise CHANNEL (a noise.KrausChannel) to the last gate added, acting on the qubits with the given
+        INDICES (by default, those of the gate), in any order. Noise only affects the computation of a DensityMatrix,
+        and Monte-Carlo trajectories (see compute_trajectory); ideal states ignore it."""
+        if not self._gates:
+            raise EpyrException("Noise can only be attached to a gate, but the circuit has no gates.")
+        if indices is None:
+            indices = self._gates[-1][1]
+        elif type(indices) == int:
+            indices = [indices]
+        if channel.num_qubits != len(indices):
+            raise EpyrException("The channel does not match the number of indices it is applied to.")
+        if len(set(indices)) != len(indices) or not all(0 <= index < self.N for index in indices):
+            raise EpyrException("The indices must be distinct qubits of the circuit.")
+        indices, channel = channel.sorted(indices)
+        self._noise.setdefault(len(self._gates) - 1, []).append((channel, indices))
 
     def add_common(self, gate, indices=None):
         """Add one of the common gates, defined in the operators module,
@@ -105,110 +399,489 @@ class Circuit:
         """Add an S gate to the qubit at position INDEX."""
         self.add_common("S", index)
 
+    def t(self, index=0):
+        """Add a T gate to the qubit at position INDEX."""
+        self.add_common("T", index)
+
+    def rx(self, index, theta):
+        """Add the rotation RX(theta) = exp(-i theta X / 2), applied to the qubit at position INDEX. THETA may be a
+        Parameter, see add_rotation()."""
+        self.add_rotation("RX", index, theta)
+
+    def ry(self, index, theta):
+        """Add the rotation RY(theta) = exp(-i theta Y / 2), applied to the qubit at position INDEX."""
+        self.add_rotation("RY", index, theta)
+
+    def rz(self, index, theta):
+        """Add the rotation RZ(theta) = exp(-i theta Z / 2), applied to the qubit at position INDEX."""
+        self.add_rotation("RZ", index, theta)
+
+    def phase(self, index, theta):
+        """Add the phase gate diag(1, exp(i theta)), applied to the qubit at position INDEX."""
+        self.add_rotation("PHASE", index, theta)
+
     def cnot(self, control, target):
         """Add a CNOT gate from the qubit at position CONTROL
         to the qubit at position TARGET."""
         indices = [control, target]
         self.add_common("CNOT", indices)
 
+    def toffoli(self, control0, control1, target):
+        """Add a Toffoli (CCNOT) gate, controlled by the qubits at positions
+        CONTROL0 and CONTROL1, to the qubit at position TARGET."""
+        indices = [control0, control1, target]
+        self.add_common("TOFFOLI", indices)
+
     def reset(self):
-        """Clear all the gates in this circuit."""
+        """Clear all the gates in this circuit, and the noise attached to them."""
         self._gates = []
+        self._noise = dict()
+        self._parameter_slots = []
+        self._parameter_values = dict()
+        self._gates_changed()
 
     #############################
     ###### STATE EVOLUTION ######
     #############################
 
-    def compute(self, state: State, enable_numba=True):  # TODO: Consider renaming state.state to state.vec(tor)
-        """Apply the quantum circuit to the given input state."""
-        ENABLE_NUMBA = enable_numba
-        for gate, indices in self._gates:
-            # Check how many qubits are affected by the gate
-            num_affected_qubits = int(np.log2(len(gate)))  # TODO: could be slow, consider computing in add() method.
-            if num_affected_qubits == 1:
-                target = indices[0]
-                apply_general_one_qubit_gate_in_place(
-                    state.state, gate, target, self.N)
-            elif num_affected_qubits == 2:
-                target0, target1 = indices
-                apply_general_two_qubit_gate_in_place(
-                    state.state, gate, target0, target1, self.N)
-            else:
-                raise NotImplemented
-
-
-# @source: https://stackoverflow.com/questions/10724854/how-to-do-a-conditional-decorator-in-python
-def conditional_decorator(dec, condition):
-    def decorator(func):
-        if not condition:
-            # Return the function unchanged, not decorated.
-            return func
-        return dec(func)
-
-    return decorator
-
-
-@conditional_decorator(njit, ENABLE_NUMBA)
-def apply_general_one_qubit_gate_in_place(state, U, target_index, N):
+    def compute(self, state: State, enable_numba=True, vectorize=False, parallel=False, num_threads=None,
+                fuse=True, profiler=None, cache=None, blocked=False):  # TODO: Consider renaming state.state to state.vec(tor)
+        """Apply the quantum circuit to the given input state. If VECTORIZE is set, every gate is applied with a single
+        tensordot over the (2,)*N tensor view of the state, rather than by looping over the probability amplitudes.
+        Otherwise, the loop kernels are used, which are compiled by Numba unless ENABLE_NUMBA is False; with Numba, the
+        whole circuit is run by a single call to the interpreter of the compiled circuit (see compile()). If BLOCKED is
+        set, it is instead run in cache-blocked passes, each applying many gates to one block of the state vector at a
+        time (see block()), so that large states stream from memory fewer times. If PARALLEL is
+        set, the loop kernels split the amplitudes into blocks which are processed on NUM_THREADS threads (by default,
+        all threads available to Numba). Unless FUSE is False, the fused gates are applied (see fused_gates).
+        A MemmapState is always processed chunk by chunk with the loop kernels, see apply_gate_chunked. A SparseState
+        is processed with apply_sparse_gate while it is sparse, and gate by gate with the loop kernels once it has
+        become dense. A StabilizerState is updated by its tableau, which requires all my gates to be Clifford gates.
+        A DensityMatrix is computed gate by gate, without fusion, followed by the noise attached to each gate (see
+        add_noise). A DistributedState is computed by its worker processes, see DistributedState.apply_gates, and an
+        MPSState by local tensor contractions, see MPSState.apply_gate.
+        If a CACHE (see cache.PrefixCache) is passed, the computation of a State resumes from the longest prefix of my
+        gates cached for the same input state, and stores checkpoints along the way.
+        If a PROFILER (see profiling.Profiler) is passed, it records every gate application to a dense state.
+        A CACHE, or BLOCKED, requires a plain State, and cannot be combined with each other, with VECTORIZE, PARALLEL
+        or a PROFILER; such combinations raise an exception rather than ignoring one of the options. Likewise,
+        VECTORIZE, PARALLEL and NUM_THREADS only apply to a plain State, and a PROFILER to a State or a MemmapState;
+        passing them with any other kind of state raises an exception."""
+        self._check_bound()
+        if type(state) is not State:
+            ignored = [name for name, option in [
+                ("vectorize", vectorize), ("parallel", parallel), ("num_threads", num_threads is not None),
+                ("profiler", profiler is not None and not isinstance(state, MemmapState))] if option]
+            if ignored:
+                raise EpyrException(f"A {type(state).__name__} cannot be computed with {', '.join(ignored)}.")
+        if cache is not None and (type(state) is not State or vectorize or parallel or profiler is not None):
+            raise EpyrException("A cache requires a State, and cannot be combined with vectorize, parallel or a "
+                                "profiler.")
+        if blocked and (type(state) is not State or vectorize or parallel or profiler is not None or
+                        cache is not None):
+            raise EpyrException("Blocked computation requires a State, and cannot be combined with a cache, "
+                                "vectorize, parallel or a profiler.")
+        if isinstance(state, StabilizerState):
+            if not self.is_clifford:
+                raise EpyrException("Only circuits of Clifford gates can be computed on a StabilizerState.")
+            for name, indices in self._clifford:
+                state.apply(name, indices)
+            return
+
+        self._check_dtype(state.dtype)
+        gates = self.fused_gates if fuse else self._gates
+
+        if isinstance(state, DistributedState):
+            state.apply_gates(gates, enable_numba)
+            return
+
+        if isinstance(state, MPSState):
+            for gate, indices, _ in gates:
+                state.apply_gate(gate, indices)
+            return
+
+        if isinstance(state, DensityMatrix):
+            for position, (gate, indices, kind) in enumerate(self._gates):
+                apply_gate_to_density_matrix(state.state, gate, indices, kind, self.N, enable_numba)
+                for channel, channel_indices in self._noise.get(position, ()):
+                    apply_channel_to_density_matrix(state.state, channel, channel_indices, self.N, enable_numba)
+            return
+
+        if isinstance(state, SparseState):
+            for gate, indices, kind in gates:
+                if state.dense:
+                    apply_gate_in_place(state.state, gate, indices, kind, self.N, enable_numba)
+                else:
+                    state.update(*apply_sparse_gate(state.indices, state.amplitudes, gate, indices))
+            return
+
+        if cache is not None:
+            cache.compute(self, state, enable_numba)
+            return
+
+        if profiler is not None:
+            specialized = not (vectorize or parallel or isinstance(state, MemmapState))
+            gates = profiler.profile(gates, state.state, specialized)
+
+        if isinstance(state, MemmapState):
+            for gate, indices, kind in gates:
+                state.io_bytes.append(apply_gate_chunked(
+                    state.state, gate, indices, kind, self.N, state.chunk_qubits, enable_numba))
+            state.state.flush()
+            return
+
+        if vectorize:
+            for gate, indices, _ in gates:
+                apply_general_gate_tensordot(state.state, gate, indices, self.N)
+            return
+
+        if blocked:
+            self.block(fuse).run(state.state, enable_numba)
+            return
+
+        if not parallel and enable_numba and profiler is None:
+            self.compile(fuse).run(state.state)
+            return
+
+        if not parallel:
+            # Diagonal, permutation and controlled gates are sent to their own kernels.
+            for gate, indices, kind in gates:
+                apply_gate_in_place(state.state, gate, indices, kind, self.N, enable_numba)
+            return
+
+        from numba import get_num_threads, set_num_threads
+        one_qubit_kernel = select_kernel("apply_one_qubit_gate_parallel", enable_numba)
+        two_qubit_kernel = select_kernel("apply_two_qubit_gate_parallel", enable_numba)
+        previous_num_threads = get_num_threads()
+        if num_threads is not None:
+            set_num_threads(num_threads)
+        try:
+            for gate, indices, kind in gates:
+                # The indices are validated and sorted when the gate is added, so they give the number of qubits.
+                if len(indices) == 1:
+                    target = indices[0]
+                    one_qubit_kernel(state.state, gate, target, self.N)
+                elif len(indices) == 2:
+                    target0, target1 = indices
+                    two_qubit_kernel(state.state, gate, target0, target1, self.N)
+                else:
+                    apply_gate_in_place(state.state, gate, indices, kind, self.N, enable_numba)
+        finally:
+            set_num_threads(previous_num_threads)
+
+    def compute_trajectory(self, state: State, rng, enable_numba=True):
+        """Apply one Monte-Carlo trajectory of the noisy circuit to the pure STATE: after every gate, each attached
+        noise channel applies one of its Kraus operators K, chosen with probability ||K psi||^2 using the random
+        generator RNG, and the state is normalized again. Averaged over many trajectories, the final states reproduce
+        the density matrix, at the memory cost of a state vector. See sample_trajectories()."""
+        self._check_bound()
+        self._check_dtype(state.dtype)
+        # The candidate K psi of each Kraus operator is computed in this buffer, reused across all operators.
+        scratch = np.empty_like(state.state) if self._noise else None
+        for position, (gate, indices, kind) in enumerate(self._gates):
+            apply_gate_in_place(state.state, gate, indices, kind, self.N, enable_numba)
+            for channel, channel_indices in self._noise.get(position, ()):
+                threshold = rng.random()
+                cumulative = 0.0
+                for operator, operator_kind in channel.kraus_gates(self._dtype):
+                    np.copyto(scratch, state.state)
+                    apply_gate_in_place(scratch, operator, channel_indices, operator_kind, self.N, enable_numba)
+                    probability = float(np.real(np.vdot(scratch, scratch)))
+                    if probability == 0:
+                        continue
+                    chosen, chosen_probability = (operator, operator_kind), probability
+                    cumulative += probability
+                    if threshold < cumulative:
+                        break
+                # If rounding left the threshold above the total, the last possible operator is kept. Unless that
+                # operator was followed by ones of probability 0, its candidate is still in the buffer.
+                if chosen[0] is operator:
+                    np.multiply(scratch, 1 / np.sqrt(chosen_probability), out=state.state)
+                else:
+                    apply_gate_in_place(state.state, chosen[0], channel_indices, chosen[1], self.N, enable_numba)
+                    state.state *= 1 / np.sqrt(chosen_probability)
+
+    def sample_trajectories(self, shots, seed=None, processes=None, qubits=None):
+        """Measure the final states of SHOTS Monte-Carlo trajectories of the noisy circuit (see compute_trajectory),
+        starting from |0...>, once each, and return the counts as in sample(). The trajectories are run on a pool of
+        PROCESSES processes, if given, see noise.run_trajectories. If QUBITS is passed, only those are reported."""
+        _, outcomes = run_trajectories(self, shots, seed, processes)
+        num_qubits = self.N
+        if qubits is not None:
+            outcomes = gather_bits(outcomes, qubits)
+            num_qubits = len(qubits)
+        outcomes = self._read_out(outcomes, num_qubits, np.random.default_rng(seed))
+        values, counts = np.unique(outcomes, return_counts=True)
+        return dict({State.basis_vector_string(num_qubits, int(value)): int(count)
+                     for value, count in zip(values, counts)})
+
+    def trajectory_probabilities(self, num_trajectories, seed=None, processes=None):
+        """Return the probabilities of the basis states after the noisy circuit, starting from |0...>, estimated as the
+        mean over NUM_TRAJECTORIES Monte-Carlo trajectories (see compute_trajectory)."""
+        probabilities, _ = run_trajectories(self, num_trajectories, seed, processes)
+        return probabilities
+
+    def _read_out(self, outcomes, num_qubits, rng):
+        """Return the measurement OUTCOMES of NUM_QUBITS qubits, with my readout error applied, if I have one."""
+        if self.readout_error is None:
+            return outcomes
+        return self.readout_error.apply(outcomes, num_qubits, rng)
+
+    def _check_dtype(self, dtype):
+        """Raise an exception, unless DTYPE, the dtype of a state, matches my precision. Mixing dtypes would silently
+        upcast inside the kernels."""
+        if dtype != self._dtype:
+            raise EpyrException(
+                f"The state has dtype {dtype}, but the circuit has precision {self._dtype}.")
+
+    def compute_batch(self, states, fuse=True, profiler=None):
+        """Apply the quantum circuit to a batch of B input states, passed as a list of State instances or as a (B, 2^N)
+        array of state vectors. Every gate is applied to the whole batch with a single tensordot, so the per-gate
+        overhead is paid once rather than B times. An array is mutated in place, and State instances are updated to
+        hold their output vectors. Returns the (B, 2^N) array of output state vectors. If a PROFILER is passed, it
+        records every gate application."""
+        self._check_bound()
+        gates = self.fused_gates if fuse else self._gates
+        if isinstance(states, np.ndarray):
+            batch = states
+        else:
+            for state in states:
+                self._check_dtype(state.dtype)
+            batch = np.stack([state.state for state in states])
+        self._check_dtype(batch.dtype)
+        if profiler is not None:
+            gates = profiler.profile(gates, batch, specialized=False)
+
+        for gate, indices, _ in gates:
+            apply_general_gate_tensordot(batch, gate, indices, self.N)
+
+        if not isinstance(states, np.ndarray):
+            for state, state_vector in zip(states, batch):
+                state.state = state_vector
+        return batch
+
+
+def sample_basis_indices(probabilities, shots, rng):
+    """Draw SHOTS basis state indices from the distribution PROBABILITIES with the random generator RNG (anything with a
+    random(size) method), by a vectorized binary search of the cumulative distribution."""
+    cdf = np.cumsum(probabilities)
+    # Normalize by the total, so that rounding errors cannot produce out of range indices.
+    draws = rng.random(shots) * cdf[-1]
+    return np.minimum(np.searchsorted(cdf, draws, side="right"), len(cdf) - 1)
+
+
+def marginal_probabilities(probabilities, qubits, N):
+    """Return the distribution of the measurement outcomes of QUBITS, given the distribution PROBABILITIES of all N
+    qubits. Bit j of the returned basis state indices refers to the qubit QUBITS[j]."""
+    # As in apply_general_gate_tensordot, qubit q is the (N - 1 - q)th axis, most significant qubits first.
+    kept = [N - 1 - qubits[j] for j in reversed(range(len(qubits)))]
+    summed = [axis for axis in range(N) if axis not in kept]
+    tensor = probabilities.reshape((2,) * N).transpose(summed + kept)
+    return tensor.reshape(2 ** len(summed), 2 ** len(kept)).sum(axis=0)
+
+
+def apply_gate_in_place(state, gate, indices, kind, N, enable_numba=True):
+    """Apply GATE, of the given KIND, to the qubits with the given INDICES of the N qubit state vector STATE, using the
+    kernel specialised to that kind of gate:
+    DIAGONAL     - only the amplitudes whose phase is not 1 are multiplied by their phase.
+    PERMUTATION  - only the amplitudes which are moved, or picks up a phase, are read and written.
+    CONTROLLED   - the 2x2 unitary is applied to the subspace in which all control qubits are 1.
+    Dense gates go through the unrolled 1- and 2-qubit kernels, or the general k-qubit kernel if they are wider. The
+    number of qubits is that of INDICES, which are validated and sorted when the gate is added."""
+    if kind == DIAGONAL or kind == PERMUTATION or kind == CONTROLLED:
+        sorted_targets = np.sort(np.asarray(indices, dtype=np.int64))
+        offsets = gate_offsets(indices)
+
+    if kind == DIAGONAL:
+        phases = np.diag(gate)
+        active = phases != 1
+        if not np.any(active):
+            return
+        select_kernel("apply_diagonal_gate_in_place", enable_numba)(
+            state, phases[active], offsets[active], sorted_targets, N)
+    elif kind == PERMUTATION:
+        # Column m of the gate has its single non-zero entry in row destinations[m].
+        destinations = np.argmax(gate != 0, axis=0)
+        sources = np.arange(len(gate))
+        phases = gate[destinations, sources]
+        moved = (destinations != sources) | (phases != 1)
+        select_kernel("apply_permutation_gate_in_place", enable_numba)(
+            state, offsets[sources[moved]], offsets[destinations[moved]], phases[moved], sorted_targets, N)
+    elif kind == CONTROLLED:
+        target = controlled_gate_target(gate)
+        block = [len(gate) - 1 - (1 << target), len(gate) - 1]
+        control_mask = offsets[block[0]]
+        select_kernel("apply_controlled_gate_in_place", enable_numba)(
+            state, gate[np.ix_(block, block)], control_mask, 1 << indices[target], sorted_targets, N)
+    else:
+        if len(indices) == 1:
+            select_kernel("apply_one_qubit_gate_range", enable_numba)(state, gate, indices[0], 0, len(state) >> 1)
+        elif len(indices) == 2:
+            select_kernel("apply_two_qubit_gate_range", enable_numba)(
+                state, gate, indices[0], indices[1], 0, len(state) >> 2)
+        else:
+            # Wider dense gates, e.g. those produced by fusing blocks of gates.
+            select_kernel("apply_dense_gate_in_place", enable_numba)(
+                state, gate, gate_offsets(indices), np.sort(np.asarray(indices, dtype=np.int64)), N)
+
+
+def apply_gate_to_density_matrix(state, gate, indices, kind, N, enable_numba=True):
+    """Apply GATE, of the given KIND, to the N qubit density matrix rho held in the vector STATE of 2N qubits (see
+    state.DensityMatrix), i.e. rho -> U rho U^dagger: U acts on the row qubits, and its conjugate on the column qubits.
+    Both are applied in place by the kernels for states, and the kind of the gate is preserved by conjugation."""
+    apply_gate_in_place(state, gate, [index + N for index in indices], kind, 2 * N, enable_numba)
+    apply_gate_in_place(state, np.ascontiguousarray(gate.conj()), indices, kind, 2 * N, enable_numba)
+
+
+def apply_channel_to_density_matrix(state, channel, indices, N, enable_numba=True):
+    """Apply the noise CHANNEL (a noise.KrausChannel) on the qubits with the given sorted INDICES to the N qubit density
+    matrix held in the vector STATE of 2N qubits. The channel acts as a single gate, its superoperator, on the column
+    and row qubits of the k qubits it acts on, which the kernels apply in place, without any copy of the state."""
+    superoperator = np.asarray(channel.superoperator, dtype=state.dtype)
+    apply_gate_in_place(state, superoperator, list(indices) + [index + N for index in indices],
+                        classify_gate(superoperator), 2 * N, enable_numba)
+
+
+def apply_gate_chunked(state, gate, indices, kind, N, chunk_qubits, enable_numba=True):
+    """Apply GATE, of the given KIND, to the qubits with the given INDICES of the N qubit state vector STATE, which is
+    read and written in chunks of 2^CHUNK_QUBITS amplitudes (e.g. a np.memmap). Target qubits below CHUNK_QUBITS are
+    local to a chunk. For each target qubit above, chunks are paired with the chunk which differs in that qubit, so
+    that for h such qubits, groups of 2^h chunks are copied into memory together, the gate is applied to the group as
+    to a state of CHUNK_QUBITS + h qubits, and the group is written back. Every chunk is thus read and written exactly
+    once, in increasing order of the groups. Returns the number of bytes read and written."""
+    high = sorted(q for q in indices if q >= chunk_qubits)
+    # Within a group, the high qubits come right after the local qubits, in the same order.
+    mapped_indices = [q if q < chunk_qubits else chunk_qubits + high.index(q) for q in indices]
+    high_bits = np.array([q - chunk_qubits for q in high], dtype=np.int64)
+    chunk_offsets = gate_offsets(high_bits)
+    chunk = 1 << chunk_qubits
+    group = np.empty(len(chunk_offsets) * chunk, dtype=state.dtype)
+    insert_zero_bits = select_kernel("insert_zero_bits", enable_numba)
+    io_bytes = 0
+    for k in range(1 << (N - chunk_qubits - len(high))):
+        first_chunk = insert_zero_bits(k, high_bits)
+        for j, offset in enumerate(chunk_offsets):
+            start = (first_chunk + offset) * chunk
+            group[j * chunk:(j + 1) * chunk] = state[start:start + chunk]
+        apply_gate_in_place(group, gate, mapped_indices, kind, chunk_qubits + len(high), enable_numba)
+        for j, offset in enumerate(chunk_offsets):
+            start = (first_chunk + offset) * chunk
+            state[start:start + chunk] = group[j * chunk:(j + 1) * chunk]
+        io_bytes += 2 * group.nbytes
+    return io_bytes
+
+
+def warm_up(dtypes=(np.complex64, np.complex128), parallel=True):
+    """Compile the Numba kernels for each of DTYPES (and the parallel kernels, if PARALLEL is set) by computing a small
+    circuit containing every kind of gate, so that the first real computation does not pay for compilation. As the
+    compiled kernels are cached on disk, this only takes long in the very first process."""
+    controlled_h = np.eye(4, dtype=np.complex128)
+    controlled_h[np.ix_([1, 3], [1, 3])] = operator_dict["H"]
+    for dtype in dtypes:
+        c = Circuit(3, dtype=dtype)
+        c.h(0)
+        c.z(1)
+        c.cnot(0, 2)
+        c.add(controlled_h, [1, 2])
+        c.add(np.kron(operator_dict["H"], operator_dict["H"]), [0, 2])
+        c.compute(State(3, dtype=dtype), fuse=False)
+        # The kernels for single gates, used when profiling or for memory-mapped states.
+        state = State(3, dtype=dtype)
+        for gate, indices, kind in c.gates:
+            apply_gate_in_place(state.state, gate, indices, kind, c.N)
+        state.expectation("XYZ")
+        if parallel:
+            c.compute(State(3, dtype=dtype), parallel=True, fuse=False)
+            state.expectation("XYZ", parallel=True)
+    # Called from Python by apply_gate_chunked.
+    select_kernel("insert_zero_bits", True)(0, np.zeros(1, dtype=np.int64))
+
+
+def select_kernel(name, enable_numba):
+    """Return the kernel with the given NAME from the kernels module, or the plain Python function it wraps if
+    ENABLE_NUMBA is False. The kernels module, and with it Numba, is imported on first use only."""
+    from . import kernels
+    kernel = getattr(kernels, name)
+    if enable_numba or not hasattr(kernel, "py_func"):
+        return kernel
+    return kernel.py_func
+
+
+def apply_general_gate_tensordot(state, U, indices, N):
     """
-    Applies a 1-qubit quantum gate U to a state vector. Mutates the state vector
-    in place to avoid larger matrix multiplications. Algorithm is
-    linear in the number of entries in the state vector, in terms of both time
-    and space.
-
-    Runtime complexity: O(2^N)
+    Apply the k-qubit gate U to the qubits with the given INDICES of an N qubit
+    state. The state vector is viewed as a tensor of shape (2,)*N, the gate as a
+    tensor of shape (2,)*2k, and the two are contracted with a single tensordot,
+    after which the target axes are moved back into place. The result is written
+    back into the state vector, so that it is mutated in place. A (B, 2^N) array
+    of B state vectors is handled in the same single pass.
+
+    Runtime complexity: O(2^k * 2^N)
     Space complexity:   O(2^N)
 
-    state:              a vector of length 2^N, where the ith entry gives the
-                        probability amplitude to measure the system in the ith
-                        basis state. (In the computational basis)
-    U:                  a 2x2 unitary matrix, representing the 1-qubit gate.
-    target_index:       the index of the qubit on which the gate is applied.
-                        Indexing from 0.
+    state:              a vector of length 2^N, or an array of shape (B, 2^N).
+    U:                  a 2^k x 2^k unitary matrix. The ith bit of a row or
+                        column index of U refers to the qubit INDICES[i].
+    indices:            the indices of the k qubits the gate acts on. Any order
+                        is accepted.
     N:                  the number of qubits
     """
-    # Enumerate all bit values before the target qubit
-    for i0 in range(2 ** target_index):
-        # Enumerate all bit values after the target qubit
-        for i1 in range(2 ** ((N - 1) - target_index)):
-            offset = i0 + i1 * (2 ** (target_index + 1))
-            # Create vector of the indices of the relevant probability amplitudes.
-            c0 = offset
-            c1 = offset + (2 ** target_index)
-
-            cs = np.array([c0, c1])
-            # Update probability amplitudes.
-            state[cs] = U @ state[cs]
-
-
-@conditional_decorator(njit, ENABLE_NUMBA)
-def apply_general_two_qubit_gate_in_place(state, U, q0, q1, N):
+    k = len(indices)
+    batch_shape = state.shape[:-1]
+    # Qubit q is the (N - 1 - q)th axis of the tensor (after any batch axes), since
+    # qubit 0 is the LSB. The first axes of the reshaped gate belong to the most
+    # significant bits.
+    axes = [len(batch_shape) + N - 1 - indices[i] for i in reversed(range(k))]
+    psi = state.reshape(batch_shape + (2,) * N)
+    gate = U.reshape((2,) * (2 * k))
+    result = np.tensordot(gate, psi, axes=(list(range(k, 2 * k)), axes))
+    # tensordot places the output axes of the gate first.
+    result = np.moveaxis(result, list(range(k)), axes)
+    state[...] = result.reshape(state.shape)
+
+
+def apply_sparse_gate(state_indices, amplitudes, gate, indices):
     """
-    Apply the two-qubit gate U to qubits with index q0 and q1 for
-    an N qubit state. Performs this operation in-place, mutating
-    the state vector, to avoid large matrix multiplication.
+    Apply the k-qubit gate GATE to the qubits with the given INDICES of a sparse
+    state, given by the sorted basis indices STATE_INDICES of its nonzero
+    AMPLITUDES. Each stored amplitude is scattered to the (at most 2^k) basis
+    states which differ from it in the target qubits only, through the column of
+    the gate selected by its target bits. Contributions to the same basis state
+    are then summed, and amplitudes which cancel to within the precision of the
+    dtype are dropped. Returns the new sorted basis indices and amplitudes.
+
+    Runtime complexity: O(2^k * n log(2^k * n)), for n nonzero amplitudes
+    Space complexity:   O(2^k * n)
     """
-    # Swap affected qubits if necessary
-    assert q0 < q1
-    # if q0 > q1:
-    #     U = swap_two_qubit_gate(U)
-    #     q0, q1 = q1, q0
-
-    for i0 in range(1 << q0):
-        # TODO: consider incrementing by the correct amount here rather than doing the multiplication below to get l.
-        for i1 in range(1 << (q1 - q0 - 1)):
-            for i2 in range(1 << ((N - 1) - q1)):
-                l = i0 + (1 << (q0 + 1)) * i1 + (1 << (q1 + 1)) * i2
-                # Create a vector of relevant alpha_js
-                # Below, j(b_q0)(b_q1) represents the index of the
-                # basis state for fixed i0, i1, i2 and with the
-                # bits in position q0 and q1 being b_q0 and b_q1
-                j00 = l
-                j01 = l + (1 << q0)
-                j10 = l + (1 << q1)
-                j11 = l + (1 << q1) + (1 << q0)
-
-                j = np.array([j00, j01, j10, j11])
-                # Update all alpha_js by applying the U gate
-                state[j] = U @ state[j]
-                # Replace the alpha_js in the state vector
+    offsets = gate_offsets(indices)
+    mask = int(offsets[-1])
+    columns = gather_bits(state_indices, indices)
+    # Row r of the output holds the contributions of every stored amplitude to the basis state with target bits r.
+    # Zero entries of the gate, e.g. all but one for permutation gates, contribute nothing and are skipped.
+    rows, positions = np.nonzero(gate[:, columns])
+    output_indices = (state_indices[positions] & ~mask) + offsets[rows]
+    contributions = gate[rows, columns[positions]] * amplitudes[positions]
+
+    order = np.argsort(output_indices, kind="stable")
+    output_indices = output_indices[order]
+    starts = np.flatnonzero(np.diff(output_indices, prepend=-1))
+    output_amplitudes = np.add.reduceat(contributions[order], starts) if len(starts) else contributions
+    output_indices = output_indices[starts]
+    kept = np.abs(output_amplitudes) > np.finfo(amplitudes.dtype).eps
+    return output_indices[kept], output_amplitudes[kept].astype(amplitudes.dtype, copy=False)
+
+
+def gather_bits(basis_indices, qubits):
+    """Return the indices formed by the bits of BASIS_INDICES which refer to QUBITS, with bit j referring to QUBITS[j]."""
+    gathered = np.zeros(len(basis_indices), dtype=np.int64)
+    for j, qubit in enumerate(qubits):
+        gathered |= ((basis_indices >> qubit) & 1) << j
+    return gathered
+
+
+def __getattr__(name):
+    """Give access to the Numba kernels as attributes of this module, importing them only when first accessed."""
+    if name in KERNEL_NAMES:
+        from . import kernels
+        return getattr(kernels, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
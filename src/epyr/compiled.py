@@ -0,0 +1,92 @@
+import numpy as np
+
+from .operators import controlled_gate_target, gate_offsets, DIAGONAL, PERMUTATION, CONTROLLED
+
+# Opcodes of the compiled circuit, see kernels.run_program.
+OP_DENSE = 0
+OP_DIAGONAL = 1
+OP_PERMUTATION = 2
+OP_CONTROLLED = 3
+
+
+class CompiledCircuit:
+    """A list of gates lowered into flat arrays, so that kernels.run_program can apply all of them in a single call.
+    Gate g is described by opcodes[g] and three slices, delimited by the pointer arrays: its target qubits in
+    ascending order (targets), integer parameters (integers) and values (values, in the dtype of the circuit):
+
+    OP_DENSE        integers: the offsets of the gate's basis states (see operators.gate_offsets),
+                    values: the 2^k x 2^k matrix, row by row.
+    OP_DIAGONAL     integers: the offsets of the basis states whose phase is not 1, values: those phases.
+    OP_PERMUTATION  integers: the offsets of the basis states which are moved (or pick up a phase), followed by the
+                    offsets they are moved to, values: the phases.
+    OP_CONTROLLED   integers: the mask of the control qubits and 2^target, values: the 2x2 unitary, row by row.
+    """
+
+    def __init__(self, gates, N, dtype, parameterized=()):
+        """Lower GATES, a list of (gate, indices, kind) tuples of an N qubit circuit of the given DTYPE. The gates
+        whose matrices are among PARAMETERIZED change their values, but not their structure, see refill()."""
+        self.N = N
+        # The positions of the parameterized gates, with their gate tuples.
+        self._parameterized = [(g, entry) for g, entry in enumerate(gates)
+                               if any(entry[0] is gate for gate in parameterized)]
+        keep_all = {g for g, _ in self._parameterized}
+        opcodes, targets, integers, values = [], [], [], []
+        for g, (gate, indices, kind) in enumerate(gates):
+            opcode, gate_integers, gate_values = lower_gate(gate, indices, kind, keep_all=g in keep_all)
+            opcodes.append(opcode)
+            targets.append(np.sort(np.asarray(indices, dtype=np.int64)))
+            integers.append(np.asarray(gate_integers, dtype=np.int64))
+            values.append(np.asarray(gate_values, dtype=dtype).reshape(-1))
+
+        self.opcodes = np.array(opcodes, dtype=np.int64)
+        self.target_pointers, self.targets = pack(targets, np.int64)
+        self.integer_pointers, self.integers = pack(integers, np.int64)
+        self.value_pointers, self.values = pack(values, dtype)
+
+    def __len__(self):
+        """Return the number of gates in the compiled circuit."""
+        return len(self.opcodes)
+
+    def refill(self):
+        """Copy the current matrices of the parameterized gates, which Circuit.bind updates in place, into their slots
+        of the values array. Nothing else about the compiled circuit changes."""
+        for g, (gate, indices, kind) in self._parameterized:
+            _, _, gate_values = lower_gate(gate, indices, kind, keep_all=True)
+            self.values[self.value_pointers[g]:self.value_pointers[g + 1]] = np.reshape(gate_values, -1)
+
+    def run(self, state_vector):
+        """Apply the compiled circuit to STATE_VECTOR, in place."""
+        from .kernels import run_program
+        run_program(state_vector, self.opcodes, self.target_pointers, self.targets, self.integer_pointers,
+                    self.integers, self.value_pointers, self.values, self.N)
+
+
+def lower_gate(gate, indices, kind, keep_all=False):
+    """Return the opcode, integer parameters and values describing GATE, of the given KIND, acting on INDICES. Unless
+    KEEP_ALL is set, the basis states a diagonal gate leaves unchanged are left out, so the values of a diagonal gate
+    only have a fixed size with KEEP_ALL."""
+    offsets = gate_offsets(indices)
+    if kind == DIAGONAL:
+        phases = np.diag(gate)
+        active = np.ones(len(phases), dtype=bool) if keep_all else phases != 1
+        return OP_DIAGONAL, offsets[active], phases[active]
+    if kind == PERMUTATION:
+        destinations = np.argmax(gate != 0, axis=0)
+        sources = np.arange(len(gate))
+        phases = gate[destinations, sources]
+        moved = (destinations != sources) | (phases != 1)
+        return OP_PERMUTATION, np.concatenate([offsets[sources[moved]], offsets[destinations[moved]]]), phases[moved]
+    if kind == CONTROLLED:
+        target = controlled_gate_target(gate)
+        block = [len(gate) - 1 - (1 << target), len(gate) - 1]
+        return OP_CONTROLLED, [offsets[block[0]], 1 << indices[target]], gate[np.ix_(block, block)]
+    return OP_DENSE, offsets, gate
+
+
+def pack(arrays, dtype):
+    """Concatenate ARRAYS into one contiguous array, and return it along with the pointers delimiting them: array i
+    is packed[pointers[i]:pointers[i + 1]]."""
+    pointers = np.zeros(len(arrays) + 1, dtype=np.int64)
+    pointers[1:] = np.cumsum([len(array) for array in arrays])
+    packed = np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+    return pointers, packed
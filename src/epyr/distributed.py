@@ -0,0 +1,209 @@
+import weakref
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .operators import sort_gate_qubits
+from .state import State, state_dict
+from .epyr_exception import EpyrException
+
+
+class DistributedState(State):
+    """A state whose 2^N amplitudes are split over NUM_RANKS worker processes, so that gates are applied with the
+    memory bandwidth of several cores (or NUMA sockets). Rank r owns a segment of shared memory holding the 2^L
+    amplitudes, L = N - k for NUM_RANKS = 2^k, whose top k ("global") qubits equal r; the low L qubits are local.
+
+    Circuit.compute sends runs of gates on local qubits to all ranks at once, which apply them to their own segments
+    with the usual in-place kernels. Before a gate on a global qubit, that qubit is swapped with an unused local qubit
+    by a pairwise block exchange between the ranks which differ in it. Rather than swapping back, the state keeps
+    track of the resulting layout: the physical bit holding each (logical) qubit. Reading the state property gathers
+    the segments into a new vector in logical order.
+
+    The workers are spawned processes, which are stopped, and the shared memory released, by close() (or when the
+    state is garbage collected). The state can be used as a context manager."""
+
+    def __init__(self, N: int, num_ranks: int = 2, dtype=np.complex64, enable_numba=True):
+        """Create the N qubit state |0...>, distributed over NUM_RANKS worker processes, a power of 2 below 2^N. The
+        workers run the Numba kernels, unless ENABLE_NUMBA is False."""
+        if num_ranks < 1 or num_ranks & (num_ranks - 1) or num_ranks >= 2 ** N:
+            raise EpyrException("The number of ranks must be a power of 2, below 2^N.")
+        self._N = N
+        self._dtype = np.dtype(dtype)
+        self.num_ranks = num_ranks
+        self.local_qubits = N - int(np.log2(num_ranks))
+        # The physical bit of the amplitude indices which holds each qubit.
+        self.layout = list(range(N))
+        # The number of pairwise block exchanges (qubit swaps) performed so far.
+        self.exchanges = 0
+
+        segment_bytes = (1 << self.local_qubits) * self._dtype.itemsize
+        self._segments = [SharedMemory(create=True, size=segment_bytes) for _ in range(num_ranks)]
+        names = [segment.name for segment in self._segments]
+        context = get_context("spawn")
+        self._connections, self._workers = [], []
+        for rank in range(num_ranks):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(target=rank_worker, daemon=True, args=(
+                worker_connection, names, rank, self.local_qubits, self._dtype.str, enable_numba))
+            worker.start()
+            self._connections.append(connection)
+            self._workers.append(worker)
+        self._finalizer = weakref.finalize(self, release, self._connections, self._workers, self._segments)
+        for rank in range(num_ranks):
+            self._segment(rank)[:] = 0
+        self._segment(0)[0] = 1
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def state(self):
+        """Return my state vector, gathered from the segments of all ranks, in logical order. This is a new array."""
+        N = self._N
+        physical = np.concatenate([self._segment(rank) for rank in range(self.num_ranks)])
+        axes = [N - 1 - self.layout[N - 1 - axis] for axis in range(N)]
+        return np.ascontiguousarray(physical.reshape((2,) * N).transpose(axes)).reshape(-1)
+
+    @state.setter
+    def state(self, vector):
+        self.layout = list(range(self._N))
+        vector = np.asarray(vector, dtype=self._dtype)
+        size = 1 << self.local_qubits
+        for rank in range(self.num_ranks):
+            self._segment(rank)[:] = vector[rank * size:(rank + 1) * size]
+
+    def _segment(self, rank):
+        """Return the amplitudes owned by RANK, as an array on its shared memory."""
+        return np.ndarray((1 << self.local_qubits,), dtype=self._dtype, buffer=self._segments[rank].buf)
+
+    def apply_gates(self, gates, enable_numba=True):
+        """Apply GATES, a list of (gate, indices, kind) tuples, to the distributed state. Runs of gates acting on local
+        qubits only are sent to all ranks in a single message; global qubits are first swapped into local ones."""
+        batch = []
+        for gate, indices, kind in gates:
+            if len(indices) > self.local_qubits:
+                raise EpyrException("A gate acts on more qubits than each rank holds locally.")
+            physical = [self.layout[q] for q in indices]
+            global_bits = [bit for bit in physical if bit >= self.local_qubits]
+            if global_bits:
+                self._broadcast(("gates", batch, enable_numba))
+                batch = []
+                free = [bit for bit in reversed(range(self.local_qubits)) if bit not in physical]
+                for global_bit in global_bits:
+                    self._swap(global_bit, free.pop(0))
+                physical = [self.layout[q] for q in indices]
+            physical, gate = sort_gate_qubits(gate, physical)
+            batch.append((gate, physical, kind))
+        self._broadcast(("gates", batch, enable_numba))
+
+    def _swap(self, global_bit, local_bit):
+        """Swap the physical bits GLOBAL_BIT and LOCAL_BIT. For every pair of ranks which differ only in the global
+        bit, the lower rank exchanges the half of its segment in which the local bit is 1 with the half of its
+        partner's segment in which it is 0."""
+        rank_bit = global_bit - self.local_qubits
+        lower_ranks = [rank for rank in range(self.num_ranks) if not (rank >> rank_bit) & 1]
+        self._broadcast(("swap", rank_bit, local_bit), lower_ranks)
+        a, b = self.layout.index(global_bit), self.layout.index(local_bit)
+        self.layout[a], self.layout[b] = local_bit, global_bit
+        self.exchanges += 1
+
+    def _broadcast(self, message, ranks=None):
+        """Send MESSAGE to RANKS (by default all), and wait until all of them have processed it."""
+        if message[0] == "gates" and not message[1]:
+            return
+        ranks = range(self.num_ranks) if ranks is None else ranks
+        for rank in ranks:
+            self._connections[rank].send(message)
+        errors = [self._connections[rank].recv() for rank in ranks]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise EpyrException(f"A rank failed: {errors[0]}")
+
+    def close(self):
+        """Stop the worker processes, and release the shared memory."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __repr__(self):
+        return f"DistributedState - {self._N} qubits over {self.num_ranks} ranks"
+
+    @classmethod
+    def common(cls, state_name, dtype=np.complex64, num_ranks=2):
+        if state_name not in state_dict:
+            raise EpyrException("State with this name is not available.")
+        state_vector = state_dict[state_name]
+        state = cls(int(np.log2(len(state_vector))), num_ranks=num_ranks, dtype=dtype)
+        state.state = state_vector
+        return state
+
+    @classmethod
+    def custom(cls, bit_string, dtype=np.complex64, num_ranks=2):
+        state = cls(len(bit_string), num_ranks=num_ranks, dtype=dtype)
+        state._segment(0)[0] = 0
+        index = int(bit_string, 2)
+        state._segment(index >> state.local_qubits)[index & ((1 << state.local_qubits) - 1)] = 1
+        return state
+
+
+def rank_worker(connection, names, rank, local_qubits, dtype, enable_numba):
+    """The loop of the worker process of RANK: attach to the shared memory segments of all ranks (given by their
+    NAMES), and process the messages received on CONNECTION until it is closed, replying None, or the error."""
+    from .circuit import apply_gate_in_place
+    segments = [SharedMemory(name=name) for name in names]
+    arrays = [np.ndarray((1 << local_qubits,), dtype=dtype, buffer=segment.buf) for segment in segments]
+    mine = arrays[rank]
+    try:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            if message[0] == "close":
+                break
+            try:
+                if message[0] == "gates":
+                    _, gates, numba = message
+                    for gate, indices, kind in gates:
+                        apply_gate_in_place(mine, gate, indices, kind, local_qubits, numba and enable_numba)
+                elif message[0] == "swap":
+                    _, rank_bit, local_bit = message
+                    exchange_halves(mine, arrays[rank | (1 << rank_bit)], local_bit)
+                connection.send(None)
+            except Exception as error:
+                connection.send(repr(error))
+    finally:
+        del mine, arrays
+        for segment in segments:
+            segment.close()
+
+
+def exchange_halves(lower, upper, local_bit):
+    """Swap the amplitudes of the segment LOWER in which LOCAL_BIT is 1 with those of UPPER in which it is 0."""
+    lower = lower.reshape(-1, 2, 1 << local_bit)
+    upper = upper.reshape(-1, 2, 1 << local_bit)
+    buffer = lower[:, 1, :].copy()
+    lower[:, 1, :] = upper[:, 0, :]
+    upper[:, 0, :] = buffer
+
+
+def release(connections, workers, segments):
+    """Stop the WORKERS through their CONNECTIONS, and release the shared memory SEGMENTS."""
+    for connection in connections:
+        try:
+            connection.send(("close",))
+        except (BrokenPipeError, OSError):
+            pass
+    for worker in workers:
+        worker.join(timeout=10)
+        if worker.is_alive():
+            worker.terminate()
+    for segment in segments:
+        segment.close()
+        segment.unlink()
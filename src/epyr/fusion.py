@@ -0,0 +1,80 @@
+import numpy as np
+
+from .operators import classify_gate
+
+
+def embed_gate(gate: np.ndarray, indices, qubits) -> np.ndarray:
+    """Return the (2^u x 2^u) matrix of GATE, acting on the qubits INDICES, as an operator on the u qubits QUBITS,
+    which must contain all of INDICES. As everywhere else, bit j of a row or column index refers to the qubit
+    QUBITS[j]."""
+    u, k = len(qubits), len(indices)
+    positions = [qubits.index(q) for q in indices]
+    # Same axis bookkeeping as circuit.apply_general_gate_tensordot, with the columns of the identity as a batch axis.
+    axes = [u - 1 - positions[i] for i in reversed(range(k))]
+    identity = np.eye(2 ** u, dtype=np.result_type(gate, np.complex64)).reshape((2,) * u + (2 ** u,))
+    result = np.tensordot(gate.reshape((2,) * (2 * k)), identity, axes=(list(range(k, 2 * k)), axes))
+    result = np.moveaxis(result, list(range(k)), axes)
+    return result.reshape(2 ** u, 2 ** u)
+
+
+def fuse_gates(gates, max_width=2, fixed=()):
+    """Return an equivalent list of (gate, indices, kind) tuples, in which runs of gates are merged into single gates
+    acting on at most MAX_WIDTH qubits, so that fewer sweeps over the state vector are needed.
+    A gate is merged into the previous gate acting on its qubits, if no other gate acts on them in between (e.g.
+    consecutive 1-qubit gates on the same wire, or a 1-qubit gate following a 2-qubit gate). Otherwise, it absorbs the
+    earlier gates acting on its qubits which are not followed by any other gate (e.g. 1-qubit gates preceding a 2-qubit
+    gate). MAX_WIDTH = 1 only fuses 1-qubit gates; widths of 3-5 fuse whole blocks into dense gates.
+    The gates at the positions in FIXED (e.g. parameterized gates, whose matrices change) are neither merged nor
+    absorbed, but passed through as the very same tuples."""
+    # Entries are (gate, indices, kind) tuples, or None once absorbed into a later gate.
+    fused = []
+    # Maps each qubit to the position in FUSED of the last gate acting on it.
+    last = {}
+    # The positions in FUSED of the fixed gates.
+    frozen = set()
+    for position, entry in enumerate(gates):
+        gate, indices = entry[0], entry[1]
+        previous = sorted({last[q] for q in indices if q in last})
+
+        if position in fixed:
+            frozen.add(len(fused))
+            fused.append(entry)
+            for q in indices:
+                last[q] = len(fused) - 1
+            continue
+
+        if len(previous) == 1 and previous[0] not in frozen:
+            j = previous[0]
+            earlier, earlier_indices, _ = fused[j]
+            qubits = sorted(set(earlier_indices) | set(indices))
+            if len(qubits) <= max_width:
+                matrix = embed_gate(gate, indices, qubits) @ embed_gate(earlier, earlier_indices, qubits)
+                fused[j] = (matrix, qubits, classify_gate(matrix))
+                for q in indices:
+                    last[q] = j
+                continue
+
+        qubits = sorted(set(indices))
+        absorbed = []
+        for j in previous:
+            earlier_indices = fused[j][1]
+            union = sorted(set(qubits) | set(earlier_indices))
+            if j not in frozen and len(union) <= max_width and all(last[q] == j for q in earlier_indices):
+                absorbed.append(j)
+                qubits = union
+
+        if absorbed:
+            # The absorbed gates act on disjoint sets of qubits, so they commute with each other.
+            matrix = embed_gate(gate, indices, qubits)
+            for j in absorbed:
+                matrix = matrix @ embed_gate(fused[j][0], fused[j][1], qubits)
+                fused[j] = None
+            entry = (matrix, qubits, classify_gate(matrix))
+        else:
+            qubits = indices
+
+        fused.append(entry)
+        for q in qubits:
+            last[q] = len(fused) - 1
+
+    return [entry for entry in fused if entry is not None]
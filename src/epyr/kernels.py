@@ -0,0 +1,358 @@
+import numpy as np
+from numba import njit, prange
+
+from .compiled import OP_DIAGONAL, OP_PERMUTATION, OP_CONTROLLED
+
+# The Numba kernels. This module is imported by the circuit module on first use only (see circuit.select_kernel), so
+# that importing epyr does not import Numba. Compiled kernels are cached on disk, so later processes skip compilation;
+# see circuit.warm_up to compile them ahead of the first computation.
+
+ENABLE_NUMBA = True
+# Number of amplitude pairs (or quadruples) each parallel work item processes.
+PARALLEL_BLOCK_SIZE = 1 << 12
+
+
+# @source: https://stackoverflow.com/questions/10724854/how-to-do-a-conditional-decorator-in-python
+def conditional_decorator(dec, condition):
+    def decorator(func):
+        if not condition:
+            # Return the function unchanged, not decorated.
+            return func
+        return dec(func)
+
+    return decorator
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_general_one_qubit_gate_in_place(state, U, target_index, N):
+    """
+    Applies a 1-qubit quantum gate U to a state vector. Mutates the state vector
+    in place to avoid larger matrix multiplications. Algorithm is
+    linear in the number of entries in the state vector, in terms of both time
+    and space.
+
+    Runtime complexity: O(2^N)
+    Space complexity:   O(2^N)
+
+    state:              a vector of length 2^N, where the ith entry gives the
+                        probability amplitude to measure the system in the ith
+                        basis state. (In the computational basis)
+    U:                  a 2x2 unitary matrix, representing the 1-qubit gate.
+    target_index:       the index of the qubit on which the gate is applied.
+                        Indexing from 0.
+    N:                  the number of qubits
+    """
+    # Enumerate all bit values before the target qubit
+    for i0 in range(2 ** target_index):
+        # Enumerate all bit values after the target qubit
+        for i1 in range(2 ** ((N - 1) - target_index)):
+            offset = i0 + i1 * (2 ** (target_index + 1))
+            # Create vector of the indices of the relevant probability amplitudes.
+            c0 = offset
+            c1 = offset + (2 ** target_index)
+
+            cs = np.array([c0, c1])
+            # Update probability amplitudes.
+            state[cs] = U @ state[cs]
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_general_two_qubit_gate_in_place(state, U, q0, q1, N):
+    """
+    Apply the two-qubit gate U to qubits with index q0 and q1 for
+    an N qubit state. Performs this operation in-place, mutating
+    the state vector, to avoid large matrix multiplication. Requires
+    q0 < q1, which Circuit.add ensures by sorting the qubits of every
+    gate (see operators.sort_gate_qubits).
+    """
+    assert q0 < q1
+
+    for i0 in range(1 << q0):
+        # TODO: consider incrementing by the correct amount here rather than doing the multiplication below to get l.
+        for i1 in range(1 << (q1 - q0 - 1)):
+            for i2 in range(1 << ((N - 1) - q1)):
+                l = i0 + (1 << (q0 + 1)) * i1 + (1 << (q1 + 1)) * i2
+                # Create a vector of relevant alpha_js
+                # Below, j(b_q0)(b_q1) represents the index of the
+                # basis state for fixed i0, i1, i2 and with the
+                # bits in position q0 and q1 being b_q0 and b_q1
+                j00 = l
+                j01 = l + (1 << q0)
+                j10 = l + (1 << q1)
+                j11 = l + (1 << q1) + (1 << q0)
+
+                j = np.array([j00, j01, j10, j11])
+                # Update all alpha_js by applying the U gate
+                state[j] = U @ state[j]
+                # Replace the alpha_js in the state vector
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_one_qubit_gate_range(state, U, target_index, start, stop):
+    """
+    Apply a 1-qubit gate U to the amplitude pairs START to STOP - 1 of a state
+    vector. The pairs are enumerated by a single flattened index: the index of
+    the first amplitude of a pair is obtained by inserting a 0 bit at the
+    position of the target qubit. No temporary arrays are allocated. All 2^(N-1)
+    pairs make a full application of the gate.
+    """
+    u00, u01, u10, u11 = U[0, 0], U[0, 1], U[1, 0], U[1, 1]
+    stride = 1 << target_index
+    low_mask = stride - 1
+    for k in range(start, stop):
+        c0 = ((k & ~low_mask) << 1) | (k & low_mask)
+        c1 = c0 | stride
+        a0 = state[c0]
+        a1 = state[c1]
+        state[c0] = u00 * a0 + u01 * a1
+        state[c1] = u10 * a0 + u11 * a1
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_two_qubit_gate_range(state, U, q0, q1, start, stop):
+    """
+    Apply a 2-qubit gate U to the groups of four amplitudes START to STOP - 1 of
+    a state vector, enumerated by a single flattened index in which 0 bits are
+    inserted at the positions of both target qubits. Bit 0 of the row and
+    column indices of U refers to q0, bit 1 to q1; q0 > q1 is allowed. All
+    2^(N-2) groups make a full application of the gate.
+    """
+    low, high = min(q0, q1), max(q0, q1)
+    low_mask = (1 << low) - 1
+    high_mask = (1 << high) - 1
+    b0 = 1 << q0
+    b1 = 1 << q1
+    for k in range(start, stop):
+        l = ((k & ~low_mask) << 1) | (k & low_mask)
+        l = ((l & ~high_mask) << 1) | (l & high_mask)
+        j00 = l
+        j01 = l | b0
+        j10 = l | b1
+        j11 = l | b0 | b1
+        a00 = state[j00]
+        a01 = state[j01]
+        a10 = state[j10]
+        a11 = state[j11]
+        state[j00] = U[0, 0] * a00 + U[0, 1] * a01 + U[0, 2] * a10 + U[0, 3] * a11
+        state[j01] = U[1, 0] * a00 + U[1, 1] * a01 + U[1, 2] * a10 + U[1, 3] * a11
+        state[j10] = U[2, 0] * a00 + U[2, 1] * a01 + U[2, 2] * a10 + U[2, 3] * a11
+        state[j11] = U[3, 0] * a00 + U[3, 1] * a01 + U[3, 2] * a10 + U[3, 3] * a11
+
+
+@conditional_decorator(njit(parallel=True, cache=True), ENABLE_NUMBA)
+def apply_one_qubit_gate_parallel(state, U, target_index, N):
+    """
+    Parallel version of apply_general_one_qubit_gate_in_place. The 2^(N-1)
+    amplitude pairs are split into blocks of PARALLEL_BLOCK_SIZE pairs that are
+    distributed over threads with prange, each applied by
+    apply_one_qubit_gate_range.
+
+    Runtime complexity: O(2^N / num_threads)
+    Space complexity:   O(2^N)
+    """
+    num_pairs = 1 << (N - 1)
+    block_size = min(PARALLEL_BLOCK_SIZE, num_pairs)
+    for block in prange(num_pairs // block_size):
+        apply_one_qubit_gate_range(state, U, target_index, block * block_size, (block + 1) * block_size)
+
+
+@conditional_decorator(njit(parallel=True, cache=True), ENABLE_NUMBA)
+def apply_two_qubit_gate_parallel(state, U, q0, q1, N):
+    """
+    Parallel version of apply_general_two_qubit_gate_in_place. The 2^(N-2)
+    groups of four amplitudes are split into blocks of PARALLEL_BLOCK_SIZE
+    groups that are distributed over threads with prange, each applied by
+    apply_two_qubit_gate_range. Unlike the serial kernel, q0 > q1 is allowed.
+    """
+    num_groups = 1 << (N - 2)
+    block_size = min(PARALLEL_BLOCK_SIZE, num_groups)
+    for block in prange(num_groups // block_size):
+        apply_two_qubit_gate_range(state, U, q0, q1, block * block_size, (block + 1) * block_size)
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def insert_zero_bits(k, sorted_targets):
+    """Insert a 0 bit into the binary representation of K at each of the positions in SORTED_TARGETS (ascending).
+    Enumerating k over range(2^(N - len(sorted_targets))) thus enumerates the indices of all basis states in which
+    the target qubits are 0."""
+    for target in sorted_targets:
+        low_mask = (1 << target) - 1
+        k = ((k & ~low_mask) << 1) | (k & low_mask)
+    return k
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_diagonal_gate_in_place(state, phases, offsets, sorted_targets, N):
+    """
+    Apply a diagonal gate, acting on the qubits SORTED_TARGETS, to a state
+    vector. Only the basis states of the gate whose phase is not 1 are passed,
+    as PHASES and their OFFSETS (see operators.gate_offsets), so e.g. a Z gate only reads
+    and writes half of the amplitudes.
+    """
+    for k in range(1 << (N - len(sorted_targets))):
+        l = insert_zero_bits(k, sorted_targets)
+        for m in range(len(offsets)):
+            state[l + offsets[m]] *= phases[m]
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_permutation_gate_in_place(state, sources, destinations, phases, sorted_targets, N):
+    """
+    Apply a gate which permutes the basis states of the qubits SORTED_TARGETS,
+    up to phases, to a state vector. Only the basis states which are moved or
+    pick up a phase are passed: the amplitude at offset SOURCES[m] is moved to
+    offset DESTINATIONS[m] and multiplied by PHASES[m]. A CNOT, for instance,
+    only swaps half of the amplitudes of its control=1 subspace.
+    """
+    buffer = np.empty(len(sources), dtype=state.dtype)
+    for k in range(1 << (N - len(sorted_targets))):
+        l = insert_zero_bits(k, sorted_targets)
+        for m in range(len(sources)):
+            buffer[m] = state[l + sources[m]]
+        for m in range(len(sources)):
+            state[l + destinations[m]] = phases[m] * buffer[m]
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_controlled_gate_in_place(state, V, control_mask, target_bit, sorted_targets, N):
+    """
+    Apply a controlled gate, acting on the qubits SORTED_TARGETS, to a state
+    vector. The 2x2 unitary V is applied to the qubit TARGET_BIT (given as
+    2^target) only within the subspace in which all qubits in CONTROL_MASK are
+    1, so just a quarter (for one control) of the amplitudes is touched.
+    """
+    for k in range(1 << (N - len(sorted_targets))):
+        c0 = insert_zero_bits(k, sorted_targets) | control_mask
+        c1 = c0 | target_bit
+        a0 = state[c0]
+        a1 = state[c1]
+        state[c0] = V[0, 0] * a0 + V[0, 1] * a1
+        state[c1] = V[1, 0] * a0 + V[1, 1] * a1
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def apply_dense_gate_in_place(state, U, offsets, sorted_targets, N):
+    """
+    Apply a dense k-qubit gate U to a state vector. For every assignment of the
+    qubits not in SORTED_TARGETS, the 2^k amplitudes at the OFFSETS of the
+    gate's basis states (see operators.gate_offsets) are gathered into a buffer,
+    multiplied by U and scattered back. A single buffer is allocated per call.
+
+    Runtime complexity: O(4^k * 2^(N-k))
+    """
+    dimension = len(offsets)
+    buffer = np.empty(dimension, dtype=state.dtype)
+    for k in range(1 << (N - len(sorted_targets))):
+        l = insert_zero_bits(k, sorted_targets)
+        for m in range(dimension):
+            buffer[m] = state[l + offsets[m]]
+        for row in range(dimension):
+            amplitude = U[row, 0] * buffer[0]
+            for m in range(1, dimension):
+                amplitude += U[row, m] * buffer[m]
+            state[l + offsets[row]] = amplitude
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def run_program(state, opcodes, target_pointers, targets, integer_pointers, integers, value_pointers, values, N):
+    """
+    Apply all gates of a compiled circuit (see compiled.CompiledCircuit) to a
+    state vector, dispatching on the opcode of each gate to the kernel for its
+    kind, without returning to Python in between. Dense 1- and 2-qubit gates go
+    through the unrolled loops, wider ones through the general k-qubit kernel.
+    """
+    for g in range(len(opcodes)):
+        opcode = opcodes[g]
+        sorted_targets = targets[target_pointers[g]:target_pointers[g + 1]]
+        gate_integers = integers[integer_pointers[g]:integer_pointers[g + 1]]
+        gate_values = values[value_pointers[g]:value_pointers[g + 1]]
+        if opcode == OP_DIAGONAL:
+            apply_diagonal_gate_in_place(state, gate_values, gate_integers, sorted_targets, N)
+        elif opcode == OP_PERMUTATION:
+            num_moved = len(gate_values)
+            apply_permutation_gate_in_place(
+                state, gate_integers[:num_moved], gate_integers[num_moved:], gate_values, sorted_targets, N)
+        elif opcode == OP_CONTROLLED:
+            apply_controlled_gate_in_place(
+                state, gate_values.reshape((2, 2)), gate_integers[0], gate_integers[1], sorted_targets, N)
+        elif len(sorted_targets) == 1:
+            apply_one_qubit_gate_range(state, gate_values.reshape((2, 2)), sorted_targets[0], 0, len(state) >> 1)
+        elif len(sorted_targets) == 2:
+            apply_two_qubit_gate_range(
+                state, gate_values.reshape((4, 4)), sorted_targets[0], sorted_targets[1], 0, len(state) >> 2)
+        else:
+            dimension = len(gate_integers)
+            apply_dense_gate_in_place(
+                state, gate_values.reshape((dimension, dimension)), gate_integers, sorted_targets, N)
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def run_program_blocked(state, opcodes, target_pointers, targets, integer_pointers, integers, value_pointers, values,
+                        block_qubits):
+    """
+    Apply all gates of a compiled circuit on the qubits below BLOCK_QUBITS to
+    a state vector, one block of 2^BLOCK_QUBITS consecutive amplitudes at a
+    time: each block stays in cache while every gate is applied to it, so the
+    whole circuit takes a single pass over the state vector.
+    """
+    block = 1 << block_qubits
+    for start in range(0, len(state), block):
+        run_program(state[start:start + block], opcodes, target_pointers, targets, integer_pointers, integers,
+                    value_pointers, values, block_qubits)
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def parity(bits):
+    """Return the parity (0 or 1) of the number of set bits of the 64-bit integer BITS."""
+    bits ^= bits >> 32
+    bits ^= bits >> 16
+    bits ^= bits >> 8
+    bits ^= bits >> 4
+    bits ^= bits >> 2
+    bits ^= bits >> 1
+    return bits & 1
+
+
+@conditional_decorator(njit(cache=True), ENABLE_NUMBA)
+def pauli_group_expectation(state, x_mask, z_masks, out):
+    """
+    Compute sum_i conj(state[i ^ X_MASK]) * (-1)^|i & z| * state[i] for each
+    z in Z_MASKS, into OUT, in a single pass over the state vector. These are
+    the expectation values (up to the phase i^#Y) of all Pauli strings which
+    flip the qubits in X_MASK, i.e. which share a basis rotation: the product of
+    each pair of amplitudes is formed once, for all of them. Nothing is
+    allocated.
+
+    Runtime complexity: O(T * 2^N), for T Pauli strings
+    """
+    for t in range(len(out)):
+        out[t] = 0
+    for i in range(len(state)):
+        product = state[i ^ x_mask].conjugate() * state[i]
+        for t in range(len(z_masks)):
+            if parity(i & z_masks[t]):
+                out[t] -= product
+            else:
+                out[t] += product
+
+
+@conditional_decorator(njit(parallel=True, cache=True), ENABLE_NUMBA)
+def pauli_group_expectation_parallel(state, x_mask, z_masks, out):
+    """
+    The parallel version of pauli_group_expectation. The state vector is split
+    into blocks of PARALLEL_BLOCK_SIZE amplitudes, which are distributed over
+    threads with prange; each block accumulates its own partial sums, which
+    are added up at the end.
+    """
+    block_size = min(PARALLEL_BLOCK_SIZE, len(state))
+    num_blocks = len(state) // block_size
+    partial = np.zeros((num_blocks, len(out)), dtype=out.dtype)
+    for block in prange(num_blocks):
+        for i in range(block * block_size, (block + 1) * block_size):
+            product = state[i ^ x_mask].conjugate() * state[i]
+            for t in range(len(z_masks)):
+                if parity(i & z_masks[t]):
+                    partial[block, t] -= product
+                else:
+                    partial[block, t] += product
+    for t in range(len(out)):
+        out[t] = partial[:, t].sum()
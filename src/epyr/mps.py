@@ -0,0 +1,207 @@
+import numpy as np
+
+from .operators import SWAP
+from .stabilizer import bit_string
+from .state import State, state_dict
+from .epyr_exception import EpyrException
+
+
+class MPSState(State):
+    """An N qubit state represented as a matrix product state: a chain of tensors A[q] of shape (chi_left, 2,
+    chi_right), one per qubit, such that the amplitude of the basis state with bits s_q is the product of the matrices
+    A[0][:, s_0, :] A[1][:, s_1, :] ... A[N-1][:, s_(N-1), :]. The bond dimensions chi stay small for weakly
+    entangled states, e.g. after shallow nearest-neighbour circuits, so that such states take O(N chi^2) memory rather
+    than 2^N amplitudes.
+
+    Circuit.compute applies each gate as a local contraction, see apply_gate. The targets of a gate on several qubits
+    are first brought next to each other by swaps of neighbouring qubits, and moved back afterwards. The contracted
+    block is split again by SVDs, discarding singular values beyond MAX_BOND, and the smallest singular values while
+    the total discarded weight (the sum of their squares, a bound on the infidelity) stays within MAX_ERROR. The
+    state is kept in canonical form around the site being updated, so the discarded weights are exact."""
+
+    def __init__(self, N: int, dtype=np.complex64, max_bond=None, max_error=0.0):
+        """Create the N qubit state |0...>, with at most MAX_BOND as bond dimension (None for no limit), and an error
+        budget of MAX_ERROR for the total weight of the discarded singular values."""
+        self._N = N
+        self._dtype = np.dtype(dtype)
+        self.max_bond = max_bond
+        self.max_error = max_error
+        # The total weight of all singular values discarded so far.
+        self.truncation_error = 0.0
+        self.tensors = []
+        for _ in range(N):
+            tensor = np.zeros((1, 2, 1), dtype=self._dtype)
+            tensor[0, 0, 0] = 1
+            self.tensors.append(tensor)
+        # The orthogonality center: the tensors left of it are left-isometries, those right of it right-isometries.
+        self._center = 0
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def bond_dimensions(self):
+        """Return the N - 1 bond dimensions between neighbouring qubits."""
+        return [tensor.shape[2] for tensor in self.tensors[:-1]]
+
+    @property
+    def state(self):
+        """Return my state vector, by contracting all tensors. Only sensible for small N; use amplitude() otherwise."""
+        psi = self.tensors[0].reshape(2, -1)
+        for q in range(1, self._N):
+            tensor = self.tensors[q]
+            psi = (psi @ tensor.reshape(tensor.shape[0], -1)).reshape(2 ** q, 2, tensor.shape[2])
+            # The new qubit is the most significant bit so far.
+            psi = psi.transpose(1, 0, 2).reshape(2 ** (q + 1), tensor.shape[2])
+        return psi.reshape(-1)
+
+    def amplitude(self, basis_state):
+        """Return the amplitude of BASIS_STATE, given as an index or a bit string (e.g. "0101", qubit 0 last), by a
+        product of N matrices, in O(N chi^2)."""
+        if isinstance(basis_state, str):
+            bits = [int(bit) for bit in reversed(basis_state)]
+        else:
+            bits = [(basis_state >> q) & 1 for q in range(self._N)]
+        vector = np.ones(1, dtype=self._dtype)
+        for tensor, bit in zip(self.tensors, bits):
+            vector = vector @ tensor[:, bit, :]
+        return vector[0]
+
+    def probabilities(self):
+        return np.abs(self.state) ** 2
+
+    def apply_gate(self, gate, indices):
+        """Apply the k-qubit GATE to the qubits with the given sorted INDICES. The qubits are swapped, one neighbour at a
+        time, until they occupy the sites indices[0], ..., indices[0] + k - 1; the k tensors are then contracted with
+        the gate and split again (see _apply_block), and the swaps are undone."""
+        first = indices[0]
+        swaps = []
+        for j, index in enumerate(indices[1:], start=1):
+            for site in range(index - 1, first + j - 1, -1):
+                swaps.append(site)
+                self._apply_block(SWAP, site, 2)
+        self._apply_block(gate, first, len(indices))
+        for site in reversed(swaps):
+            self._apply_block(SWAP, site, 2)
+
+    def _apply_block(self, gate, site, k):
+        """Apply the k-qubit GATE to the qubits at the sites SITE, ..., SITE + k - 1 (bit j of its row and column
+        indices referring to site SITE + j), by contracting their tensors into one, applying the gate, and splitting
+        the result with truncated SVDs, from left to right."""
+        self._move_center(site)
+        theta = self.tensors[site]
+        for q in range(site + 1, site + k):
+            theta = np.tensordot(theta, self.tensors[q], axes=(theta.ndim - 1, 0))
+        left, right = theta.shape[0], theta.shape[-1]
+        # Order the physical axes as the bits of the gate's indices, most significant first, and apply the gate.
+        theta = theta.transpose([0] + list(range(k, 0, -1)) + [k + 1]).reshape(left, 2 ** k, right)
+        theta = np.einsum("mn,lnr->lmr", np.asarray(gate, dtype=self._dtype), theta)
+        theta = theta.reshape((left,) + (2,) * k + (right,)).transpose([0] + list(range(k, 0, -1)) + [k + 1])
+
+        for q in range(site, site + k - 1):
+            rows = theta.shape[0] * 2
+            u, s, vh = np.linalg.svd(theta.reshape(rows, -1), full_matrices=False)
+            keep = self._bond_to_keep(s)
+            s = s[:keep] / np.linalg.norm(s[:keep])
+            self.tensors[q] = u[:, :keep].reshape(theta.shape[0], 2, keep)
+            theta = (s[:, None] * vh[:keep]).reshape((keep,) + theta.shape[2:])
+        self.tensors[site + k - 1] = theta.astype(self._dtype, copy=False)
+        self._center = site + k - 1
+
+    def _bond_to_keep(self, singular_values):
+        """Return the number of SINGULAR_VALUES (in descending order) to keep: at most max_bond, and no fewer than
+        needed to keep the total discarded weight within max_error. The discarded weight is recorded."""
+        weights = singular_values ** 2 / np.sum(singular_values ** 2)
+        # discarded[j] is the weight of all singular values from j on.
+        discarded = np.cumsum(weights[::-1])[::-1]
+        # Weights below the precision of the dtype are rounding errors, which are always dropped.
+        budget = max(self.max_error - self.truncation_error, np.finfo(self._dtype).eps)
+        keep = 1 + int(np.count_nonzero(discarded[1:] > budget))
+        if self.max_bond is not None:
+            keep = min(keep, self.max_bond)
+        if keep < len(singular_values):
+            self.truncation_error += float(discarded[keep])
+        return keep
+
+    def _move_center(self, site):
+        """Move the orthogonality center to SITE by QR decompositions of the tensors in between."""
+        while self._center < site:
+            tensor = self.tensors[self._center]
+            q, r = np.linalg.qr(tensor.reshape(-1, tensor.shape[2]))
+            self.tensors[self._center] = q.reshape(tensor.shape[0], 2, -1)
+            self.tensors[self._center + 1] = np.tensordot(r, self.tensors[self._center + 1], axes=(1, 0))
+            self._center += 1
+        while self._center > site:
+            tensor = self.tensors[self._center]
+            q, r = np.linalg.qr(tensor.reshape(tensor.shape[0], -1).T)
+            self.tensors[self._center] = q.T.reshape(-1, 2, tensor.shape[2])
+            self.tensors[self._center - 1] = np.tensordot(self.tensors[self._center - 1], r.T, axes=(2, 0))
+            self._center -= 1
+
+    def sample_bits(self, shots, rng):
+        """Return a (SHOTS, N) array of the bits of SHOTS measurements of all qubits, drawn with the random generator
+        RNG, without forming the state vector. With the orthogonality center on qubit 0, the qubits are sampled one
+        after another from their distribution conditioned on the bits drawn before, for all shots at once, in
+        O(SHOTS N chi^2)."""
+        self._move_center(0)
+        bits = np.zeros((shots, self._N), dtype=np.uint8)
+        # The (unnormalized) left vectors of each shot, conditioned on its bits so far.
+        vectors = np.ones((shots, 1), dtype=self._dtype)
+        for q, tensor in enumerate(self.tensors):
+            branches = np.einsum("sl,lbr->sbr", vectors, tensor)
+            weights = np.sum(np.abs(branches) ** 2, axis=2)
+            probability_one = weights[:, 1] / np.sum(weights, axis=1)
+            bits[:, q] = rng.random(shots) < probability_one
+            vectors = branches[np.arange(shots), bits[:, q]]
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return bits
+
+    def sample(self, shots, seed=None, qubits=None):
+        """Measure SHOTS copies of the state, and return a dictionary mapping the basis states observed (in the format
+        of State.basis_vector_string) to the number of times they were observed, as in Circuit.sample."""
+        bits = self.sample_bits(shots, np.random.default_rng(seed))
+        if qubits is not None:
+            bits = bits[:, qubits]
+        outcomes, counts = np.unique(bits, axis=0, return_counts=True)
+        return dict({bit_string(outcome): int(count) for outcome, count in zip(outcomes, counts)})
+
+    def measure(self, rng=None):
+        """Perform a complete measurement on the state, and return the index of the observed basis state."""
+        bits = self.sample_bits(1, np.random.default_rng() if rng is None else rng)[0]
+        return int(bit_string(bits)[1:-1], 2)
+
+    def __repr__(self):
+        return f"MPSState - {self._N} qubits, bond dimensions {self.bond_dimensions}"
+
+    @classmethod
+    def custom(cls, bit_string, dtype=np.complex64, max_bond=None, max_error=0.0):
+        state = cls(len(bit_string), dtype=dtype, max_bond=max_bond, max_error=max_error)
+        for q, bit in enumerate(reversed(bit_string)):
+            if bit == "1":
+                state.tensors[q][0, :, 0] = [0, 1]
+        return state
+
+    @classmethod
+    def common(cls, state_name, dtype=np.complex64, max_bond=None, max_error=0.0):
+        if state_name not in state_dict:
+            raise EpyrException("State with this name is not available.")
+        return cls.from_vector(state_dict[state_name], dtype=dtype, max_bond=max_bond, max_error=max_error)
+
+    @classmethod
+    def from_vector(cls, state_vector, dtype=np.complex64, max_bond=None, max_error=0.0):
+        """Create the matrix product state of the dense STATE_VECTOR, by splitting off one qubit at a time with SVDs,
+        starting from qubit 0."""
+        N = int(np.log2(len(state_vector)))
+        state = cls(N, dtype=dtype, max_bond=max_bond, max_error=max_error)
+        # Qubit 0 is the least significant bit, i.e. the last axis of the (2,)*N view; put it first.
+        rest = np.asarray(state_vector, dtype=dtype).reshape((2,) * N).transpose(list(reversed(range(N))))
+        rest = rest.reshape(1, -1)
+        for q in range(N - 1):
+            u, s, vh = np.linalg.svd(rest.reshape(rest.shape[0] * 2, -1), full_matrices=False)
+            keep = state._bond_to_keep(s)
+            state.tensors[q] = u[:, :keep].reshape(rest.shape[0], 2, keep)
+            rest = s[:keep, None] * vh[:keep]
+        state.tensors[N - 1] = rest.reshape(rest.shape[0], 2, 1).astype(dtype, copy=False)
+        state._center = N - 1
+        return state
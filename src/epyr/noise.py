@@ -0,0 +1,121 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from .operators import X, Y, Z, I, sort_gate_qubits, classify_gate
+from .state import State
+from .epyr_exception import EpyrException
+
+
+class KrausChannel:
+    """A noise channel rho -> sum_k K_k rho K_k^dagger, given by its Kraus operators K_k, each a (2^k x 2^k) matrix
+    acting on the same k qubits. Channels are attached to the gates of a circuit with Circuit.add_noise."""
+
+    def __init__(self, operators, name="kraus"):
+        """Create the channel with the Kraus OPERATORS, which must satisfy sum_k K_k^dagger K_k = I."""
+        self.operators = [np.asarray(operator, dtype=np.complex128) for operator in operators]
+        self.name = name
+        dim = len(self.operators[0])
+        if any(operator.shape != (dim, dim) for operator in self.operators) or dim & (dim - 1):
+            raise EpyrException("The Kraus operators must be square matrices of the same power of 2 size.")
+        if not np.allclose(sum(operator.conj().T @ operator for operator in self.operators), np.eye(dim)):
+            raise EpyrException("The Kraus operators are not trace preserving.")
+
+    @property
+    def num_qubits(self):
+        return int(np.log2(len(self.operators[0])))
+
+    @property
+    def superoperator(self):
+        """Return the (4^k x 4^k) matrix of the channel acting on the 2k qubits of a density matrix viewed as a
+        vector (see state.DensityMatrix): the k column qubits are the low bits of its indices, the k row qubits the
+        high bits. This is the only superoperator ever formed, for k qubits rather than N."""
+        return sum(np.kron(operator, operator.conj()) for operator in self.operators)
+
+    def sorted(self, indices):
+        """Return the sorted INDICES, and the channel with its operators permuted to act on them, as in
+        operators.sort_gate_qubits."""
+        operators = [sort_gate_qubits(operator, list(indices))[1] for operator in self.operators]
+        return sorted(indices), KrausChannel(operators, self.name)
+
+    def kraus_gates(self, dtype):
+        """Return (operator, kind) pairs of my Kraus operators, cast to DTYPE, and their gate kind (see
+        operators.classify_gate), ready for the kernels."""
+        gates = [np.asarray(operator, dtype=dtype) for operator in self.operators]
+        return [(gate, classify_gate(gate)) for gate in gates]
+
+    def __repr__(self):
+        return f"KrausChannel - {self.name} on {self.num_qubits} qubit(s)"
+
+
+def depolarizing(p):
+    """Return the single qubit depolarizing channel, which replaces the state of the qubit by the maximally mixed
+    state with probability P."""
+    if not 0 <= p <= 1:
+        raise EpyrException("The depolarizing probability must lie in [0, 1].")
+    return KrausChannel([np.sqrt(1 - 3 * p / 4) * I] + [np.sqrt(p / 4) * pauli for pauli in (X, Y, Z)],
+                        name=f"depolarizing({p})")
+
+
+def amplitude_damping(gamma):
+    """Return the single qubit amplitude damping channel, which decays |1> to |0> with probability GAMMA."""
+    if not 0 <= gamma <= 1:
+        raise EpyrException("The damping probability must lie in [0, 1].")
+    return KrausChannel([np.array([[1, 0], [0, np.sqrt(1 - gamma)]]), np.array([[0, np.sqrt(gamma)], [0, 0]])],
+                        name=f"amplitude_damping({gamma})")
+
+
+class ReadoutError:
+    """A classical error in the readout of every measured qubit: a 0 is read as 1 with probability P01, and a 1 as 0
+    with probability P10. Set it as the readout_error of a Circuit to apply it to the outcomes of its measurements."""
+
+    def __init__(self, p01, p10=None):
+        """Create the readout error. By default, the error is symmetric: P10 = P01."""
+        self.p01 = p01
+        self.p10 = p01 if p10 is None else p10
+
+    def apply(self, outcomes, num_qubits, rng):
+        """Return the basis state indices OUTCOMES of measurements of NUM_QUBITS qubits, with every bit flipped with
+        the probability of a readout error, drawn with the random generator RNG."""
+        outcomes = np.array(outcomes, dtype=np.int64)
+        for qubit in range(num_qubits):
+            bits = (outcomes >> qubit) & 1
+            flips = rng.random(len(outcomes)) < np.where(bits == 1, self.p10, self.p01)
+            outcomes ^= flips.astype(np.int64) << qubit
+        return outcomes
+
+    def __repr__(self):
+        return f"ReadoutError - p01={self.p01}, p10={self.p10}"
+
+
+def run_trajectories(circuit, num_trajectories, seed=None, processes=None):
+    """Run NUM_TRAJECTORIES Monte-Carlo trajectories of the noisy CIRCUIT (see Circuit.compute_trajectory), which
+    only ever hold a pure state of 2^N amplitudes, rather than the 4^N entries of a density matrix. If PROCESSES is
+    greater than 1, the trajectories are distributed over a pool of that many (spawned) processes. Returns the mean of
+    the probabilities of the final states, which estimates the diagonal of the density matrix, and an array holding
+    one measurement outcome of the final state of every trajectory."""
+    seeds = np.random.SeedSequence(seed).spawn(num_trajectories)
+    if processes is None or processes <= 1:
+        results = [trajectory_block(circuit, seeds)]
+    else:
+        blocks = [seeds[i::processes] for i in range(processes) if seeds[i::processes]]
+        with ProcessPoolExecutor(len(blocks), mp_context=get_context("spawn")) as pool:
+            results = list(pool.map(trajectory_block, [circuit] * len(blocks), blocks))
+    probabilities = sum(result[0] for result in results) / num_trajectories
+    return probabilities, np.concatenate([result[1] for result in results])
+
+
+def trajectory_block(circuit, seeds):
+    """Run one trajectory of CIRCUIT for each of the SEEDS (np.random.SeedSequence instances). Returns the sum of the
+    probabilities of the final states, and one measurement outcome of each final state."""
+    from .circuit import sample_basis_indices
+    probabilities = np.zeros(2 ** circuit.N)
+    outcomes = np.empty(len(seeds), dtype=np.int64)
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        state = State(circuit.N, dtype=circuit.dtype)
+        circuit.compute_trajectory(state, rng)
+        trajectory_probabilities = state.probabilities()
+        probabilities += trajectory_probabilities
+        outcomes[i] = sample_basis_indices(trajectory_probabilities, 1, rng)[0]
+    return probabilities, outcomes
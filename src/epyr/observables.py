@@ -0,0 +1,139 @@
+import numpy as np
+
+from .epyr_exception import EpyrException
+
+PAULI_LETTERS = "IXYZ"
+
+
+class PauliString:
+    """A tensor product of Pauli operators on the qubits of a state. Qubit q is acted on by X if bit q of x_mask is
+    set and Z if bit q of z_mask is set (Y if both are), so that P|i> = i^num_y (-1)^|i & z_mask| |i ^ x_mask>."""
+
+    def __init__(self, paulis):
+        """Create the Pauli string given by PAULIS: either a string of the letters I, X, Y and Z, written like the bit
+        strings of State.custom (the last letter acts on qubit 0), e.g. "XIZ" is X on qubit 2 and Z on qubit 0, or a
+        dictionary mapping qubits to letters, e.g. {2: "X", 0: "Z"}."""
+        if isinstance(paulis, str):
+            paulis = {qubit: letter for qubit, letter in enumerate(reversed(paulis))}
+        self.x_mask = 0
+        self.z_mask = 0
+        self.num_y = 0
+        for qubit, letter in paulis.items():
+            if letter not in PAULI_LETTERS:
+                raise EpyrException(f"{letter} is not a Pauli operator; use one of {PAULI_LETTERS}.")
+            if letter in "XY":
+                self.x_mask |= 1 << qubit
+            if letter in "YZ":
+                self.z_mask |= 1 << qubit
+            self.num_y += letter == "Y"
+
+    @property
+    def num_qubits(self):
+        """Return the number of qubits up to the highest qubit I act on nontrivially."""
+        return (self.x_mask | self.z_mask).bit_length()
+
+    def commutes_with(self, other):
+        """Return whether I commute with the Pauli string OTHER."""
+        return (bin(self.x_mask & other.z_mask).count("1") + bin(self.z_mask & other.x_mask).count("1")) % 2 == 0
+
+    def __repr__(self):
+        letters = ["IXZY"[((self.x_mask >> q) & 1) | (((self.z_mask >> q) & 1) << 1)] for q in range(self.num_qubits)]
+        return f"PauliString - {''.join(reversed(letters)) or 'I'}"
+
+
+class PauliSum:
+    """A weighted sum of Pauli strings, sum_t c_t P_t, such as the Hamiltonian of a variational algorithm."""
+
+    def __init__(self, terms):
+        """Create the sum of the TERMS, a list of (coefficient, Pauli string) tuples, where each Pauli string is a
+        PauliString or anything its constructor accepts."""
+        self.terms = [(coefficient, paulis if isinstance(paulis, PauliString) else PauliString(paulis))
+                      for coefficient, paulis in terms]
+
+    def groups(self):
+        """Return my terms grouped by their X masks, as a dictionary mapping each X mask to a tuple of the Z masks of
+        the terms in the group, as an int64 array, and their coefficients times the phase i^num_y, as a complex128
+        array. The terms in a group flip the same qubits, so they commute and share a basis rotation, and the
+        expectation values of a whole group are computed in a single pass over the state (see expectation_value)."""
+        grouped = dict()
+        for coefficient, pauli in self.terms:
+            z_masks, weights = grouped.setdefault(pauli.x_mask, ([], []))
+            z_masks.append(pauli.z_mask)
+            weights.append(coefficient * 1j ** pauli.num_y)
+        return dict({x_mask: (np.array(z_masks, dtype=np.int64), np.array(weights, dtype=np.complex128))
+                     for x_mask, (z_masks, weights) in grouped.items()})
+
+    def __repr__(self):
+        return "PauliSum - " + " + ".join(f"{coefficient} * {pauli}" for coefficient, pauli in self.terms)
+
+
+def expectation_value(state_vector, observable, parallel=False, enable_numba=True):
+    """Return <psi|O|psi> for the state vector psi = STATE_VECTOR and the OBSERVABLE O, a PauliString, a PauliSum, or
+    anything the PauliString constructor accepts. Every group of terms which share an X mask (see PauliSum.groups) is
+    evaluated in a single pass over the state vector, which allocates nothing, by the Numba kernel
+    pauli_group_expectation (or its PARALLEL version, which splits the state into blocks processed on all threads).
+    The result is real if all coefficients are."""
+    from .circuit import select_kernel
+    observable = as_pauli_sum(observable)
+    N = int(np.log2(len(state_vector)))
+    if any(pauli.num_qubits > N for _, pauli in observable.terms):
+        raise EpyrException("The observable acts on more qubits than the state has.")
+    kernel = select_kernel("pauli_group_expectation_parallel" if parallel else "pauli_group_expectation",
+                           enable_numba)
+    total = 0j
+    for x_mask, (z_masks, weights) in observable.groups().items():
+        values = np.empty(len(z_masks), dtype=np.complex128)
+        kernel(state_vector, x_mask, z_masks, values)
+        total += np.dot(weights, values)
+    return observable_result(total, observable)
+
+
+def sparse_expectation_value(indices, amplitudes, observable):
+    """Return <psi|O|psi> as in expectation_value, for the sparse state psi with the nonzero AMPLITUDES at the sorted
+    basis INDICES (see state.SparseState). Only the stored amplitudes are visited."""
+    observable = as_pauli_sum(observable)
+    total = 0j
+    for x_mask, (z_masks, weights) in observable.groups().items():
+        partners = indices ^ x_mask
+        positions = np.minimum(np.searchsorted(indices, partners), len(indices) - 1)
+        present = indices[positions] == partners
+        products = np.conj(amplitudes[positions[present]]) * amplitudes[present]
+        for z_mask, weight in zip(z_masks, weights):
+            total += weight * np.sum(np.where(bit_parity(indices[present] & z_mask), -products, products))
+    return observable_result(total, observable)
+
+
+def density_matrix_expectation_value(matrix, observable):
+    """Return Tr(rho O) for the density MATRIX rho and the OBSERVABLE O, as in expectation_value. Since P|i> is a
+    multiple of |i ^ x_mask>, only the entries rho[i, i ^ x_mask] are read for each group of terms."""
+    observable = as_pauli_sum(observable)
+    basis = np.arange(len(matrix), dtype=np.int64)
+    total = 0j
+    for x_mask, (z_masks, weights) in observable.groups().items():
+        entries = matrix[basis, basis ^ x_mask]
+        for z_mask, weight in zip(z_masks, weights):
+            total += weight * np.sum(np.where(bit_parity(basis & z_mask), -entries, entries))
+    return observable_result(total, observable)
+
+
+def bit_parity(values):
+    """Return the parity of the number of set bits of each of the int64 VALUES."""
+    values = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        values ^= values >> shift
+    return values & 1
+
+
+def as_pauli_sum(observable):
+    """Return the OBSERVABLE as a PauliSum, if it is a single Pauli string."""
+    if isinstance(observable, PauliSum):
+        return observable
+    return PauliSum([(1, observable)])
+
+
+def observable_result(total, observable):
+    """Return the expectation value TOTAL of the OBSERVABLE as a float, if all its coefficients are real, since it is
+    Hermitian then, and as a complex number otherwise."""
+    if all(np.isrealobj(coefficient) for coefficient, _ in observable.terms):
+        return float(total.real)
+    return complex(total)
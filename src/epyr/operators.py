@@ -1,27 +1,28 @@
 import numpy as np
 
-__all__ = ["I", "X", "Y", "Z", "H", "S", "CNOT", "SWAP"]
+__all__ = ["I", "X", "Y", "Z", "H", "S", "T", "CNOT", "SWAP", "TOFFOLI", "RX", "RY", "RZ", "PHASE"]
 
 
 # Define inverse sqrt(2) for convenience
 INV2 = 1 / np.sqrt(2)
 
-# Define common quantum logic gates
+# Define common quantum logic gates. They are all stored as complex128, and cast to the precision of a circuit once,
+# when they are added to it.
 # Pauli Gates
-I = np.eye(2)
-X = np.array([[0, 1], [1, 0]])
-Y = np.array([[0, -1j], [1j, 0]])
-Z = np.array([[1, 0], [0, -1]])
+I = np.eye(2, dtype=np.complex128)
+X = np.array([[0, 1], [1, 0]], dtype=np.complex128)
+Y = np.array([[0, -1j], [1j, 0]], dtype=np.complex128)
+Z = np.array([[1, 0], [0, -1]], dtype=np.complex128)
 
 # Clifford Gates
-H = INV2 * np.array([[1, 1], [1, -1]], dtype=np.complex64)
-S = np.array([[1, 0], [0, 1j]])
+H = INV2 * np.array([[1, 1], [1, -1]], dtype=np.complex128)
+S = np.array([[1, 0], [0, 1j]], dtype=np.complex128)
 
 # T Gate
 T = np.array([
     [1, 0],
     [0, np.exp(1j * np.pi / 4)]
-])
+], dtype=np.complex128)
 
 # Controlled NOT (CNOT) Gate (2-qubit operator)
 CNOT = np.array([
@@ -29,14 +30,18 @@ CNOT = np.array([
     [0, 0, 0, 1],
     [0, 0, 1, 0],
     [0, 1, 0, 0]
-], dtype=np.complex64)
+], dtype=np.complex128)
 
 SWAP = np.array([
     [1, 0, 0, 0],
     [0, 0, 1, 0],
     [0, 1, 0, 0],
     [0, 0, 0, 1]
-])
+], dtype=np.complex128)
+
+# Toffoli (CCNOT) Gate (3-qubit operator), controlled by the first two qubits it acts on.
+TOFFOLI = np.eye(8, dtype=np.complex128)
+TOFFOLI[[3, 7]] = TOFFOLI[[7, 3]]
 
 operator_dict = dict({
     "I": I,
@@ -45,18 +50,112 @@ operator_dict = dict({
     "Z": Z,
     "H": H,
     "S": S,
+    "T": T,
     "CNOT": CNOT,
     "SWAP": SWAP,
+    "TOFFOLI": TOFFOLI,
+})
+
+
+# Gate kinds, which determine the kernel used to apply a gate. See classify_gate().
+DIAGONAL = "diagonal"
+PERMUTATION = "permutation"
+CONTROLLED = "controlled"
+DENSE = "dense"
+
+
+# Rotation gates, functions of an angle THETA.
+def RX(theta):
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    return np.array([[c, -1j * s], [-1j * s, c]], dtype=np.complex128)
+
+
+def RY(theta):
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    return np.array([[c, -s], [s, c]], dtype=np.complex128)
+
+
+def RZ(theta):
+    return np.array([[np.exp(-0.5j * theta), 0], [0, np.exp(0.5j * theta)]], dtype=np.complex128)
+
+
+def PHASE(theta):
+    return np.array([[1, 0], [0, np.exp(1j * theta)]], dtype=np.complex128)
+
+
+# The rotation gates by name, with the kind of gate they are for any angle. (At particular angles, they may be of a
+# more specialised kind, e.g. RX(0) is diagonal, but a gate whose angle is a parameter must keep a fixed kind.)
+rotation_dict = dict({
+    "RX": (RX, DENSE),
+    "RY": (RY, DENSE),
+    "RZ": (RZ, DIAGONAL),
+    "PHASE": (PHASE, DIAGONAL),
 })
 
 
+def classify_gate(gate: np.ndarray) -> str:
+    """Return the kind of the (2^k x 2^k) GATE, in order of precedence:
+    DIAGONAL     - the gate only multiplies basis states by phases (Z, S, T).
+    PERMUTATION  - every row and column has a single non-zero entry, i.e. the gate permutes basis states up to
+                   phases (X, Y, CNOT, SWAP).
+    CONTROLLED   - the gate acts as a 2x2 unitary on a single target qubit if all its other qubits are 1, and as the
+                   identity otherwise. See controlled_gate_target().
+    DENSE        - any other gate."""
+    nonzero = gate != 0
+    if not np.any(nonzero & ~np.eye(len(gate), dtype=bool)):
+        return DIAGONAL
+    if np.all(np.count_nonzero(nonzero, axis=0) == 1) and np.all(np.count_nonzero(nonzero, axis=1) == 1):
+        return PERMUTATION
+    if controlled_gate_target(gate) is not None:
+        return CONTROLLED
+    return DENSE
+
+
+def controlled_gate_target(gate: np.ndarray):
+    """If the (2^k x 2^k) GATE, with k >= 2, is a (k-1)-fold controlled 2x2 unitary, returns the bit of the gate's
+    basis state indices which refers to the target qubit. All other bits refer to control qubits. Returns None
+    otherwise."""
+    if len(gate) < 4:
+        return None
+    all_ones = len(gate) - 1
+    for target in range(int(np.log2(len(gate)))):
+        block = [all_ones ^ (1 << target), all_ones]
+        expected = np.eye(len(gate), dtype=gate.dtype)
+        expected[np.ix_(block, block)] = gate[np.ix_(block, block)]
+        if np.array_equal(expected, gate):
+            return target
+    return None
+
+
+def gate_offsets(indices):
+    """Return an array whose mth entry is the offset, within the state vector, of the mth basis state of a gate
+    acting on the qubits with the given INDICES. That is, the sum of 2^indices[j] over all set bits j of m."""
+    m = np.arange(2 ** len(indices))
+    offsets = np.zeros(len(m), dtype=np.int64)
+    for j, index in enumerate(indices):
+        offsets += ((m >> j) & 1) << index
+    return offsets
+
+
+def sort_gate_qubits(gate: np.ndarray, indices):
+    """Given a (2^k x 2^k) GATE acting on the qubits INDICES, in any order, returns the sorted indices and the
+    equivalent gate acting on them. Rather than multiplying by swap gates, the row and column bits of the gate are
+    permuted by transposing its (2,)*2k tensor view, which preserves its dtype."""
+    k = len(indices)
+    order = np.argsort(indices)
+    # Axis a of either half of the tensor view refers to bit k - 1 - a. The new bit j is the old bit order[j].
+    axes = [k - 1 - order[k - 1 - a] for a in range(k)]
+    tensor = gate.reshape((2,) * (2 * k)).transpose(axes + [k + axis for axis in axes])
+    return [indices[j] for j in order], np.ascontiguousarray(tensor.reshape(2 ** k, 2 ** k))
+
+
 def swap_two_qubit_gate(gate: np.ndarray) -> np.ndarray:
-    """Given a unitary 2x2 operator GATE, which operates on |q1 q0>,
-    returns the operator equivalent of acting it on |q0 q1>. This is
-    done by first applying a swap gate, then the operator, and then
-    unswapping (SWAP^dagger = SWAP). TODO: there may be a more efficient way to do this.
+    """Given a unitary 4x4 operator GATE, which operates on |q1 q0>,
+    returns the operator equivalent of acting it on |q0 q1>. This
+    is the same as applying a swap gate, then the operator, and then
+    unswapping (SWAP^dagger = SWAP).
     """
-    return SWAP @ gate @ SWAP
+    return sort_gate_qubits(gate, [1, 0])[1]
 
 
 class Operator:
@@ -0,0 +1,74 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from .state import State
+
+
+class Parameter:
+    """A symbolic angle of the rotation gates of a circuit (see Circuit.rx and friends), whose value is bound later,
+    with Circuit.bind, possibly many times. Multiplying a parameter by a number gives a ScaledParameter, e.g. for
+    the weighted angles of a QAOA layer."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __mul__(self, factor):
+        return ScaledParameter(self, factor)
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return f"Parameter - {self.name}"
+
+
+class ScaledParameter:
+    """The angle FACTOR * PARAMETER."""
+
+    def __init__(self, parameter, factor):
+        self.parameter = parameter
+        self.factor = factor
+
+    def __mul__(self, factor):
+        return ScaledParameter(self.parameter, self.factor * factor)
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return f"ScaledParameter - {self.factor} * {self.parameter.name}"
+
+
+def run_sweep(circuit, values, state=None, observable=None, processes=None):
+    """Compute CIRCUIT for each row of VALUES, a (P x number of parameters) array of parameter sets ordered as
+    circuit.parameters, on a copy of STATE (by default, |0...>). Returns a (P,) array of the expectation values of
+    OBSERVABLE (see State.expectation), if one is passed, and the (P x 2^N) array of the final state vectors otherwise.
+    If PROCESSES is greater than 1, the rows are split into that many blocks, each computed by a (spawned) process
+    which receives the circuit once and only rebinds it between rows, see sweep_block."""
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    state_vector = State(circuit.N, dtype=circuit.dtype).state if state is None else state.state
+    if processes is None or processes <= 1:
+        return sweep_block(circuit, values, state_vector, observable)
+    blocks = [block for block in np.array_split(values, processes) if len(block)]
+    with ProcessPoolExecutor(len(blocks), mp_context=get_context("spawn")) as pool:
+        results = pool.map(sweep_block, [circuit] * len(blocks), blocks, [state_vector] * len(blocks),
+                           [observable] * len(blocks))
+        return np.concatenate(list(results))
+
+
+def sweep_block(circuit, values, state_vector, observable=None):
+    """Compute CIRCUIT for each row of VALUES, as in run_sweep, in this process. The circuit is fused and compiled at
+    most once; every row only refills the matrices of its parameterized gates, see Circuit.bind."""
+    if observable is None:
+        results = np.empty((len(values), len(state_vector)), dtype=circuit.dtype)
+    else:
+        results = np.empty(len(values))
+    state = State(circuit.N, dtype=circuit.dtype)
+    for i, row in enumerate(values):
+        circuit.bind(row)
+        state.state[:] = state_vector
+        circuit.compute(state)
+        if observable is None:
+            results[i] = state.state
+        else:
+            results[i] = state.expectation(observable)
+    return results
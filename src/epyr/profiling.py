@@ -0,0 +1,71 @@
+import numpy as np
+from time import perf_counter
+
+from .operators import DIAGONAL, PERMUTATION, CONTROLLED
+
+
+class Profiler:
+    """Records the wall time, kind, target qubits and (estimated) bytes of the state vector touched by every gate
+    application of the computations it is passed to, e.g. c.compute(state, profiler=p). Each record is a dictionary,
+    which is also passed to CALLBACK, if given, as soon as the gate has been applied. Computations without a profiler
+    are not instrumented at all."""
+
+    def __init__(self, callback=None):
+        self.records = []
+        self._callback = callback
+
+    def profile(self, gates, state_vector, specialized=True):
+        """Yield the (gate, indices, kind) tuples of GATES, recording the time between handing out a gate and being
+        asked for the next one, i.e. the time the caller took to apply it to STATE_VECTOR. SPECIALIZED indicates
+        whether gates are applied with the kernels specialized to their kind, which touch fewer amplitudes."""
+        for gate, indices, kind in gates:
+            start = perf_counter()
+            yield gate, indices, kind
+            seconds = perf_counter() - start
+            record = dict({
+                "gate": len(self.records),
+                "kind": kind,
+                "qubits": list(indices),
+                "seconds": seconds,
+                "bytes": bytes_touched(gate, kind, state_vector.nbytes) if specialized else 2 * state_vector.nbytes,
+            })
+            self.records.append(record)
+            if self._callback is not None:
+                self._callback(record)
+
+    def report(self):
+        """Return a dictionary with the totals of the records, overall and per kind of gate, and the records
+        themselves, slowest first."""
+        kinds = dict()
+        for record in self.records:
+            totals = kinds.setdefault(record["kind"], dict({"gates": 0, "seconds": 0.0, "bytes": 0}))
+            totals["gates"] += 1
+            totals["seconds"] += record["seconds"]
+            totals["bytes"] += record["bytes"]
+        return dict({
+            "gates": len(self.records),
+            "seconds": sum(record["seconds"] for record in self.records),
+            "bytes": sum(record["bytes"] for record in self.records),
+            "kinds": kinds,
+            "records": sorted(self.records, key=lambda record: record["seconds"], reverse=True),
+        })
+
+    def reset(self):
+        """Discard all records."""
+        self.records = []
+
+
+def bytes_touched(gate, kind, nbytes):
+    """Estimate the number of bytes read and written when GATE, of the given KIND, is applied with its specialized
+    kernel (see circuit.apply_gate_in_place) to a state vector of NBYTES bytes."""
+    if kind == DIAGONAL:
+        fraction = np.count_nonzero(np.diag(gate) != 1) / len(gate)
+    elif kind == PERMUTATION:
+        destinations = np.argmax(gate != 0, axis=0)
+        sources = np.arange(len(gate))
+        fraction = np.count_nonzero((destinations != sources) | (gate[destinations, sources] != 1)) / len(gate)
+    elif kind == CONTROLLED:
+        fraction = 2 / len(gate)
+    else:
+        fraction = 1
+    return int(2 * nbytes * fraction)
@@ -0,0 +1,136 @@
+import struct
+
+import numpy as np
+
+from .circuit import Circuit
+from .noise import ReadoutError
+from .operators import DIAGONAL, PERMUTATION, CONTROLLED, DENSE
+from .state import State, MemmapState
+from .epyr_exception import EpyrException
+
+# The version of the formats written by this module; files of other versions are rejected.
+FORMAT_VERSION = 2
+STATE_MAGIC = b"EPYRSTAT"
+CIRCUIT_MAGIC = b"EPYRCIRC"
+# The amplitude buffer of a state file starts at a multiple of this many bytes, a cache line.
+ALIGNMENT = 64
+# The number of amplitudes written at a time by save_state.
+CHUNK_SIZE = 1 << 20
+
+# The header of a state file: magic, version, N, dtype (as np.dtype.str) and the offset of the amplitude buffer.
+STATE_HEADER = struct.Struct("<8sHI8sQ")
+# The header of a circuit file: magic, version, N, dtype, fusion width, the numbers of gates, of qubit indices in the
+# gate table, and of matrices in the pool, and the probabilities p01 and p10 of the readout error (NaN if there is none).
+CIRCUIT_HEADER = struct.Struct("<8sHI8sIIIIdd")
+# A row of the gate table: the index of its matrix in the pool, its kind, and the offset and number of its qubits.
+GATE_TABLE = np.dtype([("matrix", "<u4"), ("kind", "u1"), ("qubits", "<u4"), ("num_qubits", "u1")])
+# A row of the matrix pool: the offset of the matrix, in elements, and its number of qubits.
+MATRIX_TABLE = np.dtype([("offset", "<u8"), ("num_qubits", "u1")])
+KINDS = [DIAGONAL, PERMUTATION, CONTROLLED, DENSE]
+
+
+def save_state(state, path, chunk_size=CHUNK_SIZE):
+    """Write the state vector of STATE to the file at PATH: a header, followed by the 2^N amplitudes, little endian,
+    starting at an aligned offset. The amplitudes are written CHUNK_SIZE at a time, so that a MemmapState is streamed
+    from its file rather than read into memory."""
+    vector = state.state
+    N = int(np.log2(len(vector)))
+    dtype = vector.dtype.newbyteorder("<")
+    offset = -(-STATE_HEADER.size // ALIGNMENT) * ALIGNMENT
+    with open(path, "wb") as file:
+        file.write(STATE_HEADER.pack(STATE_MAGIC, FORMAT_VERSION, N, dtype.str.encode(), offset))
+        file.write(bytes(offset - STATE_HEADER.size))
+        for start in range(0, len(vector), chunk_size):
+            file.write(np.ascontiguousarray(vector[start:start + chunk_size], dtype=dtype).data)
+
+
+def load_state(path, mode="r", chunk_size=1 << 20):
+    """Return the state saved at PATH by save_state. By default, it is a MemmapState mapping the amplitude buffer
+    without copying, opened with MODE ("r", "r+" or "c", see MemmapState.open) and processed in chunks of CHUNK_SIZE
+    amplitudes. If MODE is None, the amplitudes are read into a State instead."""
+    with open(path, "rb") as file:
+        header = file.read(STATE_HEADER.size)
+    magic, version, N, dtype, offset = unpack_header(STATE_HEADER, header, STATE_MAGIC)
+    if mode is None:
+        state = State(N, dtype=dtype)
+        state.state = np.fromfile(path, dtype=dtype, count=2 ** N, offset=offset)
+        return state
+    return MemmapState.open(path, N, dtype=dtype, offset=offset, mode=mode, chunk_size=chunk_size)
+
+
+def save_circuit(circuit, path):
+    """Write the gates of CIRCUIT to the file at PATH: a header, a table of one packed row per gate (see GATE_TABLE),
+    the qubits of all gates, and a pool of the distinct gate matrices, each stored once however often it is used.
+    Parameterized gates are saved with their bound matrices, and the readout error in the header; noise is not
+    supported."""
+    if circuit.noise:
+        raise EpyrException("Circuits with noise cannot be serialized.")
+    circuit._check_bound()
+    dtype = np.dtype(circuit.dtype).newbyteorder("<")
+    gates = circuit.gates
+    table = np.zeros(len(gates), dtype=GATE_TABLE)
+    qubits, matrices, pool = [], [], dict()
+    for row, (gate, indices, kind) in zip(table, gates):
+        matrix = np.ascontiguousarray(gate, dtype=dtype)
+        key = matrix.tobytes()
+        if key not in pool:
+            pool[key] = len(matrices)
+            matrices.append(matrix)
+        row["matrix"], row["kind"] = pool[key], KINDS.index(kind)
+        row["qubits"], row["num_qubits"] = len(qubits), len(indices)
+        qubits.extend(indices)
+    matrix_table = np.zeros(len(matrices), dtype=MATRIX_TABLE)
+    matrix_table["num_qubits"] = [int(np.log2(len(matrix))) for matrix in matrices]
+    matrix_table["offset"][1:] = np.cumsum([matrix.size for matrix in matrices])[:-1]
+    readout = circuit.readout_error
+    p01, p10 = (np.nan, np.nan) if readout is None else (readout.p01, readout.p10)
+    with open(path, "wb") as file:
+        file.write(CIRCUIT_HEADER.pack(CIRCUIT_MAGIC, FORMAT_VERSION, circuit.N, dtype.str.encode(),
+                                       circuit.fusion_width, len(gates), len(qubits), len(matrices), p01, p10))
+        file.write(table.data)
+        file.write(np.asarray(qubits, dtype="<u4").data)
+        file.write(matrix_table.data)
+        for matrix in matrices:
+            file.write(matrix.data)
+
+
+def load_circuit(path):
+    """Return the circuit saved at PATH by save_circuit. Its gates share the matrices of the pool."""
+    with open(path, "rb") as file:
+        data = file.read()
+    _, _, N, dtype, fusion_width, num_gates, num_qubits, num_matrices, p01, p10 = unpack_header(
+        CIRCUIT_HEADER, data[:CIRCUIT_HEADER.size], CIRCUIT_MAGIC)
+    offset = CIRCUIT_HEADER.size
+    table = np.frombuffer(data, dtype=GATE_TABLE, count=num_gates, offset=offset)
+    offset += table.nbytes
+    qubits = np.frombuffer(data, dtype="<u4", count=num_qubits, offset=offset).tolist()
+    offset += 4 * num_qubits
+    matrix_table = np.frombuffer(data, dtype=MATRIX_TABLE, count=num_matrices, offset=offset)
+    offset += matrix_table.nbytes
+    elements = np.frombuffer(data, dtype=dtype, offset=offset).astype(np.dtype(dtype).newbyteorder("="))
+    matrices = []
+    for start, k in matrix_table:
+        size = 2 ** int(k)
+        matrices.append(elements[int(start):int(start) + size * size].reshape(size, size))
+
+    circuit = Circuit(N, fusion_width=fusion_width, dtype=dtype)
+    circuit._gates = [(matrices[row["matrix"]], qubits[row["qubits"]:row["qubits"] + row["num_qubits"]],
+                       KINDS[row["kind"]]) for row in table]
+    if not np.isnan(p01):
+        circuit.readout_error = ReadoutError(p01, p10)
+    return circuit
+
+
+def unpack_header(header_struct, header, magic):
+    """Unpack the bytes HEADER with HEADER_STRUCT, checking the MAGIC bytes and the version. The dtype field (the
+    fourth) is returned as a np.dtype."""
+    if len(header) < header_struct.size:
+        raise EpyrException("The file is truncated.")
+    fields = list(header_struct.unpack(header))
+    if fields[0] != magic:
+        raise EpyrException("The file is not in the expected format.")
+    if fields[1] != FORMAT_VERSION:
+        raise EpyrException(f"The file has format version {fields[1]}, but only version {FORMAT_VERSION} is "
+                            f"supported.")
+    fields[3] = np.dtype(fields[3].rstrip(b"\0").decode())
+    return fields
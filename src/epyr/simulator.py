@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import numpy as np
+
+from .state import State
+from .epyr_exception import EpyrException
+
+# The number of recent job latencies kept for the metrics.
+LATENCY_WINDOW = 1000
+
+
+class Simulator:
+    """An asyncio front end which computes circuits on a managed pool of (spawned) worker processes, e.g. for a service
+    handling many simulation requests:
+
+        async with Simulator(processes=4) as simulator:
+            counts = await simulator.submit(circuit, shots=1000)
+
+    Jobs are collected for BATCH_WINDOW seconds after one arrives, and grouped by structure (see job_key): jobs whose
+    circuits have the same N, dtype and gates, and which start from plain dense states, are computed together, as one
+    call of Circuit.compute_batch on up to MAX_BATCH input states. All other jobs (noisy circuits, or other kinds of
+    states) run on their own. At most PROCESSES batches run at a time; the group holding the oldest job is dispatched
+    next, so that a stream of small jobs cannot starve a large one.
+
+    At most MAX_PENDING jobs are accepted at a time: further calls of submit wait for a free slot (backpressure). A
+    job which has not finished within its TIMEOUT raises asyncio.TimeoutError; its result is discarded. The metrics
+    property reports the queue depth, throughput, and latencies.
+
+    A circuit and its input state are copied (pickled) when they are submitted, so that binding new parameter values,
+    or changing the state, afterwards does not affect the jobs already submitted. If a worker process dies (e.g. out of
+    memory), the jobs of its batch fail with the BrokenProcessPool error, and the pool is replaced for later jobs."""
+
+    def __init__(self, processes=None, max_pending=256, max_batch=32, batch_window=0.002):
+        self.processes = os.cpu_count() if processes is None else processes
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._pool = None
+        self._dispatcher = None
+        # Jobs submitted but not yet grouped, and the groups of jobs waiting for a free worker, by job_key.
+        self._incoming = []
+        self._groups = dict()
+        self._running = 0
+        # The number of jobs holding one of the MAX_PENDING slots.
+        self.pending = 0
+        # The error which stopped the dispatcher, if any; later submissions fail with it.
+        self._failure = None
+        self._slots = None
+        self._wakeup = None
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._waits = deque(maxlen=LATENCY_WINDOW)
+        # The times at which the recent jobs completed.
+        self._completions = deque(maxlen=LATENCY_WINDOW)
+
+    async def submit(self, circuit, state=None, shots=None, seed=None, timeout=None):
+        """Compute CIRCUIT on a copy of STATE (by default, its initial_state()), in a worker process. Returns the
+        dictionary of measurement counts of SHOTS shots (see Circuit.sample), drawn with SEED, if SHOTS is given, and
+        the final state otherwise. Waits for a free slot first, if MAX_PENDING jobs are pending. Raises
+        asyncio.TimeoutError if the job has not finished after TIMEOUT seconds (waiting for a slot included)."""
+        self._start()
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        key = job_key(circuit, state)
+        if state is not None:
+            # Batched jobs only need the state vector.
+            state = np.array(state.state) if key is not None else pickle.dumps(state)
+        job = Job(pickle.dumps(circuit), state, shots, seed, key, loop.create_future())
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        self.pending += 1
+        try:
+            if self._failure is not None:
+                raise EpyrException(f"The simulator has stopped: {self._failure!r}")
+            job.submitted = time.perf_counter()
+            self._incoming.append(job)
+            self._wakeup.set()
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                return await asyncio.wait_for(asyncio.shield(job.future), remaining)
+            except asyncio.TimeoutError:
+                job.future.cancel()
+                self.timed_out += 1
+                raise
+        finally:
+            self.pending -= 1
+            self._slots.release()
+
+    @property
+    def queue_depth(self):
+        """Return the number of jobs waiting to be dispatched to a worker."""
+        return len(self._incoming) + sum(len(group) for group in self._groups.values())
+
+    @property
+    def metrics(self):
+        """Return a dictionary of the queue depth, the number of pending jobs (holding a slot, queued or running), the
+        number of running batches, the counts of completed, failed and
+        timed out jobs and of batches, the throughput (the rate at which the recent jobs completed, in jobs per second),
+        and the mean and 95th percentile of the recent latencies (from submission to result) and queue waits (from
+        submission to dispatch), in seconds."""
+        metrics = dict(queue_depth=self.queue_depth, pending=self.pending, running_batches=self._running,
+                       completed=self.completed, failed=self.failed, timed_out=self.timed_out, batches=self.batches)
+        span = self._completions[-1] - self._completions[0] if len(self._completions) > 1 else 0.0
+        metrics["throughput"] = (len(self._completions) - 1) / span if span > 0 else 0.0
+        for name, values in [("latency", self._latencies), ("queue_wait", self._waits)]:
+            metrics[f"mean_{name}"] = float(np.mean(values)) if values else 0.0
+            metrics[f"p95_{name}"] = float(np.percentile(values, 95)) if values else 0.0
+        return metrics
+
+    def _start(self):
+        """Create the pool and the dispatcher task, on the first submission."""
+        if self._dispatcher is not None:
+            return
+        if self.processes < 1:
+            raise EpyrException("A simulator needs at least one process.")
+        self._pool = ProcessPoolExecutor(self.processes, mp_context=get_context("spawn"))
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def _dispatch(self):
+        """Group the incoming jobs, and run the group holding the oldest job whenever a worker is free. Should this
+        fail, all queued jobs, and later submissions, fail with the error, rather than waiting forever."""
+        try:
+            await self._dispatch_loop()
+        except Exception as error:
+            self._failure = error
+            for job in self._incoming + [job for group in self._groups.values() for job in group]:
+                if not job.future.done():
+                    job.future.set_exception(error)
+                    self.failed += 1
+            self._incoming, self._groups = [], dict()
+            raise
+
+    async def _dispatch_loop(self):
+        """The loop of _dispatch."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._incoming and self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            for job in self._incoming:
+                self._groups.setdefault(job.key, []).append(job)
+            self._incoming = []
+            for key in list(self._groups):
+                self._groups[key] = [job for job in self._groups[key] if not job.future.done()]
+                if not self._groups[key]:
+                    del self._groups[key]
+            while self._groups and self._running < self.processes:
+                key = min(self._groups, key=lambda k: self._groups[k][0].submitted)
+                jobs = self._groups[key][:1 if key is None else self.max_batch]
+                self._groups[key] = self._groups[key][len(jobs):]
+                if not self._groups[key]:
+                    del self._groups[key]
+                self._launch(jobs)
+
+    def _launch(self, jobs):
+        """Run JOBS, which share a job_key, as one batch in the pool."""
+        dispatched = time.perf_counter()
+        for job in jobs:
+            self._waits.append(dispatched - job.submitted)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._pool, run_batch, [job.circuit for job in jobs], [job.state for job in jobs],
+                [job.shots for job in jobs], [job.seed for job in jobs], jobs[0].key is not None)
+        except Exception as error:
+            # E.g. a BrokenProcessPool, after a worker died.
+            self._fail(jobs, error)
+            return
+        self._running += 1
+        self.batches += 1
+        future.add_done_callback(lambda done: self._finish(jobs, done))
+
+    def _finish(self, jobs, done):
+        """Hand the results of the batch DONE to its JOBS, and wake up the dispatcher."""
+        self._running -= 1
+        self._wakeup.set()
+        finished = time.perf_counter()
+        error = done.exception()
+        if error is not None:
+            self._fail(jobs, error)
+            return
+        for i, job in enumerate(jobs):
+            if not job.future.done():
+                job.future.set_result(done.result()[i])
+                self.completed += 1
+                self._latencies.append(finished - job.submitted)
+                self._completions.append(finished)
+
+    def _fail(self, jobs, error):
+        """Hand ERROR to JOBS. If it is due to a broken pool, replace the pool, so that later jobs can run."""
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_exception(error)
+                self.failed += 1
+        if isinstance(error, BrokenProcessPool):
+            self._pool.shutdown(wait=False)
+            self._pool = ProcessPoolExecutor(self.processes, mp_context=get_context("spawn"))
+
+    async def close(self):
+        """Stop the dispatcher, and shut the pool down once the running batches have finished."""
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        await asyncio.get_running_loop().run_in_executor(None, self._pool.shutdown)
+        self._dispatcher, self._pool = None, None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+    def __repr__(self):
+        return f"Simulator - {self.processes} processes, {self.queue_depth} jobs queued, {self._running} batches running"
+
+
+class Job:
+    """A job submitted to a Simulator, resolved through its FUTURE. CIRCUIT is the pickled circuit, and STATE a copy of
+    the state vector, for jobs which can be batched, or the pickled state (or None, for the initial state)."""
+
+    def __init__(self, circuit, state, shots, seed, key, future):
+        self.circuit = circuit
+        self.state = state
+        self.shots = shots
+        self.seed = seed
+        self.key = key
+        self.future = future
+        self.submitted = time.perf_counter()
+
+
+def job_key(circuit, state):
+    """Return the key of the jobs which can be batched with a job computing CIRCUIT on STATE, or None if it must run on
+    its own: the hash of N, the dtype, the gates (matrices and qubits) and the readout error of the circuit. Only
+    noiseless circuits, starting from a plain State of their dtype (or from |0...>, unless they are Clifford circuits,
+    which are faster on a StabilizerState) are batched."""
+    circuit._check_bound()
+    if circuit.noise or (state is None and circuit.is_clifford) or \
+            (state is not None and (type(state) is not State or state.dtype != circuit.dtype)):
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((circuit.N, np.dtype(circuit.dtype).str)).encode())
+    for gate, indices, _ in circuit.gates:
+        digest.update(np.ascontiguousarray(gate).data)
+        digest.update(np.asarray(indices, dtype=np.int64).data)
+    readout_error = circuit.readout_error
+    digest.update(str(None if readout_error is None else (readout_error.p01, readout_error.p10)).encode())
+    return digest.hexdigest()
+
+
+def run_batch(circuits, states, shots, seeds, batched):
+    """Compute the pickled CIRCUITS[i] on STATES[i], and return the counts of SHOTS[i] shots drawn with SEEDS[i], or the
+    final state, for each. If BATCHED, the circuits share their gates, and the states are state vectors (or None for
+    |0...>), computed together with Circuit.compute_batch of the first circuit; otherwise they are pickled States (or
+    None for the circuit's initial_state()), computed one by one. Every job is sampled with its own circuit."""
+    circuits = [pickle.loads(circuit) for circuit in circuits]
+    circuit = circuits[0]
+    if batched:
+        vectors = np.stack([State(circuit.N, dtype=circuit.dtype).state if vector is None else vector
+                            for vector in states])
+        if len(vectors) > 1:
+            circuit.compute_batch(vectors)
+        else:
+            state = State(circuit.N, dtype=circuit.dtype)
+            state.state = vectors[0]
+            circuit.compute(state)
+            vectors[0] = state.state
+        states = []
+        for vector in vectors:
+            state = State(circuit.N, dtype=circuit.dtype)
+            state.state = vector
+            states.append(state)
+    else:
+        states = [job_circuit.initial_state() if state is None else pickle.loads(state)
+                  for job_circuit, state in zip(circuits, states)]
+        for job_circuit, state in zip(circuits, states):
+            job_circuit.compute(state)
+    return [state if count is None else job_circuit.sample(state, count, seed)
+            for job_circuit, state, count, seed in zip(circuits, states, shots, seeds)]
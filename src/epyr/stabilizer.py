@@ -0,0 +1,222 @@
+import numpy as np
+
+from .operators import operator_dict, sort_gate_qubits
+from .epyr_exception import EpyrException
+
+# The Clifford gates the tableau simulates, by the number of qubits they act on. A 2-qubit gate whose control is the
+# higher of its qubits is stored with its bits swapped (see operators.sort_gate_qubits), hence "CNOT_REVERSED".
+CLIFFORD_GATES = {
+    1: {name: operator_dict[name] for name in ["I", "X", "Y", "Z", "H", "S"]},
+    2: {
+        "CNOT": operator_dict["CNOT"],
+        "CNOT_REVERSED": sort_gate_qubits(operator_dict["CNOT"], [1, 0])[1],
+        "SWAP": operator_dict["SWAP"],
+    },
+}
+
+
+def clifford_operations(gates):
+    """Given GATES, in the format of Circuit.gates, returns a list of (name, indices) tuples naming the Clifford gate
+    each of them is (see CLIFFORD_GATES), with the control of a CNOT first. Returns None if any gate is not one of
+    those Clifford gates."""
+    operations = []
+    for gate, indices, _ in gates:
+        name = next((name for name, clifford_gate in CLIFFORD_GATES.get(len(indices), {}).items()
+                     if np.allclose(gate, clifford_gate)), None)
+        if name is None:
+            return None
+        if name == "CNOT_REVERSED":
+            name, indices = "CNOT", [indices[1], indices[0]]
+        operations.append((name, list(indices)))
+    return operations
+
+
+class StabilizerState:
+    """An N qubit stabilizer state, represented by the tableau of Aaronson and Gottesman (the CHP simulator,
+    arXiv:quant-ph/0406196), which takes O(N^2) bits rather than 2^N amplitudes. Rows 0 to N-1 of the tableau are the
+    destabilizers and rows N to 2N-1 the stabilizers of the state; row i is the Pauli product with X on the qubits
+    where x[i] is set, Z on those where z[i] is set, and sign (-1)^r[i]. Clifford gates update the tableau in O(N).
+
+    Measuring in the computational basis only ever yields the outcomes in the affine subspace x0 + span(B), where B
+    are the X parts of the stabilizers, and all of them equally likely. This subspace is found once, in O(N^3), after
+    which every shot costs a single product of random bits with B. See sample()."""
+
+    def __init__(self, N: int):
+        """Create the N qubit state |0...>, which is stabilized by Z on every qubit."""
+        self._N = N
+        self.x = np.zeros((2 * N, N), dtype=np.uint8)
+        self.z = np.zeros((2 * N, N), dtype=np.uint8)
+        self.r = np.zeros(2 * N, dtype=np.uint8)
+        self.x[np.arange(N), np.arange(N)] = 1
+        self.z[np.arange(N, 2 * N), np.arange(N)] = 1
+        # The outcomes of a measurement of all qubits, see outcome_space(). Cleared whenever a gate is applied.
+        self._outcome_space = None
+
+    @property
+    def N(self):
+        return self._N
+
+    @classmethod
+    def custom(cls, bit_string):
+        """Create the stabilizer state corresponding to the passed bit string, e.g. "010" -> |010>."""
+        state = cls(len(bit_string))
+        for qubit, bit in enumerate(reversed(bit_string)):
+            if bit == "1":
+                state.apply("X", [qubit])
+        return state
+
+    def apply(self, name, indices):
+        """Apply the Clifford gate with the given NAME (see CLIFFORD_GATES) to the qubits with the given INDICES."""
+        if name == "I":
+            return
+        if name == "X":
+            self._x(*indices)
+        elif name == "Y":
+            self._y(*indices)
+        elif name == "Z":
+            self._z(*indices)
+        elif name == "H":
+            self._h(*indices)
+        elif name == "S":
+            self._s(*indices)
+        elif name == "CNOT":
+            self._cnot(*indices)
+        elif name == "SWAP":
+            a, b = indices
+            self._cnot(a, b)
+            self._cnot(b, a)
+            self._cnot(a, b)
+        else:
+            raise EpyrException(f"{name} is not a Clifford gate the tableau can simulate.")
+        self._outcome_space = None
+
+    def _x(self, a):
+        self.r ^= self.z[:, a]
+
+    def _y(self, a):
+        self.r ^= self.x[:, a] ^ self.z[:, a]
+
+    def _z(self, a):
+        self.r ^= self.x[:, a]
+
+    def _h(self, a):
+        self.r ^= self.x[:, a] & self.z[:, a]
+        self.x[:, a], self.z[:, a] = self.z[:, a].copy(), self.x[:, a].copy()
+
+    def _s(self, a):
+        self.r ^= self.x[:, a] & self.z[:, a]
+        self.z[:, a] ^= self.x[:, a]
+
+    def _cnot(self, control, target):
+        self.r ^= self.x[:, control] & self.z[:, target] & (self.x[:, target] ^ self.z[:, control] ^ 1)
+        self.x[:, target] ^= self.x[:, control]
+        self.z[:, control] ^= self.z[:, target]
+
+    def outcome_space(self):
+        """Return (x0, B): the bits of one outcome of a measurement of all qubits, and a (rank, N) array of the bits
+        of a basis of the outcome space, such that the outcomes are x0 + any combination of the rows of B (mod 2),
+        all with probability 2^-rank. The result is cached until the next gate is applied."""
+        if self._outcome_space is None:
+            self._outcome_space = stabilizer_outcome_space(
+                self.x[self._N:].copy(), self.z[self._N:].copy(), self.r[self._N:].copy())
+        return self._outcome_space
+
+    def sample_bits(self, shots, rng, qubits=None):
+        """Return a (SHOTS, n) array of the bits measured in SHOTS measurements of QUBITS (by default, all qubits),
+        drawn with the random generator RNG. Column j refers to QUBITS[j]."""
+        x0, basis = self.outcome_space()
+        if qubits is not None:
+            x0, basis = x0[qubits], basis[:, qubits]
+        coefficients = rng.integers(0, 2, size=(shots, len(basis))).astype(np.float32)
+        # The float product is exact, as long as the rank is below 2^24.
+        return ((coefficients @ basis.astype(np.float32)).astype(np.int64) % 2).astype(np.uint8) ^ x0
+
+    def sample(self, shots, seed=None, qubits=None):
+        """Measure SHOTS copies of the state, and return a dictionary mapping the basis states observed (in the format
+        of State.basis_vector_string) to the number of times they were observed. See Circuit.sample."""
+        bits = self.sample_bits(shots, np.random.default_rng(seed), qubits)
+        outcomes, counts = np.unique(bits, axis=0, return_counts=True)
+        return dict({bit_string(outcome): int(count) for outcome, count in zip(outcomes, counts)})
+
+    def measure(self, rng=None):
+        """Perform a complete measurement on the state, and return the index of the observed basis state."""
+        if rng is None:
+            rng = np.random.default_rng()
+        return int(bit_string(self.sample_bits(1, rng)[0])[1:-1], 2)
+
+    def probabilities(self):
+        """Return the dense array of the probabilities of the 2^N basis states. Only sensible for small N."""
+        x0, basis = self.outcome_space()
+        weights = (np.int64(1) << np.arange(self._N, dtype=np.int64))
+        combinations = (np.arange(2 ** len(basis))[:, None] >> np.arange(len(basis))) & 1
+        outcomes = (combinations @ basis.astype(np.int64)) % 2 ^ x0
+        probabilities = np.zeros(2 ** self._N)
+        probabilities[outcomes @ weights] = 2.0 ** -len(basis)
+        return probabilities
+
+    def __repr__(self):
+        return f"StabilizerState - {self._N} qubits"
+
+
+def bit_string(bits):
+    """Return the basis state, as in State.basis_vector_string, whose jth qubit is BITS[j]."""
+    return "|" + "".join("1" if bit else "0" for bit in reversed(bits)) + ">"
+
+
+def stabilizer_outcome_space(x, z, r):
+    """Given the N stabilizers (X bits X, Z bits Z and sign bits R) of a stabilizer state, return (x0, B), as in
+    StabilizerState.outcome_space. The stabilizers are brought to row echelon form in their X parts by Gaussian
+    elimination, multiplying rows as Pauli products. The rows with nonzero X parts then form B, while the remaining
+    rows are products of Z with sign (-1)^r, whose +1 eigenspaces fix x0: z . x0 = r (mod 2)."""
+    N = x.shape[1]
+    rank = 0
+    for column in range(N):
+        rows = rank + np.flatnonzero(x[rank:, column])
+        if len(rows) == 0:
+            continue
+        pivot = rows[0]
+        if pivot != rank:
+            for array in (x, z, r):
+                array[[rank, pivot]] = array[[pivot, rank]]
+        others = np.flatnonzero(x[:, column])
+        others = others[others != rank]
+        multiply_rows(x, z, r, others, rank)
+        rank += 1
+    basis = x[:rank].copy()
+
+    # The remaining rows are products of Z alone, which multiply without phases. Reduce them to reduced row echelon
+    # form, after which setting x0 to r on the pivot columns (and 0 elsewhere) solves z . x0 = r.
+    z_rows, signs = z[rank:], r[rank:]
+    x0 = np.zeros(N, dtype=np.uint8)
+    pivot_row = 0
+    for column in range(N):
+        rows = pivot_row + np.flatnonzero(z_rows[pivot_row:, column])
+        if len(rows) == 0:
+            continue
+        pivot = rows[0]
+        z_rows[[pivot_row, pivot]] = z_rows[[pivot, pivot_row]]
+        signs[[pivot_row, pivot]] = signs[[pivot, pivot_row]]
+        others = np.flatnonzero(z_rows[:, column])
+        others = others[others != pivot_row]
+        z_rows[others] ^= z_rows[pivot_row]
+        signs[others] ^= signs[pivot_row]
+        pivot_row += 1
+    pivot_columns = np.argmax(z_rows[:pivot_row], axis=1)
+    x0[pivot_columns] = signs[:pivot_row]
+    return x0, basis
+
+
+def multiply_rows(x, z, r, targets, source):
+    """Multiply each of the rows TARGETS of the tableau (X, Z, R) by the row SOURCE, from the left, tracking the sign
+    of the products (the rowsum operation of the CHP simulator, for many target rows at once)."""
+    if len(targets) == 0:
+        return
+    x1, z1 = x[source].astype(np.int64), z[source].astype(np.int64)
+    x2, z2 = x[targets].astype(np.int64), z[targets].astype(np.int64)
+    # The power of i picked up by multiplying the single qubit Paulis (x1, z1) and (x2, z2), for every qubit.
+    g = np.where((x1 == 1) & (z1 == 1), z2 - x2,
+                 np.where(x1 == 1, z2 * (2 * x2 - 1), np.where(z1 == 1, x2 * (1 - 2 * z2), 0)))
+    phase = (2 * r[targets].astype(np.int64) + 2 * int(r[source]) + g.sum(axis=1)) % 4
+    r[targets] = (phase == 2).astype(np.uint8)
+    x[targets] ^= x[source]
+    z[targets] ^= z[source]
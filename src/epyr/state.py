@@ -1,3 +1,7 @@
+import os
+import tempfile
+import weakref
+
 import numpy as np
 
 from .epyr_exception import EpyrException
@@ -5,7 +9,8 @@ from .epyr_exception import EpyrException
 from typing import Union
 
 __all__ = ["up", "down", "plus", "minus", "right", "left",
-           "phi_plus", "phi_minus", "psi_plus", "psi_minus", "State"]
+           "phi_plus", "phi_minus", "psi_plus", "psi_minus", "State", "MemmapState", "SparseState",
+           "DensityMatrix"]
 
 # Common single qubit states
 up = np.array([1, 0])
@@ -42,12 +47,13 @@ class State:
     EQUALITY_TOLERANCE_RELATIVE = 1e-05
     EQUALITY_TOLERANCE_ABSOLUTE = 1e-05
 
-    def __init__(self, N: int):
+    def __init__(self, N: int, dtype=np.complex64):
         """Create an N qubit state, which is represented as a (ket) vector with 2^N entries. The vector is taken to be in the
         standard (computational) basis. By default, the state is initialized to the 0th basis state: |0...›.
-        The state is represented by a (2^N,) np.ndarray."""
+        The state is represented by a (2^N,) np.ndarray of the given DTYPE (complex64 or complex128), which should
+        match the precision of the circuits it is passed to."""
 
-        self.state: np.ndarray = np.zeros(2 ** N, dtype=np.complex64)  # NOTE: may want to consider using complex128/256
+        self.state: np.ndarray = np.zeros(2 ** N, dtype=dtype)
         self.state[0] = 1
         self._N = N
 
@@ -55,10 +61,24 @@ class State:
     def N(self):
         return self._N
 
+    @property
+    def dtype(self):
+        """Return the dtype of my state vector."""
+        return self.state.dtype
+
     def probabilities(self):
         """Returns an array where the ith entry corresponds to the probability of measuring my state
-        to be the ith basis state."""
-        return np.real(self.state.conj() * self.state)
+        to be the ith basis state. Only real arrays are allocated, rather than the complex conj() * state."""
+        probabilities = np.square(self.state.real)
+        probabilities += np.square(self.state.imag)
+        return probabilities
+
+    def expectation(self, observable, parallel=False, enable_numba=True):
+        """Return the expectation value of the OBSERVABLE (see observables.PauliString and observables.PauliSum) in my
+        state, computed in a single pass over my state vector per group of terms, without copies. If PARALLEL is set,
+        the amplitudes are split into blocks processed on all threads. See observables.expectation_value."""
+        from .observables import expectation_value
+        return expectation_value(self.state, observable, parallel, enable_numba)
 
     @staticmethod
     def basis_vector_string(n: int, i: int):
@@ -110,26 +130,258 @@ class State:
         return f"State - {self.state}"
 
     @classmethod
-    def common(cls, state_name):
+    def common(cls, state_name, dtype=np.complex64):
         """Create a State instance from a set of common states."""
         if state_name not in state_dict:
             raise EpyrException("State with this name is not available.")
         state_vector = state_dict[state_name]
         N = int(np.log2(len(state_vector)))
-        state = cls(N)
-        state.state = state_vector
+        state = cls(N, dtype=dtype)
+        state.state[:] = state_vector
         return state
 
     @classmethod
-    def custom(cls, bit_string):
+    def custom(cls, bit_string, dtype=np.complex64):
         """
         Create the state vector corresponding to the passed bit string.
         E.g: "000" -> |000>, "010" -> |010>, "1" -> |1>
         """
         N = len(bit_string)
-        state_vector = np.zeros(2 ** N)
+        state = cls(N, dtype=dtype)
+        state.state[0] = 0
         basis_index = int(bit_string, 2)
-        state_vector[basis_index] = 1
-        state = cls(N)
-        state.state = state_vector
+        state.state[basis_index] = 1
+        return state
+
+
+class MemmapState(State):
+    """A state whose vector is a np.memmap of a file on local disk, for states which do not fit into memory.
+    Circuit.compute applies gates to it one chunk of CHUNK_SIZE amplitudes at a time (see
+    circuit.apply_gate_chunked), and records the number of bytes each gate read and wrote in io_bytes.
+
+    A state created without a path lives in a temporary file, which is deleted by close() (or when the state is garbage
+    collected). The state can be used as a context manager."""
+
+    def __init__(self, N: int, path=None, chunk_size: int = 1 << 20, dtype=np.complex64):
+        """Create an N qubit state |0...>, stored in the file at PATH, or in a new temporary file. CHUNK_SIZE must be
+        a power of 2."""
+        if chunk_size < 1 or chunk_size & (chunk_size - 1):
+            raise EpyrException("The chunk size must be a power of 2.")
+        temporary = path is None
+        if temporary:
+            handle, path = tempfile.mkstemp(suffix=".state")
+            os.close(handle)
+        self.path = path
+        self._finalizer = weakref.finalize(self, remove_file, path if temporary else None)
+        self.state: np.ndarray = np.memmap(path, dtype=dtype, mode="w+", shape=(2 ** N,))
+        self.state[0] = 1
+        self._N = N
+        # Chunks hold 2^chunk_qubits amplitudes, so qubits below chunk_qubits are local to a chunk.
+        self.chunk_qubits = min(int(np.log2(chunk_size)), N)
+        # Bytes read from and written to the file by each gate applied to this state, in order.
+        self.io_bytes = []
+
+    @classmethod
+    def open(cls, path, N: int, dtype=np.complex64, offset: int = 0, mode="r+", chunk_size: int = 1 << 20):
+        """Return the N qubit state whose 2^N amplitudes are stored in the existing file at PATH, from byte OFFSET on,
+        mapped without copying. MODE is that of np.memmap: "r+" writes gates through to the file, "c" keeps them in
+        memory, and "r" makes the state read-only."""
+        if chunk_size < 1 or chunk_size & (chunk_size - 1):
+            raise EpyrException("The chunk size must be a power of 2.")
+        state = cls.__new__(cls)
+        state.path = path
+        state.state = np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(2 ** N,))
+        state._N = N
+        state.chunk_qubits = min(int(np.log2(chunk_size)), N)
+        state.io_bytes = []
+        state._finalizer = weakref.finalize(state, remove_file, None)
+        return state
+
+    def close(self):
+        """Delete my file, if it is a temporary file. The state must not be used afterwards."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def remove_file(path):
+    """Delete the file at PATH, unless PATH is None or the file is already gone."""
+    if path is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SparseState(State):
+    """A state which stores only its nonzero probability amplitudes, as a sorted array of basis indices and the matching
+    array of amplitudes. This allows simulating circuits on many qubits whose states stay sparse, such as reversible
+    arithmetic built from X, CNOT and Toffoli gates. Circuit.compute applies gates to it with
+    circuit.apply_sparse_gate, and switches it to a dense vector as soon as more than THRESHOLD of the 2^N amplitudes
+    are nonzero, after which it behaves like a State."""
+
+    def __init__(self, N: int, dtype=np.complex64, threshold: float = 1 / 16):
+        """Create an N qubit state |0...>. THRESHOLD is the fill ratio above which the state becomes dense."""
+        self._N = N
+        self._dtype = np.dtype(dtype)
+        self.threshold = threshold
+        self.indices: np.ndarray = np.zeros(1, dtype=np.int64)
+        self.amplitudes: np.ndarray = np.ones(1, dtype=dtype)
+        # The dense state vector, once the state has become dense.
+        self._vector = None
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def dense(self):
+        """Whether the state has switched to a dense vector."""
+        return self._vector is not None
+
+    @property
+    def state(self):
+        """Return my state vector. While the state is sparse, this is a new dense array, which is not written back."""
+        if self.dense:
+            return self._vector
+        vector = np.zeros(2 ** self._N, dtype=self._dtype)
+        vector[self.indices] = self.amplitudes
+        return vector
+
+    @state.setter
+    def state(self, vector):
+        self._vector = np.asarray(vector, dtype=self._dtype)
+
+    @property
+    def fill_ratio(self):
+        """Return the fraction of the 2^N amplitudes which are stored."""
+        if self.dense:
+            return 1.0
+        return len(self.indices) / 2 ** self._N
+
+    def update(self, indices, amplitudes):
+        """Replace my nonzero amplitudes, which must be sorted by basis index, and switch to a dense vector if the fill
+        ratio exceeds my threshold."""
+        self.indices = indices
+        self.amplitudes = amplitudes
+        if self.fill_ratio > self.threshold:
+            self.densify()
+
+    def densify(self):
+        """Switch to a dense state vector."""
+        if not self.dense:
+            self._vector = self.state
+            self.indices = None
+            self.amplitudes = None
+
+    def probabilities(self):
+        if self.dense:
+            return super().probabilities()
+        probabilities = np.zeros(2 ** self._N)
+        probabilities[self.indices] = np.abs(self.amplitudes) ** 2
+        return probabilities
+
+    def expectation(self, observable, parallel=False, enable_numba=True):
+        if self.dense:
+            return super().expectation(observable, parallel, enable_numba)
+        from .observables import sparse_expectation_value
+        return sparse_expectation_value(self.indices, self.amplitudes, observable)
+
+    def show(self):
+        if self.dense:
+            super().show()
+            return
+        print(" ".join(f"({amplitude}){State.basis_vector_string(self._N, int(index))}"
+                       for index, amplitude in zip(self.indices, self.amplitudes)))
+
+    def __str__(self):
+        if self.dense:
+            return super().__str__()
+        return str(dict(zip(self.indices.tolist(), self.amplitudes.tolist())))
+
+    def __repr__(self):
+        return f"SparseState - {self}"
+
+    @classmethod
+    def common(cls, state_name, dtype=np.complex64):
+        if state_name not in state_dict:
+            raise EpyrException("State with this name is not available.")
+        return cls.from_vector(state_dict[state_name], dtype=dtype)
+
+    @classmethod
+    def custom(cls, bit_string, dtype=np.complex64):
+        state = cls(len(bit_string), dtype=dtype)
+        state.indices[0] = int(bit_string, 2)
+        return state
+
+    @classmethod
+    def from_vector(cls, state_vector, dtype=np.complex64, threshold: float = 1 / 16):
+        """Create a sparse state holding the nonzero entries of the dense STATE_VECTOR."""
+        N = int(np.log2(len(state_vector)))
+        state = cls(N, dtype=dtype, threshold=threshold)
+        indices = np.flatnonzero(state_vector).astype(np.int64)
+        state.update(indices, np.asarray(state_vector, dtype=dtype)[indices])
+        return state
+
+
+class DensityMatrix(State):
+    """A mixed state of N qubits, represented by its (2^N x 2^N) density matrix rho. The matrix is stored row-major as
+    a vector of 4^N entries, so that it can be treated as the state vector of 2N qubits: qubits 0 to N-1 of that
+    vector index the columns of rho, and qubits N to 2N-1 its rows. Circuit.compute applies a gate U by applying U to
+    the row qubits and its conjugate to the column qubits, and noise channels by their superoperator on both (see
+    noise.KrausChannel), all with the usual in-place kernels."""
+
+    def __init__(self, N: int, dtype=np.complex64):
+        """Create the N qubit pure state |0...><0...|."""
+        self.state: np.ndarray = np.zeros(4 ** N, dtype=dtype)
+        self.state[0] = 1
+        self._N = N
+
+    @property
+    def matrix(self):
+        """Return the (2^N x 2^N) density matrix, as a view of my state vector."""
+        return self.state.reshape(2 ** self._N, 2 ** self._N)
+
+    def probabilities(self):
+        """Returns the diagonal of the density matrix: the probabilities of measuring each basis state."""
+        return np.real(self.state[::2 ** self._N + 1])
+
+    def expectation(self, observable, parallel=False, enable_numba=True):
+        """Return Tr(rho O) for the OBSERVABLE O, see observables.density_matrix_expectation_value."""
+        from .observables import density_matrix_expectation_value
+        return density_matrix_expectation_value(self.matrix, observable)
+
+    def purity(self):
+        """Return Tr(rho^2), which is 1 for pure states and 2^-N for the maximally mixed state."""
+        return float(np.real(np.vdot(self.state, self.state)))
+
+    def show(self):
+        print(self.matrix)
+
+    def __repr__(self):
+        return f"DensityMatrix - {self.matrix}"
+
+    @classmethod
+    def common(cls, state_name, dtype=np.complex64):
+        if state_name not in state_dict:
+            raise EpyrException("State with this name is not available.")
+        return cls.from_vector(state_dict[state_name], dtype=dtype)
+
+    @classmethod
+    def custom(cls, bit_string, dtype=np.complex64):
+        state_vector = np.zeros(2 ** len(bit_string))
+        state_vector[int(bit_string, 2)] = 1
+        return cls.from_vector(state_vector, dtype=dtype)
+
+    @classmethod
+    def from_vector(cls, state_vector, dtype=np.complex64):
+        """Create the density matrix of the pure state with the given STATE_VECTOR."""
+        N = int(np.log2(len(state_vector)))
+        state = cls(N, dtype=dtype)
+        state.state[:] = np.outer(state_vector, np.conj(state_vector)).ravel()
         return state
@@ -0,0 +1,92 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Number of columns of the circuit unitary computed together, as one batch.
+UNITARY_BLOCK_SIZE = 1 << 10
+
+
+class CircuitOperator:
+    """A lazy representation of the unitary of a circuit, in the style of scipy's LinearOperator. Applying it to a
+    vector runs the circuit on a copy of that vector with the in-place kernels, so at most a few vectors of length 2^N
+    are ever held, rather than a dense 2^N x 2^N matrix. scipy.sparse.linalg.aslinearoperator accepts it as is."""
+
+    def __init__(self, circuit, adjoint=None):
+        """Create the operator of CIRCUIT. ADJOINT may be the operator of the inverse circuit, if already known."""
+        self._circuit = circuit
+        self._adjoint = adjoint
+
+    @property
+    def shape(self):
+        return (2 ** self._circuit.N, 2 ** self._circuit.N)
+
+    @property
+    def dtype(self):
+        return self._circuit.dtype
+
+    @property
+    def H(self):
+        """Return the (lazy) Hermitian adjoint of this operator, i.e. the operator of the inverse circuit."""
+        if self._adjoint is None:
+            self._adjoint = CircuitOperator(self._circuit.adjoint(), adjoint=self)
+        return self._adjoint
+
+    def matvec(self, v):
+        """Return U v, for a vector V of length 2^N."""
+        return self.matmat(np.reshape(v, (-1, 1)))[:, 0]
+
+    def rmatvec(self, v):
+        """Return U^dagger v, for a vector V of length 2^N."""
+        return self.H.matvec(v)
+
+    def matmat(self, V):
+        """Return U V, for a (2^N x m) matrix V. The m columns are computed as a single batch."""
+        batch = np.array(np.transpose(V), dtype=self.dtype)
+        self._circuit.compute_batch(batch)
+        return batch.T
+
+    def rmatmat(self, V):
+        """Return U^dagger V, for a (2^N x m) matrix V."""
+        return self.H.matmat(V)
+
+    def __matmul__(self, other):
+        if np.ndim(other) == 1:
+            return self.matvec(other)
+        return self.matmat(other)
+
+    def to_dense(self, block_size=UNITARY_BLOCK_SIZE, processes=None):
+        """Return the unitary as a dense (2^N x 2^N) matrix. See circuit_unitary()."""
+        return circuit_unitary(self._circuit, block_size, processes)
+
+
+def unitary_columns(circuit, start, stop):
+    """Return the columns START to STOP of the unitary of CIRCUIT, as the rows of a (stop - start, 2^N) array. These are
+    the images of the basis states |start> to |stop - 1>, which are computed as a single batch."""
+    batch = np.zeros((stop - start, 2 ** circuit.N), dtype=circuit.dtype)
+    batch[np.arange(stop - start), np.arange(start, stop)] = 1
+    circuit.compute_batch(batch)
+    return batch
+
+
+def circuit_unitary(circuit, block_size=UNITARY_BLOCK_SIZE, processes=None):
+    """Return the unitary of CIRCUIT as a dense (2^N x 2^N) matrix. Rather than multiplying the 2^N x 2^N embeddings of
+    its gates, the circuit is applied to blocks of BLOCK_SIZE columns of the identity at a time. If PROCESSES is
+    greater than 1, the blocks are distributed over a pool of that many processes. The workers are spawned rather
+    than forked, since forking a process which has started Numba's thread pool can deadlock."""
+    dim = 2 ** circuit.N
+    starts = list(range(0, dim, block_size))
+    stops = [min(start + block_size, dim) for start in starts]
+    if processes is None or processes <= 1:
+        blocks = map(unitary_columns, [circuit] * len(starts), starts, stops)
+        return _assemble(dim, starts, stops, blocks, circuit.dtype)
+    with ProcessPoolExecutor(processes, mp_context=get_context("spawn")) as pool:
+        blocks = pool.map(unitary_columns, [circuit] * len(starts), starts, stops)
+        return _assemble(dim, starts, stops, blocks, circuit.dtype)
+
+
+def _assemble(dim, starts, stops, blocks, dtype):
+    """Collect the blocks of columns returned by unitary_columns into a single matrix."""
+    U = np.empty((dim, dim), dtype=dtype)
+    for start, stop, block in zip(starts, stops, blocks):
+        U[:, start:stop] = block.T
+    return U
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+
+# The gates random_circuit draws from by default: a mix of 1-, 2- and 3-qubit gates, of every kind.
+MIXED_GATES = ("H", "CNOT", "T", "TOFFOLI", "DENSE3")
+
+
+def make_random_circuit(N, num_gates, seed=0, gates=MIXED_GATES, dtype=np.complex128, fusion_width=2):
+    """Return an N qubit circuit of NUM_GATES gates drawn uniformly from GATES, on random qubits. GATES holds names of
+    the operators module (1-qubit gates, or "CNOT", "SWAP", "TOFFOLI"), and "DENSE2" or "DENSE3", a fixed random
+    unitary on 2 or 3 qubits. SEED is an integer, or a np.random.Generator to draw from."""
+    rng = np.random.default_rng(seed)
+    dense = {f"DENSE{k}": np.linalg.qr(rng.normal(size=(2 ** k, 2 ** k)) + 1j * rng.normal(size=(2 ** k, 2 ** k)))[0]
+             for k in (2, 3)}
+    c = Circuit(N, fusion_width=fusion_width, dtype=dtype)
+    for _ in range(num_gates):
+        name = gates[rng.integers(len(gates))]
+        q = [int(q) for q in rng.choice(N, min(N, 3), replace=False)]
+        if name in dense:
+            c.add(dense[name], q[:int(name[-1])])
+        elif name == "CNOT":
+            c.cnot(q[0], q[1])
+        elif name == "SWAP":
+            c.add("SWAP", q[:2])
+        elif name == "TOFFOLI":
+            c.toffoli(*q)
+        else:
+            c.add(name, q[0])
+    return c
+
+
+@pytest.fixture
+def random_circuit():
+    """Return make_random_circuit, the circuit generator shared by the tests."""
+    return make_random_circuit
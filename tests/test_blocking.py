@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from epyr.cache import PrefixCache
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.parameters import Parameter
+from epyr.profiling import Profiler
+from epyr.state import State, MemmapState
+
+
+def layered_circuit(N, layers, dtype=np.complex128):
+    rng = np.random.default_rng(7)
+    c = Circuit(N, dtype=dtype)
+    for _ in range(layers):
+        for q in range(N):
+            c.add(np.linalg.qr(rng.normal(size=(2, 2)) + 1j * rng.normal(size=(2, 2)))[0], q)
+        for q in range(0, N - 1, 2):
+            c.cnot(q, q + 1)
+        c.t(int(rng.integers(N)))
+        c.cnot(N - 1, 0)
+    return c
+
+
+@pytest.mark.parametrize("block_qubits", [2, 4, 6, 12])
+def test_blocked_compute_matches(block_qubits):
+    c = layered_circuit(10, 4)
+    reference = State(10, dtype=np.complex128)
+    c.compute(reference)
+    blocked = c.block(block_qubits=block_qubits)
+    s = State(10, dtype=np.complex128)
+    blocked.run(s.state)
+    assert np.allclose(s.state, reference.state)
+
+    s = State(10, dtype=np.complex128)
+    blocked.run(s.state, enable_numba=False)
+    assert np.allclose(s.state, reference.state)
+
+
+def test_blocking_saves_passes():
+    c = layered_circuit(12, 6)
+    report = c.blocking_report(block_qubits=8)
+    assert report["gates"] == len(c.fused_gates)
+    assert report["passes"] < report["gates"] / 2 and report["swap_passes"] > 0
+    assert c.blocking_report(block_qubits=12)["passes"] == 1
+
+    reference = State(12, dtype=np.complex128)
+    c.compute(reference)
+    s = State(12, dtype=np.complex128)
+    c.compute(s, blocked=True)
+    assert np.allclose(s.state, reference.state)
+
+
+def test_blocked_parameterized_circuit():
+    theta = Parameter("theta")
+    c = layered_circuit(8, 2)
+    c.rx(7, theta)
+    c.cnot(7, 0)
+    for value in [0.3, 1.1]:
+        c.bind([value])
+        reference = State(8, dtype=np.complex128)
+        c.compute(reference)
+        s = State(8, dtype=np.complex128)
+        c.block(block_qubits=4).run(s.state)
+        assert np.allclose(s.state, reference.state)
+
+
+def test_blocked_incompatible_options_raise():
+    c = layered_circuit(4, 1)
+    for options in [dict(parallel=True), dict(vectorize=True), dict(profiler=Profiler()), dict(cache=PrefixCache())]:
+        with pytest.raises(EpyrException):
+            c.compute(State(4, dtype=np.complex128), blocked=True, **options)
+    with MemmapState(4, dtype=np.complex128) as mapped, pytest.raises(EpyrException):
+        c.compute(mapped, blocked=True)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from epyr.cache import PrefixCache
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.profiling import Profiler
+from epyr.state import State
+
+
+def circuit_with_suffix(prefix_length, suffix_angle):
+    """A circuit of PREFIX_LENGTH fixed gates, followed by a rotation by SUFFIX_ANGLE."""
+    rng = np.random.default_rng(0)
+    c = Circuit(5, dtype=np.complex128)
+    for _ in range(prefix_length):
+        control, target = (int(q) for q in rng.choice(5, 2, replace=False))
+        [c.h, c.t, c.s][rng.integers(3)](target)
+        c.cnot(control, target)
+    c.rx(0, suffix_angle)
+    return c
+
+
+def test_prefix_cache_resumes_from_shared_prefix():
+    cache = PrefixCache(checkpoint_interval=8)
+    for angle in [0.1, 0.2, 0.3]:
+        c = circuit_with_suffix(20, angle)
+        reference = State(5, dtype=np.complex128)
+        c.compute(reference)
+        s = State(5, dtype=np.complex128)
+        c.compute(s, cache=cache)
+        assert s == reference.state
+    assert cache.misses == 1 and cache.hits == 2
+    # The 41 gates share a prefix of 40, of which 40 are checkpointed.
+    assert cache.gates_skipped == 2 * 40
+
+    # A different input state does not hit the cache.
+    s = State.custom("00001", dtype=np.complex128)
+    circuit_with_suffix(20, 0.1).compute(s, cache=cache)
+    assert cache.misses == 2
+
+
+def test_memory_budget_and_spill(tmp_path):
+    state_bytes = State(5, dtype=np.complex128).state.nbytes
+    cache = PrefixCache(memory_budget=2 * state_bytes, checkpoint_interval=4, spill_directory=str(tmp_path))
+    c = circuit_with_suffix(10, 0.5)
+    c.compute(State(5, dtype=np.complex128), cache=cache)
+    assert cache.memory_bytes <= 2 * state_bytes
+    assert len(cache) == 6 and len(list(tmp_path.iterdir())) == 4
+
+    reference = State(5, dtype=np.complex128)
+    c.compute(reference)
+    s = State(5, dtype=np.complex128)
+    c.compute(s, cache=cache)
+    assert s == reference.state
+    cache.clear()
+    assert len(cache) == 0 and not list(tmp_path.iterdir())
+
+
+def test_incompatible_options_raise():
+    c = circuit_with_suffix(4, 0.1)
+    for options in [dict(parallel=True), dict(vectorize=True), dict(profiler=Profiler())]:
+        with pytest.raises(EpyrException):
+            c.compute(State(5, dtype=np.complex128), cache=PrefixCache(), **options)
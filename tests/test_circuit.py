@@ -1,6 +1,13 @@
+import gc
+import os
+import subprocess
+import sys
+
 import numpy as np
+import pytest
 
 from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
 from epyr.state import *
 
 # Define 1 / sqrt(2) for convenience
@@ -150,3 +157,314 @@ def test_very_very_entangled_states():
         expected *= INV2  # 1 / sqrt(2) [|00...00> + |11...11>]
         assert s == expected
 
+
+
+def test_vectorized_matches_loop_kernels():
+    c, _ = configure(4)
+    c.h(0)
+    c.y(3)
+    c.cnot(0, 2)
+    c.s(2)
+    c.cnot(1, 3)
+    s_loop, s_vec = State(4), State(4)
+    c.compute(s_loop, enable_numba=False)
+    c.compute(s_vec, vectorize=True)
+    assert s_vec == s_loop.state
+
+
+def test_vectorized_very_very_entangled_states():
+    for N in range(1, 20):
+        c, s = configure(N)
+        c.h(0)
+        for i in range(1, N):
+            c.cnot(0, i)
+
+        c.compute(s, vectorize=True)
+
+        expected = np.zeros(2 ** N)
+        expected[0], expected[2 ** N - 1] = 1, 1
+        expected *= INV2  # 1 / sqrt(2) [|00...00> + |11...11>]
+        assert s == expected
+
+
+def test_parallel_matches_vectorized():
+    for N in [1, 2, 3, 6, 14]:
+        c, _ = configure(N)
+        c.h(0)
+        for i in range(1, N):
+            c.cnot(0, i)
+            c.h(i)
+            c.s(i - 1)
+        s_vec, s_par = State(N), State(N)
+        c.compute(s_vec, vectorize=True)
+        c.compute(s_par, parallel=True, num_threads=1)
+        assert s_par == s_vec.state
+
+
+def test_gate_classification():
+    c, _ = configure(3)
+    c.z(0)
+    c.t(1)
+    c.x(2)
+    c.cnot(0, 1)
+    c.h(0)
+    controlled_h = np.eye(4, dtype=np.complex64)
+    controlled_h[np.ix_([1, 3], [1, 3])] = INV2 * np.array([[1, 1], [1, -1]])
+    c.add(controlled_h, [2, 0])
+    kinds = [kind for _, _, kind in c.gates]
+    assert kinds == ["diagonal", "diagonal", "permutation", "permutation", "dense", "controlled"]
+
+
+def test_specialized_kernels_match_vectorized():
+    controlled_h = np.eye(4, dtype=np.complex64)
+    controlled_h[np.ix_([1, 3], [1, 3])] = INV2 * np.array([[1, 1], [1, -1]])
+    c, _ = configure(4)
+    for i in range(4):
+        c.add(INV2 * np.array([[1, 1], [1, -1]], dtype=np.complex64), i)
+    c.z(1)
+    c.s(2)
+    c.t(3)
+    c.y(0)
+    c.add("SWAP", [0, 3])
+    c.cnot(3, 1)
+    c.add(controlled_h, [2, 0])
+    s_vec, s_specialized = State(4), State(4)
+    c.compute(s_vec, vectorize=True)
+    c.compute(s_specialized, enable_numba=False)
+    assert s_specialized == s_vec.state
+
+
+def test_compute_batch_matches_compute():
+    c, _ = configure(3)
+    c.h(0)
+    c.cnot(0, 2)
+    c.t(1)
+    c.y(2)
+    states = [State.custom(format(i, "03b")) for i in range(8)]
+    expected = []
+    for i in range(8):
+        s = State(3)
+        s.state = np.eye(8, dtype=np.complex64)[i]
+        c.compute(s, vectorize=True)
+        expected.append(s.state)
+
+    batch = c.compute_batch(states)
+    assert batch.shape == (8, 8)
+    for state, expected_vector in zip(states, expected):
+        assert state == expected_vector
+
+    array = np.eye(8, dtype=np.complex64)
+    c.compute_batch(array)
+    assert np.allclose(array, batch)
+
+
+def test_sample_bell_state():
+    c, s = configure(2)
+    c.h(0)
+    c.cnot(0, 1)
+    c.compute(s, vectorize=True)
+    counts = c.sample(s, 10000, seed=42)
+    assert set(counts) == {"|00>", "|11>"}
+    assert sum(counts.values()) == 10000
+    assert abs(counts["|00>"] - 5000) < 300
+    assert c.sample(s, 100, seed=1) == c.sample(s, 100, seed=1)
+
+
+def test_sample_subset_of_qubits():
+    c, s = configure(3)
+    c.x(2)
+    c.h(0)
+    c.compute(s, vectorize=True)
+    assert c.sample(s, 1000, seed=0, qubits=[2]) == {"|1>": 1000}
+    counts = c.sample(s, 1000, seed=0, qubits=[2, 1])
+    assert set(counts) == {"|01>"}
+    assert set(c.sample(s, 1000, seed=0, qubits=[0, 1])) == {"|00>", "|01>"}
+
+
+def test_measure_returns_possible_outcome():
+    c, s = configure(2)
+    c.h(0)
+    c.cnot(0, 1)
+    c.compute(s, vectorize=True)
+    assert c.measure(s) in (0, 3)
+
+
+def test_memmap_state_matches_in_memory_state(tmp_path):
+    c, s = configure(6)
+    for i in range(6):
+        c.h(i)
+        c.t(i)
+    c.cnot(0, 5)
+    c.cnot(4, 1)
+    c.add("SWAP", [2, 4])
+    c.y(5)
+    c.compute(s, vectorize=True)
+
+    mapped = MemmapState(6, path=tmp_path / "state.bin", chunk_size=4)
+    c.compute(mapped, enable_numba=False)
+    assert mapped == s.state
+    assert len(mapped.io_bytes) == len(c.fused_gates)
+    # Every gate reads and writes each chunk exactly once.
+    assert all(io_bytes == 2 * mapped.state.nbytes for io_bytes in mapped.io_bytes)
+    assert np.allclose(np.fromfile(tmp_path / "state.bin", dtype=np.complex64), s.state, atol=1e-5)
+
+
+def test_memmap_state_temporary_file_is_removed():
+    with MemmapState(4, chunk_size=4) as temporary:
+        path = temporary.path
+        assert os.path.exists(path)
+    assert not os.path.exists(path)
+
+    path = MemmapState(4).path
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_precision():
+    for dtype in [np.complex64, np.complex128]:
+        c = Circuit(2, dtype=dtype)
+        c.h(0)
+        c.t(0)
+        c.cnot(0, 1)
+        assert all(gate.dtype == dtype for gate, _, _ in c.gates)
+        s = State(2, dtype=dtype)
+        c.compute(s)
+        assert s.dtype == dtype
+        assert s == INV2 * np.array([1, 0, 0, np.exp(1j * np.pi / 4)])
+
+
+def test_precision_mismatch_raises():
+    c = Circuit(1, dtype=np.complex128)
+    c.h(0)
+    with pytest.raises(EpyrException):
+        c.compute(State(1))
+
+
+def test_import_does_not_import_numba():
+    code = "import sys; import epyr.circuit; assert 'numba' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_warm_up_compiles_kernels():
+    from epyr.circuit import warm_up, apply_one_qubit_gate_range, apply_permutation_gate_in_place
+    warm_up(parallel=False)
+    for kernel in [apply_one_qubit_gate_range, apply_permutation_gate_in_place]:
+        compiled_dtypes = {str(signature[0].dtype) for signature in kernel.signatures}
+        assert {"complex64", "complex128"} <= compiled_dtypes
+
+
+def test_compiled_circuit():
+    c = Circuit(4, fusion_width=3)
+    c.h(0)
+    c.cnot(0, 1)
+    c.t(1)
+    c.h(2)
+    c.cnot(2, 3)
+    c.cnot(1, 2)
+    c.z(3)
+    compiled = c.compile()
+    assert compiled is c.compile()
+    assert len(compiled) == len(c.fused_gates)
+    assert len(c.compile(fuse=False)) == len(c.gates)
+    assert list(c.compile(fuse=False).opcodes) == [0, 2, 1, 0, 2, 2, 1]
+
+    s_compiled, s_vec = State(4), State(4)
+    c.compute(s_compiled)
+    c.compute(s_vec, vectorize=True, fuse=False)
+    assert s_compiled == s_vec.state
+
+    c.x(0)
+    assert c.compile() is not compiled
+
+
+def test_toffoli():
+    for controls, expected_index in [("011", 0b111), ("010", 0b010), ("101", 0b101)]:
+        # Qubits 0 and 1 are the controls, qubit 2 the target (bit strings are written MSB first).
+        c = Circuit(3)
+        c.toffoli(0, 1, 2)
+        s = State.custom(controls)
+        c.compute(s)
+        expected = np.zeros(8)
+        expected[expected_index] = 1
+        assert s == expected
+
+
+def test_unordered_dense_gates_in_every_mode():
+    rng = np.random.default_rng(7)
+    dense3 = np.linalg.qr(rng.normal(size=(8, 8)) + 1j * rng.normal(size=(8, 8)))[0]
+    dense2 = np.linalg.qr(rng.normal(size=(4, 4)) + 1j * rng.normal(size=(4, 4)))[0]
+    c, _ = configure(5)
+    c.h(4)
+    c.add(dense3, [4, 0, 2])
+    c.add(dense2, [3, 1])
+    c.toffoli(4, 2, 1)
+    reference = State(5)
+    c.compute(reference, vectorize=True, fuse=False)
+    for options in [dict(), dict(fuse=False), dict(enable_numba=False, fuse=False),
+                    dict(parallel=True, fuse=False)]:
+        s = State(5)
+        c.compute(s, **options)
+        assert s == reference.state
+
+
+def test_invalid_indices_raise():
+    c = Circuit(3)
+    with pytest.raises(EpyrException):
+        c.add("CNOT", [1, 1])
+    with pytest.raises(EpyrException):
+        c.add("CNOT", [0, 3])
+    with pytest.raises(EpyrException):
+        c.add("H", [0, 1])
+
+
+def test_sparse_state_matches_dense():
+    rng = np.random.default_rng(11)
+    dense3 = np.linalg.qr(rng.normal(size=(8, 8)) + 1j * rng.normal(size=(8, 8)))[0]
+    c, _ = configure(5)
+    c.x(1)
+    c.cnot(1, 3)
+    c.toffoli(1, 3, 0)
+    c.t(0)
+    c.h(4)
+    c.add(dense3, [4, 0, 2])
+    reference = State(5)
+    c.compute(reference)
+    for threshold in [1.0, 1 / 16]:
+        s = SparseState(5, threshold=threshold)
+        c.compute(s)
+        assert s.dense == (threshold < 1)
+        assert s == reference.state
+
+
+def test_sparse_state_on_many_qubits():
+    N = 48
+    c = Circuit(N)
+    c.h(0)
+    for q in range(N - 1):
+        c.cnot(q, q + 1)
+    c.x(3)
+    s = SparseState(N)
+    c.compute(s)
+    assert not s.dense
+    assert s.indices.tolist() == [1 << 3, (1 << N) - 1 - (1 << 3)]
+    assert np.allclose(np.abs(s.amplitudes) ** 2, 0.5)
+    counts = c.sample(s, 1000, seed=3, qubits=[0, N - 1])
+    assert set(counts) == {"|00>", "|11>"} and sum(counts.values()) == 1000
+
+
+def test_options_ignored_by_a_backend_raise():
+    from epyr.mps import MPSState
+    from epyr.profiling import Profiler
+    from epyr.stabilizer import StabilizerState
+
+    c = Circuit(2)
+    c.h(0)
+    c.cnot(0, 1)
+    with MemmapState(2) as mapped:
+        for state in [StabilizerState(2), SparseState(2), DensityMatrix(2), MPSState(2), mapped]:
+            for options in [dict(vectorize=True), dict(parallel=True), dict(num_threads=2)]:
+                with pytest.raises(EpyrException):
+                    c.compute(state, **options)
+        c.compute(mapped, profiler=Profiler())
+    with pytest.raises(EpyrException):
+        c.compute(SparseState(2), profiler=Profiler())
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from epyr.distributed import DistributedState
+from epyr.epyr_exception import EpyrException
+from epyr.state import State
+
+
+@pytest.mark.parametrize("num_ranks", [2, 4])
+def test_distributed_state_matches_state(num_ranks, random_circuit):
+    N = 6
+    c = random_circuit(N, 30, seed=num_ranks)
+    reference = State(N, dtype=np.complex128)
+    c.compute(reference)
+    with DistributedState(N, num_ranks=num_ranks, dtype=np.complex128) as s:
+        c.compute(s)
+        assert s.exchanges > 0
+        assert s == reference.state
+        # A second computation starts from the remapped layout.
+        c.compute(s, fuse=False)
+        c.compute(reference, fuse=False)
+        assert s == reference.state
+
+
+def test_distributed_state_initialization():
+    with DistributedState.custom("0101", num_ranks=2) as s:
+        assert np.flatnonzero(s.state).tolist() == [0b0101]
+    with pytest.raises(EpyrException):
+        DistributedState(3, num_ranks=3)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from epyr.circuit import Circuit
+from epyr.state import State
+
+
+def test_single_qubit_runs_are_fused():
+    c = Circuit(2, fusion_width=1)
+    c.h(0)
+    c.s(0)
+    c.h(0)
+    c.x(1)
+    c.cnot(0, 1)
+    c.z(1)
+    assert c.fusion_report() == {"gates": 6, "fused_gates": 4, "sweeps_saved": 2}
+
+
+def test_single_qubit_gates_are_absorbed_into_two_qubit_gates():
+    c = Circuit(2)
+    c.h(0)
+    c.x(1)
+    c.cnot(0, 1)
+    c.z(1)
+    assert c.fusion_report()["fused_gates"] == 1
+    s_fused, s_unfused = State(2), State(2)
+    c.compute(s_fused, vectorize=True)
+    c.compute(s_unfused, vectorize=True, fuse=False)
+    assert s_fused == s_unfused.state
+
+
+def test_fused_circuits_match_unfused(random_circuit):
+    for width in range(1, 6):
+        c = random_circuit(6, 40, seed=width, gates=("X", "Y", "Z", "H", "S", "T", "CNOT", "CNOT"),
+                           dtype=np.complex64, fusion_width=width)
+        s_fused, s_unfused = State(6), State(6)
+        c.compute(s_fused, enable_numba=False)
+        c.compute(s_unfused, vectorize=True, fuse=False)
+        assert s_fused == s_unfused.state
+        assert len(c.fused_gates) <= len(c.gates)
+
+
+def test_fusion_is_recomputed_when_gates_change():
+    c = Circuit(1)
+    c.h(0)
+    c.h(0)
+    assert len(c.fused_gates) == 1
+    c.reset()
+    assert c.fused_gates == []
@@ -0,0 +1,51 @@
+import numpy as np
+
+from epyr.circuit import Circuit
+from epyr.mps import MPSState
+from epyr.state import State
+
+
+def test_mps_matches_state(random_circuit):
+    N = 6
+    c = random_circuit(N, 40, seed=4)
+    reference = State(N, dtype=np.complex128)
+    c.compute(reference)
+    for fuse in [True, False]:
+        m = MPSState(N, dtype=np.complex128)
+        c.compute(m, fuse=fuse)
+        assert m == reference.state
+        assert m.truncation_error < 1e-12
+        assert np.isclose(m.amplitude(5), reference.state[5])
+        assert np.isclose(m.amplitude("100001"), reference.state[0b100001])
+    assert MPSState.from_vector(reference.state, dtype=np.complex128) == reference.state
+
+
+def test_truncation_respects_bond_dimension(random_circuit):
+    N = 8
+    c = random_circuit(N, 40, seed=5)
+    reference = State(N, dtype=np.complex128)
+    c.compute(reference)
+    m = MPSState(N, dtype=np.complex128, max_bond=4)
+    c.compute(m)
+    assert max(m.bond_dimensions) <= 4
+    assert m.truncation_error > 0
+    fidelity = abs(np.vdot(reference.state, m.state)) ** 2
+    assert fidelity < 1
+    assert np.isclose(np.linalg.norm(m.state), 1)
+
+
+def test_sampling_many_qubits():
+    N = 80
+    c = Circuit(N)
+    for q in range(N):
+        c.h(q)
+    for q in range(0, N - 1, 2):
+        c.cnot(q, q + 1)
+        c.t(q + 1)
+    c.cnot(0, N - 1)
+    m = MPSState(N, max_bond=16)
+    c.compute(m)
+    assert max(m.bond_dimensions) <= 4
+    counts = c.sample(m, 500, seed=1, qubits=[0, 1, 2])
+    assert sum(counts.values()) == 500 and len(counts) == 8
+    assert np.isclose(abs(m.amplitude(0)) ** 2, 2.0 ** -N, rtol=1e-3)
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.noise import KrausChannel, ReadoutError, amplitude_damping, depolarizing
+from epyr.state import DensityMatrix, State
+
+
+def noisy_circuit():
+    c = Circuit(3, dtype=np.complex128)
+    c.h(0)
+    c.add_noise(depolarizing(0.2))
+    c.cnot(2, 0)
+    c.cnot(0, 2)
+    c.add_noise(amplitude_damping(0.3), 2)
+    c.toffoli(0, 2, 1)
+    c.add_noise(depolarizing(0.1), [1])
+    return c
+
+
+def reference_density_matrix(c):
+    """Compute the density matrix of C with dense 2^N x 2^N matrices."""
+    def embed(gate, indices):
+        columns = np.eye(2 ** c.N, dtype=np.complex128)
+        for column in columns:
+            s = State(c.N, dtype=np.complex128)
+            s.state[:] = column
+            c_gate = Circuit(c.N, dtype=np.complex128)
+            c_gate.add(gate, list(indices))
+            c_gate.compute(s, fuse=False)
+            column[:] = s.state
+        return columns.T
+
+    rho = np.zeros((2 ** c.N, 2 ** c.N), dtype=np.complex128)
+    rho[0, 0] = 1
+    for position, (gate, indices, _) in enumerate(c.gates):
+        U = embed(gate, indices)
+        rho = U @ rho @ U.conj().T
+        for channel, channel_indices in c.noise.get(position, ()):
+            kraus = [embed(operator, channel_indices) for operator in channel.operators]
+            rho = sum(K @ rho @ K.conj().T for K in kraus)
+    return rho
+
+
+def test_density_matrix_matches_reference():
+    c = noisy_circuit()
+    rho = DensityMatrix(3, dtype=np.complex128)
+    c.compute(rho)
+    assert np.allclose(rho.matrix, reference_density_matrix(c))
+    assert np.isclose(np.trace(rho.matrix), 1)
+    assert rho.purity() < 1
+
+
+def test_noiseless_density_matrix_is_pure():
+    c = Circuit(2)
+    c.h(0)
+    c.cnot(0, 1)
+    rho = DensityMatrix(2)
+    c.compute(rho)
+    assert np.allclose(rho.matrix, np.outer(State.common("phi_plus").state, State.common("phi_plus").state))
+    assert np.isclose(rho.purity(), 1)
+
+
+def test_trajectories_estimate_the_density_matrix():
+    c = noisy_circuit()
+    rho = DensityMatrix(3, dtype=np.complex128)
+    c.compute(rho)
+    probabilities = c.trajectory_probabilities(2000, seed=1)
+    assert np.allclose(probabilities, rho.probabilities(), atol=0.03)
+    counts = c.sample_trajectories(200, seed=2, processes=2)
+    assert sum(counts.values()) == 200
+
+
+class FixedRandom:
+    """A stand-in for a random generator, whose random() always returns VALUE."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+def test_trajectory_applies_the_chosen_kraus_operator():
+    c = Circuit(1, dtype=np.complex128)
+    c.h(0)
+    c.add_noise(amplitude_damping(0.36))
+    # A threshold of 0.9 picks the decay K1, of probability 0.18, after K0, of probability 0.82.
+    state = State(1, dtype=np.complex128)
+    c.compute_trajectory(state, FixedRandom(0.9))
+    assert np.allclose(state.state, [1, 0])
+    state = State(1, dtype=np.complex128)
+    c.compute_trajectory(state, FixedRandom(0.5))
+    assert np.allclose(state.state, np.array([1, 0.8]) / np.sqrt(1.64))
+
+    # A threshold above the total, as left by rounding, keeps the last operator of nonzero probability, here K0, which
+    # is followed by K1, of probability 0 on |0>.
+    c = Circuit(1, dtype=np.complex128)
+    c.x(0)
+    c.x(0)
+    c.add_noise(amplitude_damping(0.36))
+    state = State(1, dtype=np.complex128)
+    c.compute_trajectory(state, FixedRandom(1.0))
+    assert np.allclose(state.state, [1, 0])
+
+
+def test_readout_error():
+    c = Circuit(2)
+    c.x(0)
+    c.readout_error = ReadoutError(0, 1)
+    assert c.sample(State(2), 100, seed=0) == {"|00>": 100}
+    c.readout_error = ReadoutError(1, 0)
+    assert c.sample(State(2), 100, seed=0) == {"|11>": 100}
+
+
+def test_invalid_channels():
+    with pytest.raises(EpyrException):
+        KrausChannel([np.eye(2), np.eye(2)])
+    c = Circuit(2)
+    with pytest.raises(EpyrException):
+        c.add_noise(depolarizing(0.1))
+    c.cnot(0, 1)
+    with pytest.raises(EpyrException):
+        c.add_noise(depolarizing(0.1))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.observables import PauliString, PauliSum
+from epyr.operators import operator_dict
+from epyr.state import DensityMatrix, SparseState, State
+
+
+def dense_pauli(letters):
+    matrix = np.eye(1)
+    for letter in letters:
+        matrix = np.kron(matrix, operator_dict[letter])
+    return matrix
+
+
+def random_state_circuit(N, seed):
+    rng = np.random.default_rng(seed)
+    c = Circuit(N, dtype=np.complex128)
+    for _ in range(30):
+        control, target = (int(q) for q in rng.choice(N, 2, replace=False))
+        [c.h, c.t, c.s, c.y][rng.integers(4)](target)
+        if rng.random() < 0.5:
+            c.cnot(control, target)
+    return c
+
+
+def test_expectation_matches_dense_operators():
+    N = 4
+    rng = np.random.default_rng(3)
+    c = random_state_circuit(N, 3)
+    strings = ["".join(rng.choice(list("IXYZ"), N)) for _ in range(12)] + ["ZZII", "ZIZI", "XXII"]
+    coefficients = rng.normal(size=len(strings))
+    observable = PauliSum(list(zip(coefficients, strings)))
+    s = State(N, dtype=np.complex128)
+    c.compute(s)
+    expected = sum(coefficient * np.vdot(s.state, dense_pauli(letters) @ s.state)
+                   for coefficient, letters in zip(coefficients, strings))
+    assert np.isclose(s.expectation(observable), expected.real)
+    assert np.isclose(s.expectation(observable, parallel=True), expected.real)
+    assert np.isclose(s.expectation(observable, enable_numba=False), expected.real)
+
+    sparse = SparseState(N, dtype=np.complex128, threshold=1.0)
+    c.compute(sparse)
+    assert np.isclose(sparse.expectation(observable), expected.real)
+    rho = DensityMatrix(N, dtype=np.complex128)
+    c.compute(rho)
+    assert np.isclose(rho.expectation(observable), expected.real)
+
+
+def test_terms_are_grouped_by_flipped_qubits():
+    observable = PauliSum([(1, "ZZ"), (2, "IZ"), (1, "XX"), (1, "YY"), (0.5, {0: "X"})])
+    groups = observable.groups()
+    assert sorted(groups) == [0, 1, 3]
+    assert len(groups[0][0]) == 2 and len(groups[3][0]) == 2
+
+
+def test_bell_state_correlations():
+    s = State.common("phi_plus")
+    assert np.isclose(s.expectation("ZZ"), 1)
+    assert np.isclose(s.expectation("XX"), 1)
+    assert np.isclose(s.expectation("YY"), -1)
+    assert np.isclose(s.expectation(PauliString({0: "Z"})), 0)
+    with pytest.raises(EpyrException):
+        s.expectation("ZZZ")
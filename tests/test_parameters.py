@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.observables import PauliSum
+from epyr.parameters import Parameter
+from epyr.state import State
+
+N = 4
+OBSERVABLE = PauliSum([(1.0, {q: "Z", q + 1: "Z"}) for q in range(N - 1)] + [(0.5, "XIIX")])
+
+
+def qaoa_circuit(gamma, beta):
+    """A QAOA-like circuit, with the angles GAMMA and BETA given as numbers or parameters."""
+    c = Circuit(N, dtype=np.complex128)
+    for q in range(N):
+        c.h(q)
+    for q in range(N - 1):
+        c.cnot(q, q + 1)
+        c.rz(q + 1, 2 * gamma)
+        c.cnot(q, q + 1)
+    for q in range(N):
+        c.rx(q, beta)
+        c.ry(q, 0.5 * beta)
+        c.phase(q, gamma)
+    return c
+
+
+def reference_expectation(gamma, beta):
+    s = State(N, dtype=np.complex128)
+    qaoa_circuit(gamma, beta).compute(s)
+    return s.expectation(OBSERVABLE)
+
+
+def test_binding_matches_concrete_angles():
+    gamma, beta = Parameter("gamma"), Parameter("beta")
+    c = qaoa_circuit(gamma, beta)
+    assert c.parameters == [gamma, beta]
+    compiled = c.compile()
+    for values in [(0.3, 1.2), (0, 0), (2.5, -0.7)]:
+        c.bind(values)
+        assert c.compile() is compiled
+        for options in [dict(), dict(fuse=False), dict(enable_numba=False), dict(vectorize=True)]:
+            s = State(N, dtype=np.complex128)
+            c.compute(s, **options)
+            assert np.isclose(s.expectation(OBSERVABLE), reference_expectation(*values))
+    c.bind({"gamma": 0.1, beta: 0.2})
+    s = State(N, dtype=np.complex128)
+    c.compute(s)
+    assert np.isclose(s.expectation(OBSERVABLE), reference_expectation(0.1, 0.2))
+
+
+def test_sweep():
+    c = qaoa_circuit(Parameter("gamma"), Parameter("beta"))
+    values = np.random.default_rng(1).uniform(0, np.pi, size=(6, 2))
+    expected = [reference_expectation(*row) for row in values]
+    assert np.allclose(c.sweep(values, observable=OBSERVABLE), expected)
+    assert np.allclose(c.sweep(values, observable=OBSERVABLE, processes=2), expected)
+    states = c.sweep(values[:2])
+    assert states.shape == (2, 2 ** N)
+
+
+def test_unbound_parameters_raise():
+    c = Circuit(1)
+    c.rx(0, Parameter("theta"))
+    with pytest.raises(EpyrException):
+        c.compute(State(1))
+    with pytest.raises(EpyrException):
+        c.bind([1, 2])
+    v = np.array([1, 0], dtype=np.complex64)
+    with pytest.raises(EpyrException):
+        c.U.H @ v
+    with pytest.raises(EpyrException):
+        c.U.rmatvec(v)
+    c.bind([np.pi])
+    assert np.allclose(c.U.H @ v, [0, 1j], atol=1e-6)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from epyr.circuit import Circuit
+from epyr.profiling import Profiler
+from epyr.state import State
+
+
+def test_profiler_records_every_gate():
+    c = Circuit(3)
+    c.h(0)
+    c.cnot(0, 1)
+    c.z(2)
+    received = []
+    profiler = Profiler(callback=received.append)
+    s = State(3)
+    c.compute(s, fuse=False, profiler=profiler)
+
+    assert [record["kind"] for record in profiler.records] == ["dense", "permutation", "diagonal"]
+    assert [record["qubits"] for record in profiler.records] == [[0], [0, 1], [2]]
+    assert received == profiler.records
+    assert all(record["seconds"] >= 0 for record in profiler.records)
+    # A dense gate touches the whole vector twice, a CNOT and a Z only half of it.
+    assert [record["bytes"] for record in profiler.records] == [2 * s.state.nbytes, s.state.nbytes, s.state.nbytes]
+
+
+def test_profiler_report():
+    c = Circuit(2)
+    c.h(0)
+    c.h(1)
+    c.cnot(0, 1)
+    profiler = Profiler()
+    c.compute(State(2), fuse=False, profiler=profiler)
+    c.compute(State(2), vectorize=True, fuse=False, profiler=profiler)
+    report = profiler.report()
+    assert report["gates"] == 6
+    assert report["kinds"]["dense"]["gates"] == 4
+    assert report["kinds"]["permutation"]["gates"] == 2
+    assert np.isclose(report["seconds"], sum(record["seconds"] for record in report["records"]))
+    profiler.reset()
+    assert profiler.report()["gates"] == 0
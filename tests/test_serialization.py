@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.noise import ReadoutError
+from epyr.parameters import Parameter
+from epyr.serialization import save_state, load_state, save_circuit, load_circuit, ALIGNMENT, STATE_HEADER
+from epyr.state import State, MemmapState
+
+
+@pytest.mark.parametrize("dtype", [np.complex64, np.complex128])
+def test_state_round_trip(tmp_path, dtype, random_circuit):
+    state = State(6, dtype=dtype)
+    random_circuit(6, 60, seed=3, dtype=dtype).compute(state)
+    path = str(tmp_path / "state.bin")
+    save_state(state, path, chunk_size=8)
+
+    loaded = load_state(path)
+    assert isinstance(loaded, MemmapState) and loaded.dtype == dtype
+    assert loaded.state.offset % ALIGNMENT == 0 and loaded.state.offset >= STATE_HEADER.size
+    assert np.array_equal(loaded.state, state.state)
+    copied = load_state(path, mode=None)
+    assert type(copied) is State and np.array_equal(copied.state, state.state)
+
+    # A state opened with mode "r+" is computed in place, in its file.
+    writable = load_state(path, mode="r+", chunk_size=16)
+    c = Circuit(6, dtype=dtype)
+    c.h(5)
+    c.compute(writable)
+    c.compute(state)
+    writable.state.flush()
+    assert np.allclose(load_state(path).state, state.state)
+
+
+def test_circuit_round_trip(tmp_path, random_circuit):
+    c = random_circuit(5, 60, seed=3, gates=("H", "T", "X", "CNOT", "DENSE2"), dtype=np.complex64, fusion_width=3)
+    path = str(tmp_path / "circuit.bin")
+    save_circuit(c, path)
+    loaded = load_circuit(path)
+    assert loaded.N == 5 and loaded.dtype == c.dtype and loaded.fusion_width == 3
+    assert len(loaded.gates) == len(c.gates)
+    for (gate, indices, kind), (original, original_indices, original_kind) in zip(loaded.gates, c.gates):
+        assert np.array_equal(gate, original) and list(indices) == list(original_indices) and kind == original_kind
+    # The 60 gates share a handful of distinct matrices, which are stored once.
+    assert len({id(gate) for gate, _, _ in loaded.gates}) <= 8
+
+    s, reference = State(5), State(5)
+    loaded.compute(s)
+    c.compute(reference)
+    assert s == reference.state
+
+
+def test_circuit_round_trip_keeps_the_readout_error(tmp_path):
+    c = Circuit(2)
+    c.h(0)
+    path = str(tmp_path / "circuit.bin")
+    save_circuit(c, path)
+    assert load_circuit(path).readout_error is None
+
+    c.readout_error = ReadoutError(0.1, 0.25)
+    save_circuit(c, path)
+    readout = load_circuit(path).readout_error
+    assert (readout.p01, readout.p10) == (0.1, 0.25)
+
+
+def test_invalid_files(tmp_path):
+    theta = Parameter("theta")
+    c = Circuit(2)
+    c.rx(0, theta)
+    with pytest.raises(EpyrException):
+        save_circuit(c, str(tmp_path / "unbound.bin"))
+
+    path = tmp_path / "state.bin"
+    save_state(State(2), str(path))
+    data = bytearray(path.read_bytes())
+    data[8] = 99
+    path.write_bytes(bytes(data))
+    with pytest.raises(EpyrException, match="version"):
+        load_state(str(path))
+    with pytest.raises(EpyrException):
+        load_circuit(str(path))
@@ -0,0 +1,135 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+from epyr.state import State
+from epyr.simulator import Simulator
+from epyr.stabilizer import StabilizerState
+
+
+def rotation_circuit(N, theta):
+    c = Circuit(N, dtype=np.complex128)
+    for q in range(N):
+        c.h(q)
+        c.ry(q, theta * (q + 1))
+    for q in range(N - 1):
+        c.cnot(q, q + 1)
+    return c
+
+
+def test_submit_batches_compatible_jobs():
+    async def run():
+        async with Simulator(processes=2, batch_window=0.05) as simulator:
+            circuit = rotation_circuit(4, 0.3)
+            states = [State.custom(format(i, "04b"), dtype=np.complex128) for i in range(8)]
+            results = await asyncio.gather(*[simulator.submit(circuit, state) for state in states],
+                                           simulator.submit(rotation_circuit(3, 0.1), shots=100, seed=1),
+                                           simulator.submit(Circuit(3), shots=10))
+            return results, simulator.metrics
+
+    results, metrics = asyncio.run(run())
+    for i, result in enumerate(results[:8]):
+        reference = State.custom(format(i, "04b"), dtype=np.complex128)
+        rotation_circuit(4, 0.3).compute(reference)
+        assert result == reference.state
+    assert sum(results[8].values()) == 100
+    assert results[9] == {"|000>": 10}
+    assert metrics["completed"] == 10 and metrics["queue_depth"] == 0
+    # The 8 jobs of the same circuit form one batch; the empty circuit is a Clifford circuit, which runs on its own.
+    assert metrics["batches"] == 3
+    assert metrics["mean_latency"] > 0
+
+
+def test_timeout_and_backpressure():
+    async def run():
+        async with Simulator(processes=1, max_pending=2) as simulator:
+            slow = [asyncio.create_task(simulator.submit(rotation_circuit(16, 0.2))) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            # Two jobs hold the slots, while the third waits for one (the pool is still starting).
+            assert simulator.pending == 2 and not any(task.done() for task in slow)
+            with pytest.raises(asyncio.TimeoutError):
+                await simulator.submit(rotation_circuit(4, 0.1), timeout=0.05)
+            assert simulator.pending == 2
+            results = await asyncio.gather(*slow)
+            return results, simulator.metrics
+
+    results, metrics = asyncio.run(run())
+    assert all(isinstance(result, State) for result in results)
+    assert metrics["timed_out"] == 1 and metrics["completed"] == 3 and metrics["pending"] == 0
+
+
+class CrashingState(State):
+    """A state which kills the worker process unpickling it."""
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def test_broken_pool_fails_jobs_and_recovers():
+    async def run():
+        async with Simulator(processes=1) as simulator:
+            with pytest.raises(BrokenProcessPool):
+                await simulator.submit(rotation_circuit(2, 0.1), CrashingState(2))
+            return await simulator.submit(rotation_circuit(2, 0.1), shots=10), simulator.metrics
+
+    counts, metrics = asyncio.run(run())
+    assert sum(counts.values()) == 10 and metrics["failed"] == 1
+
+
+def test_jobs_snapshot_their_states():
+    async def run():
+        async with Simulator(processes=1) as simulator:
+            state = State(2, dtype=np.complex128)
+            task = asyncio.ensure_future(simulator.submit(Circuit(2, dtype=np.complex128), state))
+            await asyncio.sleep(0)
+            state.state[:] = [0, 0, 0, 1]
+            return await task
+
+    assert asyncio.run(run()) == np.array([1, 0, 0, 0])
+
+
+def test_clifford_jobs_run_on_stabilizer_states():
+    async def run():
+        async with Simulator(processes=1) as simulator:
+            c = Circuit(40)
+            c.h(0)
+            for q in range(39):
+                c.cnot(q, q + 1)
+            return await simulator.submit(c)
+
+    assert isinstance(asyncio.run(run()), StabilizerState)
+
+
+def test_jobs_snapshot_their_circuits():
+    from epyr.noise import ReadoutError
+    from epyr.parameters import Parameter
+
+    async def run():
+        async with Simulator(processes=1, batch_window=0.05) as simulator:
+            a = rotation_circuit(2, 0.4)
+            b = rotation_circuit(2, 0.4)
+            b.readout_error = ReadoutError(1.0)
+            counts = await asyncio.gather(simulator.submit(a, shots=1000, seed=1),
+                                          simulator.submit(b, shots=1000, seed=1))
+
+            theta = Parameter("theta")
+            c = Circuit(1, dtype=np.complex128)
+            c.rx(0, theta)
+            c.bind([np.pi])
+            # The circuit is snapshot as soon as the task starts, before the job is dispatched.
+            flipped = asyncio.ensure_future(simulator.submit(c, shots=10))
+            await asyncio.sleep(0)
+            c.bind([0.0])
+            unchanged = asyncio.ensure_future(simulator.submit(c, shots=10))
+            return counts, await asyncio.gather(flipped, unchanged), simulator.metrics
+
+    (a, b), (flipped, unchanged), metrics = asyncio.run(run())
+    # Every bit is flipped by the readout error of b.
+    flip = {"|00>": "|11>", "|01>": "|10>", "|10>": "|01>", "|11>": "|00>"}
+    assert b == {flip[outcome]: count for outcome, count in a.items()}
+    assert flipped == {"|1>": 10} and unchanged == {"|0>": 10}
+    assert metrics["throughput"] > 0
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from epyr.circuit import Circuit
+from epyr.epyr_exception import EpyrException
+from epyr.stabilizer import StabilizerState
+from epyr.state import State
+
+
+def test_tableau_matches_state_vector(random_circuit):
+    rng = np.random.default_rng(5)
+    for _ in range(50):
+        c = random_circuit(4, 20, seed=rng, gates=("H", "S", "X", "Y", "Z", "CNOT", "SWAP"))
+        assert c.is_clifford
+        s = c.initial_state()
+        assert isinstance(s, StabilizerState)
+        c.compute(s)
+        reference = State(4, dtype=np.complex128)
+        c.compute(reference)
+        assert np.allclose(s.probabilities(), reference.probabilities())
+
+
+def test_non_clifford_circuits():
+    c = Circuit(2)
+    c.h(0)
+    c.t(0)
+    assert not c.is_clifford
+    assert isinstance(c.initial_state(), State)
+    with pytest.raises(EpyrException):
+        c.compute(StabilizerState(2))
+
+
+def test_sampling_thousands_of_qubits():
+    N = 1000
+    c = Circuit(N)
+    c.h(0)
+    for q in range(N - 1):
+        c.cnot(q, q + 1)
+    c.x(N - 1)
+    counts = c.sample(None, 500, seed=2, qubits=[0, 500, N - 1])
+    assert set(counts) == {"|100>", "|011>"}
+    assert sum(counts.values()) == 500
+    assert c.measure() in {1 << (N - 1), (1 << (N - 1)) - 1}
+
+
+def test_custom_stabilizer_state():
+    c = Circuit(3)
+    c.cnot(0, 2)
+    s = StabilizerState.custom("001")
+    c.compute(s)
+    assert c.sample(s, 10) == {"|101>": 10}
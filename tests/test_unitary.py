@@ -0,0 +1,53 @@
+import numpy as np
+
+from epyr.circuit import Circuit
+from epyr.state import State
+
+# Define 1 / sqrt(2) for convenience
+INV2 = 1 / np.sqrt(2)
+
+
+def bell_circuit():
+    c = Circuit(2)
+    c.h(0)
+    c.cnot(0, 1)
+    return c
+
+
+def test_bell_circuit_unitary():
+    # Columns are the images of |00>, |01>, |10>, |11> (qubit 0 being the LSB).
+    expected = INV2 * np.array([
+        [1, 1, 0, 0],
+        [0, 0, 1, -1],
+        [0, 0, 1, 1],
+        [1, -1, 0, 0],
+    ])
+    assert np.allclose(bell_circuit().unitary(), expected)
+
+
+def test_unitary_blocks_and_processes():
+    c = Circuit(4)
+    for i in range(4):
+        c.h(i)
+        c.t(i)
+    for i in range(3):
+        c.cnot(i, i + 1)
+    U = c.unitary()
+    assert np.allclose(U.conj().T @ U, np.eye(16), atol=1e-6)
+    assert np.allclose(c.unitary(block_size=3), U)
+    assert np.allclose(c.unitary(block_size=4, processes=2), U)
+
+
+def test_lazy_operator():
+    c = bell_circuit()
+    U = c.unitary()
+    v = np.arange(4) + 1j * np.arange(4)[::-1]
+    assert c.U.shape == (4, 4)
+    assert np.allclose(c.U @ v, U @ v)
+    assert np.allclose(c.U.rmatvec(v), U.conj().T @ v)
+    assert np.allclose(c.U.H @ (c.U @ v), v)
+    assert np.allclose(c.U.matmat(np.eye(4)), U)
+
+    s = State(2)
+    c.compute(s, vectorize=True)
+    assert s == c.U.matvec(State(2).state)